@@ -0,0 +1,96 @@
+"""Checks that joining record batches by date gives the same rows as pandas merge."""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROWS = 10000
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def make_frames(
+    rows: int, chunk_size: int, seed: int
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Trend rows and volume rows with gaps: the first two and a half chunks and
+    random rows of volume are missing.
+
+    Args:
+        rows {int}: Number of trend rows.
+        chunk_size {int}: Rows of record batch.
+        seed {int}: Seed of generator.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: Trend and volume results.
+    """
+    generator = np.random.default_rng(seed)
+    dates = pd.date_range("2020-01-01", periods=rows, freq="min")
+    data_trend = pd.DataFrame(
+        {
+            "date": dates,
+            "close": generator.normal(0, 1, rows).cumsum(),
+            "trend": pd.Categorical(generator.choice(["rise", "fall", "flat"], rows)),
+        }
+    )
+    kept = generator.random(rows) < 0.9
+    kept[: int(chunk_size * 2.5)] = False
+    data_volume = pd.DataFrame(
+        {"date": dates[kept], "volume_anomaly": generator.random(kept.sum()) < 0.1}
+    )
+    return data_trend, data_volume
+
+
+def check_concat(
+    rows: int = DEFAULT_ROWS, chunk_size: int = DEFAULT_CHUNK_SIZE, seed: int = 0
+) -> bool:
+    """
+    Join batches, write them to one file and compare with pandas merge.
+
+    Args:
+        rows {int}: Number of trend rows.
+        chunk_size {int}: Rows of record batch.
+        seed {int}: Seed of generator.
+
+    Returns:
+        bool: Joined rows are the same.
+    """
+    sys.path.append(PROJECT_PATH)
+    from src.models.concat import join_batches, joined_schema, make_source
+
+    data_trend, data_volume = make_frames(rows, chunk_size, seed)
+    table = pa.Table.from_pandas(data_trend, preserve_index=False)
+    sources = [
+        make_source(
+            data_volume["date"].to_numpy(),
+            {"volume_anomaly": data_volume["volume_anomaly"].to_numpy()},
+        )
+    ]
+    schema = joined_schema(table.schema.remove_metadata(), sources)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, schema) as writer:
+        for batch in join_batches(table.to_batches(chunk_size), sources, schema):
+            writer.write_batch(batch)
+    joined = pa.ipc.open_file(sink.getvalue()).read_pandas()
+
+    expected = data_trend.merge(data_volume, on="date", how="left")
+    for data in (joined, expected):
+        data["volume_anomaly"] = data["volume_anomaly"].astype("boolean")
+    return joined.equals(expected)
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--rows", dest="rows", type=int, default=DEFAULT_ROWS)
+    args_parser.add_argument(
+        "--chunk-size", dest="chunk_size", type=int, default=DEFAULT_CHUNK_SIZE
+    )
+    args_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args = args_parser.parse_args()
+    same = check_concat(args.rows, args.chunk_size, args.seed)
+    print(f"Joined rows are {'the same' if same else 'different'}")
+    sys.exit(0 if same else 1)
@@ -0,0 +1,237 @@
+"""Checks that compiled kernels give the same output as NumPy ones and times both."""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ROWS = 1000000
+DEFAULT_CASES = 200
+
+
+def same(first, second) -> bool:
+    """
+    Outputs of kernels are equal, NaN are equal to each other.
+
+    Args:
+        first: Array or tuple of arrays.
+        second: Array or tuple of arrays.
+
+    Returns:
+        bool: Same values, dtypes and shapes.
+    """
+    if isinstance(first, tuple):
+        return len(first) == len(second) and all(map(same, first, second))
+    first, second = np.asarray(first), np.asarray(second)
+    return (
+        first.dtype == second.dtype
+        and first.shape == second.shape
+        and np.array_equal(first, second, equal_nan=first.dtype.kind == "f")
+    )
+
+
+def random_values(generator: np.random.Generator, size: int) -> np.ndarray:
+    """
+    Values with NaN, zeros, negative numbers and repeated runs.
+
+    Args:
+        generator {np.random.Generator}: Random generator.
+        size {int}: Number of values.
+
+    Returns:
+        np.ndarray: Values.
+    """
+    values = generator.normal(0, 1, size).cumsum() * generator.choice([1e-4, 1.0])
+    kinds = generator.random(size)
+    values[kinds < 0.05] = np.nan
+    values[(kinds >= 0.05) & (kinds < 0.08)] = 0.0
+    repeated = (kinds >= 0.08) & (kinds < 0.2)
+    values[1:][repeated[1:]] = values[:-1][repeated[1:]]
+    return values
+
+
+def random_cases(seed: int, cases: int) -> dict[str, list[tuple]]:
+    """
+    Arguments of every kernel with edge cases.
+
+    Args:
+        seed {int}: Seed of generator.
+        cases {int}: Number of cases of every kernel.
+
+    Returns:
+        dict[str, list[tuple]]: Arguments by kernel.
+    """
+    from src.models.volume_anomaly import thresholds_for_laps
+
+    generator = np.random.default_rng(seed)
+    arguments = {
+        "first_detected_laps": [],
+        "trend_bounds": [],
+        "flat_bounds": [],
+        "ewm_means": [],
+    }
+    for _ in range(cases):
+        candidates, windows = generator.integers(0, 50), generator.integers(1, 5)
+        laps = generator.integers(1, 30)
+        current = np.abs(random_values(generator, candidates * laps))
+        means = np.abs(random_values(generator, candidates * windows))
+        means[generator.random(len(means)) < 0.1] = np.inf
+        arguments["first_detected_laps"].append(
+            (
+                current.reshape(candidates, laps),
+                means.reshape(candidates, windows),
+                thresholds_for_laps([3, 6, 9], [0.8, 0.7, 0.5, 0.3], laps),
+            )
+        )
+
+        size = int(generator.integers(1, 2000))
+        minimums = np.flatnonzero(generator.random(size) < 0.1)
+        maximums = np.flatnonzero(generator.random(size) < 0.1)
+        arguments["trend_bounds"].append((minimums, maximums))
+
+        indices = np.sort(generator.choice(size * 10, size, replace=False))
+        window = int(generator.choice([1, 2, 5, 150]))
+        border = float(generator.choice([0.0007, 0.05, 1.0]))
+        arguments["flat_bounds"].append(
+            (random_values(generator, size), indices, window, -border, border)
+        )
+
+        spans = generator.choice([1, 2, 9, 12, 26, 100], generator.integers(0, 4))
+        arguments["ewm_means"].append(
+            (
+                random_values(generator, size),
+                spans.astype(np.float64),
+                generator.integers(0, 30, len(spans)),
+            )
+        )
+    return arguments
+
+
+def realistic_cases(rows: int, seed: int) -> dict[str, tuple]:
+    """
+    Arguments of every kernel as the models pass them for synthetic bars.
+
+    Args:
+        rows {int}: Number of bars.
+        seed {int}: Seed of generator.
+
+    Returns:
+        dict[str, tuple]: Arguments by kernel.
+    """
+    from src.models.volume_anomaly import thresholds_for_laps
+    from src.utils.extremes import find_extremes
+
+    generator = np.random.default_rng(seed)
+    signal_line = generator.normal(0, 1, rows).cumsum()
+    signal_line = np.convolve(signal_line, np.ones(50) / 50, mode="same")
+    extremes = find_extremes(signal_line, [5, 1000])
+    indices = np.sort(np.concatenate(extremes[5]))
+
+    candidates = rows // 20
+    means = generator.lognormal(0, 0.3, (candidates, 3))
+    current = means[:, :1] * generator.lognormal(0, 0.5, (candidates, 22))
+    return {
+        "first_detected_laps": (
+            current,
+            means,
+            thresholds_for_laps([3, 6, 9], [0.8, 0.7, 0.5, 0.3], 22),
+        ),
+        "trend_bounds": extremes[1000],
+        "flat_bounds": (signal_line[indices], indices, 150, -0.0007, 0.0007),
+        "ewm_means": (signal_line, np.array([12.0, 26.0]), np.array([12, 26])),
+    }
+
+
+def best_time(function: Callable, arguments: tuple, repeat: int) -> float:
+    """
+    Fastest run of function.
+
+    Args:
+        function {Callable}: Kernel.
+        arguments {tuple}: Arguments of kernel.
+        repeat {int}: Number of runs.
+
+    Returns:
+        float: Seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*arguments)
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def check_kernels(
+    rows: int = DEFAULT_ROWS, cases: int = DEFAULT_CASES, seed: int = 0, repeat: int = 3
+) -> dict:
+    """
+    Compare both versions of every kernel.
+
+    Args:
+        rows {int}: Number of bars of realistic case.
+        cases {int}: Number of random cases of every kernel.
+        seed {int}: Seed of generator.
+        repeat {int}: Number of timed runs.
+
+    Returns:
+        dict: Backend, mismatches and times of every kernel.
+    """
+    sys.path.append(PROJECT_PATH)
+    from src.utils import kernels
+
+    report = {"backend": kernels.BACKEND, "kernels": {}}
+    try:
+        from src.utils import _kernels
+    except ImportError:
+        return report
+    random = random_cases(seed, cases)
+    realistic = realistic_cases(rows, seed)
+    for name in random:
+        python = getattr(kernels, f"python_{name}")
+        native = getattr(_kernels, name)
+        mismatches = sum(
+            not same(python(*arguments), native(*arguments))
+            for arguments in random[name] + [realistic[name]]
+        )
+        python_seconds = best_time(python, realistic[name], repeat)
+        native_seconds = best_time(native, realistic[name], repeat)
+        report["kernels"][name] = {
+            "mismatches": mismatches,
+            "python_seconds": python_seconds,
+            "native_seconds": native_seconds,
+            "speedup": python_seconds / native_seconds if native_seconds else None,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--rows", dest="rows", type=int, default=DEFAULT_ROWS)
+    args_parser.add_argument("--cases", dest="cases", type=int, default=DEFAULT_CASES)
+    args_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args_parser.add_argument("--repeat", dest="repeat", type=int, default=3)
+    args_parser.add_argument("--output", dest="output", help="json file with results")
+    args = args_parser.parse_args()
+    report = check_kernels(args.rows, args.cases, args.seed, args.repeat)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    print(f"Backend: {report['backend']}")
+    if not report["kernels"]:
+        print("Compiled kernels are not built, run `python build.py`")
+        sys.exit(1)
+    for name, values in report["kernels"].items():
+        print(
+            f"{name:22} mismatches {values['mismatches']:>4}  "
+            f"python {values['python_seconds'] * 1e3:9.3f} ms  "
+            f"native {values['native_seconds'] * 1e3:9.3f} ms  "
+            f"x{values['speedup']:.1f}"
+        )
+    sys.exit(any(values["mismatches"] for values in report["kernels"].values()))
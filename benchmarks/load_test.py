@@ -0,0 +1,370 @@
+"""Measures end-to-end latency per bar of the live service under load."""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Text
+
+import numpy as np
+import yaml
+from envyaml import EnvYAML
+
+DEFAULT_BARS = 100000
+DEFAULT_BATCH = 100
+DEFAULT_TIMEOUT = 600
+
+
+def free_port() -> int:
+    """
+    Port which is free now on localhost.
+
+    Returns:
+        int: Port.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def write_config(base_config: Text, path: Text, port: int) -> Text:
+    """
+    Write config whose service listens on given port.
+
+    Args:
+        base_config {Text}: Config with parameters of models.
+        path {Text}: Path to new config.
+        port {int}: Port of HTTP server.
+
+    Returns:
+        Text: Path to config.
+    """
+    with open(base_config) as file:
+        sections = yaml.safe_load(file)
+    values = EnvYAML(base_config)
+    config = {section: values[section] for section in sections}
+    config["base"]["log_level"] = "WARNING"
+    config["service"].update(host="127.0.0.1", port=port, unix_socket=None)
+    with open(path, "w") as file:
+        yaml.safe_dump(config, file, sort_keys=False)
+    return path
+
+
+def make_lines(rows: int, seed: int, column_for_macd: Text) -> list[bytes]:
+    """
+    Synthetic bars as JSON lines.
+
+    Args:
+        rows {int}: Number of bars.
+        seed {int}: Seed of generator.
+        column_for_macd {Text}: Name of price column.
+
+    Returns:
+        list[bytes]: One line per bar.
+    """
+    from benchmarks.synthetic import generate_bars
+
+    lines = []
+    for batch in generate_bars(rows, seed):
+        dates = batch.column("date").to_numpy().view(np.int64).tolist()
+        prices = batch.column(column_for_macd).to_numpy().tolist()
+        volumes = batch.column("volume").to_numpy().tolist()
+        lines.extend(
+            f'{{"date": {date}, "{column_for_macd}": {price}, "volume": {volume}}}\n'.encode()
+            for date, price, volume in zip(dates, prices, volumes)
+        )
+    return lines
+
+
+def summarize(latencies: np.ndarray) -> dict:
+    """
+    Percentiles of latencies.
+
+    Args:
+        latencies {np.ndarray}: Latencies in nanoseconds.
+
+    Returns:
+        dict: Count, mean, p50, p90, p99 and max in milliseconds.
+    """
+    if len(latencies) == 0:
+        return {"count": 0}
+    milliseconds = np.asarray(latencies, dtype=np.float64) / 1e6
+    summary = {"count": len(milliseconds), "mean": float(milliseconds.mean())}
+    for name, q in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)):
+        summary[name] = float(np.percentile(milliseconds, q))
+    return summary
+
+
+async def wait_for_service(port: int, timeout: float):
+    """
+    Wait until HTTP server of service accepts connections.
+
+    Args:
+        port {int}: Port of HTTP server.
+        timeout {float}: Seconds to wait.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def send_bars(
+    port: int, lines: list[bytes], rate: float, batch: int, timeout: float
+) -> np.ndarray:
+    """
+    Send bars to ingest socket and wait until all of them are processed.
+
+    Latency of a bar is the time from writing it to receiving the first
+    `{"rows": N}` line which covers it, so it includes queueing, detection and both
+    directions of the socket. Service is expected to start without checkpoint.
+
+    Args:
+        port {int}: Port of ingest socket.
+        lines {list[bytes]}: Bars as JSON lines.
+        rate {float}: Bars per second, as fast as possible if 0.
+        batch {int}: Number of bars written at once.
+        timeout {float}: Seconds to wait for the last ack.
+
+    Returns:
+        np.ndarray: Latency of every bar in nanoseconds.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    sent = np.zeros(len(lines), dtype=np.int64)
+    acked = np.zeros(len(lines), dtype=np.int64)
+
+    async def read_acks():
+        done = 0
+        while done < len(lines):
+            line = await reader.readline()
+            if not line:
+                break
+            now = time.perf_counter_ns()
+            rows = min(json.loads(line)["rows"], len(lines))
+            acked[done:rows] = now
+            done = max(done, rows)
+
+    acks = asyncio.create_task(read_acks())
+    started = time.perf_counter()
+    for start in range(0, len(lines), batch):
+        if rate > 0:
+            delay = start / rate - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        sent[start : start + batch] = time.perf_counter_ns()
+        writer.write(b"".join(lines[start : start + batch]))
+        await writer.drain()
+    await asyncio.wait_for(acks, timeout)
+    writer.close()
+    return acked - sent
+
+
+async def query_state(port: int, stop: asyncio.Event) -> list[int]:
+    """
+    Request `/state` over one keep-alive connection until stopped.
+
+    Args:
+        port {int}: Port of HTTP server.
+        stop {asyncio.Event}: Set when bars are sent.
+
+    Returns:
+        list[int]: Latency of every request in nanoseconds.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter_ns()
+        writer.write(b"GET /state HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter_ns() - started)
+    writer.close()
+    return latencies
+
+
+async def load(
+    port: int,
+    ingest_port: int,
+    lines: list[bytes],
+    rate: float,
+    batch: int,
+    clients: int,
+    timeout: float,
+) -> dict:
+    """
+    Send bars and query state at the same time.
+
+    Args:
+        port {int}: Port of HTTP server.
+        ingest_port {int}: Port of ingest socket.
+        lines {list[bytes]}: Bars as JSON lines.
+        rate {float}: Bars per second, as fast as possible if 0.
+        batch {int}: Number of bars written at once.
+        clients {int}: Number of connections requesting state.
+        timeout {float}: Seconds to wait for service.
+
+    Returns:
+        dict: Latencies of bars and requests and throughput.
+    """
+    await wait_for_service(port, timeout)
+    await wait_for_service(ingest_port, timeout)
+    stop = asyncio.Event()
+    queries = [asyncio.create_task(query_state(port, stop)) for _ in range(clients)]
+    started = time.perf_counter()
+    bars = await send_bars(ingest_port, lines, rate, batch, timeout)
+    seconds = time.perf_counter() - started
+    stop.set()
+    requests = [latency for task in queries for latency in await task]
+    return {
+        "seconds": seconds,
+        "bars_per_second": len(lines) / seconds,
+        "bar_latency_ms": summarize(bars),
+        "state_latency_ms": summarize(np.array(requests)),
+    }
+
+
+def run_load_test(
+    config_path: Text,
+    bars: int = DEFAULT_BARS,
+    rate: float = 0.0,
+    batch: int = DEFAULT_BATCH,
+    clients: int = 1,
+    seed: int = 0,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> dict:
+    """
+    Start service fed by TCP socket and measure it with synthetic bars.
+
+    Args:
+        config_path {Text}: Config with parameters of models.
+        bars {int}: Number of bars.
+        rate {float}: Bars per second, as fast as possible if 0.
+        batch {int}: Number of bars written at once.
+        clients {int}: Number of connections requesting state during the test.
+        seed {int}: Seed of synthetic bars.
+        timeout {float}: Seconds to wait for service.
+
+    Returns:
+        dict: Parameters of test and its results.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    column_for_macd = config["featurize"]["trend_detection"]["column_for_macd"]
+    lines = make_lines(bars, seed, column_for_macd)
+    port, ingest_port = free_port(), free_port()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        service_config = write_config(
+            config_path, os.path.join(temporary, "params.yaml"), port
+        )
+        service = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(config["base"]["project_path"], "src", "service.py"),
+                "--config",
+                service_config,
+                "--source",
+                "tcp",
+                "--input",
+                f"127.0.0.1:{ingest_port}",
+            ]
+        )
+        try:
+            results = asyncio.run(
+                load(port, ingest_port, lines, rate, batch, clients, timeout)
+            )
+        finally:
+            service.terminate()
+            service.wait()
+    return {
+        "bars": bars,
+        "rate": rate,
+        "batch": batch,
+        "clients": clients,
+        "max_batch": config["service"]["max_batch"],
+        **results,
+    }
+
+
+def print_report(report: dict):
+    """
+    Print results of load test.
+
+    Args:
+        report {dict}: Results of `run_load_test`.
+    """
+    print(
+        f"{report['bars']} bars in {report['seconds']:.2f} s, "
+        f"{report['bars_per_second']:.0f} bars/s"
+    )
+    for name in ["bar_latency_ms", "state_latency_ms"]:
+        values = report[name]
+        if not values["count"]:
+            continue
+        print(
+            f"{name:18} count {values['count']:>8}  "
+            + "  ".join(
+                f"{key} {values[key]:8.3f}" for key in ["p50", "p90", "p99", "max"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument("--bars", dest="bars", type=int, default=DEFAULT_BARS)
+    args_parser.add_argument(
+        "--rate",
+        dest="rate",
+        type=float,
+        default=0.0,
+        help="bars per second, as fast as possible if 0",
+    )
+    args_parser.add_argument(
+        "--batch",
+        dest="batch",
+        type=int,
+        default=DEFAULT_BATCH,
+        help="bars written to socket at once",
+    )
+    args_parser.add_argument(
+        "--clients",
+        dest="clients",
+        type=int,
+        default=1,
+        help="connections requesting state during the test",
+    )
+    args_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args_parser.add_argument(
+        "--timeout", dest="timeout", type=float, default=DEFAULT_TIMEOUT
+    )
+    args_parser.add_argument("--output", dest="output", help="json file with results")
+    args = args_parser.parse_args()
+    report = run_load_test(
+        args.config,
+        args.bars,
+        args.rate,
+        args.batch,
+        args.clients,
+        args.seed,
+        args.timeout,
+    )
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    print_report(report)
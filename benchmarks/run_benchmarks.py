@@ -0,0 +1,499 @@
+"""Times and memory-profiles every stage on synthetic data of growing size."""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional, Sequence, Text
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import yaml
+from envyaml import EnvYAML
+
+DEFAULT_SIZES = [10**4, 10**5, 10**6]
+DEFAULT_TOLERANCE = 0.25
+MIN_SECONDS = 0.05
+MIN_MEMORY_MB = 32
+STAGES = {
+    "preprocess_for_trend_detection": (
+        "src.features.preprocessing_for_trend_detection",
+        "preprocess_for_trend_detection",
+        [],
+    ),
+    "preprocess_for_volume_anomaly": (
+        "src.features.preprocessing_for_volume_anomaly",
+        "preprocess_for_volume_anomaly",
+        [],
+    ),
+    "detect_trend": (
+        "src.models.trend_detection",
+        "detect_trend",
+        ["preprocess_for_trend_detection"],
+    ),
+    "find_volume_anomaly": (
+        "src.models.volume_anomaly",
+        "find_volume_anomaly",
+        ["preprocess_for_volume_anomaly"],
+    ),
+    "concat": ("src.models.concat", "concat", ["detect_trend", "find_volume_anomaly"]),
+    "plot_stock_with_trends": (
+        "src.visualization.plots_for_trend",
+        "plot_stock_with_trends",
+        ["concat"],
+    ),
+    "plot_volume_with_anomaly": (
+        "src.visualization.plots_for_volume",
+        "plot_volume_with_anomaly",
+        ["concat"],
+    ),
+}
+
+
+def peak_memory_mb() -> float:
+    """
+    Peak resident memory of current process.
+
+    Returns:
+        float: Megabytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def import_project(project_path: Text):
+    """
+    Import all modules of `src`, stages import them lazily and the time of the
+    first import would be counted as time of stage.
+
+    Args:
+        project_path {Text}: Root of repository.
+    """
+    for directory, _, files in os.walk(os.path.join(project_path, "src")):
+        package = os.path.relpath(directory, project_path).replace(os.sep, ".")
+        for name in sorted(files):
+            if name.endswith(".py"):
+                importlib.import_module(f"{package}.{name[:-3]}")
+
+
+def measure_stage(stage: Text, config_path: Text) -> dict:
+    """
+    Run one stage in current process and measure it.
+
+    Modules of project are imported before the clock starts.
+
+    Args:
+        stage {Text}: Name of stage from `STAGES`.
+        config_path {Text}: path to config
+
+    Returns:
+        dict: Wall time of stage and peak memory before and after it.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    import_project(config["base"]["project_path"])
+    module, function, _ = STAGES[stage]
+    run = getattr(importlib.import_module(module), function)
+    memory_before = peak_memory_mb()
+    started = time.perf_counter()
+    run(config_path)
+    seconds = time.perf_counter() - started
+    return {
+        "seconds": round(seconds, 4),
+        "peak_memory_mb": round(peak_memory_mb(), 1),
+        "import_memory_mb": round(memory_before, 1),
+    }
+
+
+def write_config(base_config: Text, work_dir: Text, rows: int) -> Text:
+    """
+    Write config whose data and reports live in work directory.
+
+    Cache of derived columns is disabled, so every run computes all columns.
+
+    Args:
+        base_config {Text}: Config with parameters of models.
+        work_dir {Text}: Directory for files of all sizes.
+        rows {int}: Number of bars.
+
+    Returns:
+        Text: Path to config.
+    """
+    with open(base_config) as file:
+        sections = yaml.safe_load(file)
+    values = EnvYAML(base_config)
+    config = {section: values[section] for section in sections}
+    directory = os.path.join(work_dir, str(rows))
+    for name in ["processed", "result", "reports/trends", "reports/volumes"]:
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    config["base"]["log_level"] = "WARNING"
+    config["base"]["cache_dir"] = None
+    config["data"] = {
+        "raw": os.path.join(work_dir, f"raw_{rows}.feather"),
+        "processed_volume_anomaly": os.path.join(
+            directory, "processed", "processed_volume_anomaly.feather"
+        ),
+        "processed_trend_detection": os.path.join(
+            directory, "processed", "processed_trend_detection.feather"
+        ),
+        "result_volume_anomaly": os.path.join(
+            directory, "result", "result_volume_anomaly.feather"
+        ),
+        "result_trend_detection": os.path.join(
+            directory, "result", "result_trend_detection.feather"
+        ),
+        "result_with_trend_and_anomaly": os.path.join(
+            directory, "result", "result_with_trend_and_anomaly.feather"
+        ),
+    }
+    reports = config["reports"]
+    reports["trend_detection"]["path_to_trend_png"] = (
+        os.path.join(directory, "reports", "trends") + os.sep
+    )
+    reports["volume_anomaly"]["path_to_volume_png"] = (
+        os.path.join(directory, "reports", "volumes") + os.sep
+    )
+    path = os.path.join(directory, "params.yaml")
+    with open(path, "w") as file:
+        yaml.safe_dump(config, file, sort_keys=False)
+    return path
+
+
+def run_stage(
+    stage: Text, config_path: Text, timeout: Optional[float], repeat: int = 1
+) -> dict:
+    """
+    Run one stage in fresh processes, so peak memory belongs to this stage only.
+
+    Args:
+        stage {Text}: Name of stage from `STAGES`.
+        config_path {Text}: path to config
+        timeout {Optional[float]}: Seconds after which the stage is stopped.
+        repeat {int}: Number of runs, the fastest one is kept.
+
+    Returns:
+        dict: Measurements and status of stage.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--config", config_path]
+    best = None
+    for _ in range(repeat):
+        try:
+            process = subprocess.run(
+                command + ["--stage", stage],
+                capture_output=True,
+                text=True,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return {"status": "timeout", "error": f"longer than {timeout} s"}
+        if process.returncode != 0:
+            lines = process.stderr.strip().splitlines() or [
+                f"exit {process.returncode}"
+            ]
+            return {"status": "failed", "error": lines[-1]}
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return dict(best, status="ok")
+
+
+def run_benchmarks(
+    config_path: Text,
+    sizes: Sequence[int],
+    stages: Sequence[Text],
+    work_dir: Text,
+    seed: int = 0,
+    timeout: Optional[float] = None,
+    repeat: int = 1,
+) -> dict:
+    """
+    Run stages on synthetic data of every size.
+
+    A stage is skipped when a stage it depends on did not finish, a stage which
+    failed or timed out is not run on larger sizes, so the largest size each stage
+    can handle is visible in results.
+
+    Args:
+        config_path {Text}: Config with parameters of models.
+        sizes {Sequence[int]}: Numbers of bars.
+        stages {Sequence[Text]}: Names of stages in order of `STAGES`.
+        work_dir {Text}: Directory for data, results and reports.
+        seed {int}: Seed of generator.
+        timeout {Optional[float]}: Seconds after which a stage is stopped.
+        repeat {int}: Number of runs of every stage, the fastest one is kept.
+
+    Returns:
+        dict: Environment and measurements of every stage and size.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from benchmarks.synthetic import write_bars
+    from src.utils.logger import get_logger
+
+    logger = get_logger("BENCHMARKS", log_level=config["base"]["log_level"])
+    os.makedirs(work_dir, exist_ok=True)
+    stopped = set()
+    results = []
+    for rows in sorted(sizes):
+        raw = os.path.join(work_dir, f"raw_{rows}.feather")
+        if not os.path.exists(raw):
+            logger.info(f"Generate {rows} bars")
+            write_bars(raw, rows, seed=seed)
+        stage_config = write_config(config_path, work_dir, rows)
+        finished = set()
+        for stage in stages:
+            if stage in stopped:
+                continue
+            missing = [name for name in STAGES[stage][2] if name not in finished]
+            if any(name in stages for name in missing):
+                result = {"status": "skipped", "error": f"{missing} did not finish"}
+            else:
+                result = run_stage(stage, stage_config, timeout, repeat)
+            results.append(dict(stage=stage, rows=rows, **result))
+            logger.info(f"{stage} on {rows} rows: {result}")
+            if result["status"] == "ok":
+                finished.add(stage)
+            elif result["status"] in ("failed", "timeout"):
+                stopped.add(stage)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "pyarrow": pa.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "workers": config["base"].get("workers", 1),
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def scaling_exponents(results: list[dict]) -> dict[Text, list[tuple[int, float]]]:
+    """
+    Growth of time between neighbouring sizes, 1 is linear and 2 is quadratic.
+
+    Args:
+        results {list[dict]}: Measurements from `run_benchmarks`.
+
+    Returns:
+        dict[Text, list[tuple[int, float]]]: Larger size and exponent by stage.
+    """
+    exponents = {}
+    for stage in STAGES:
+        points = sorted(
+            (result["rows"], result["seconds"])
+            for result in results
+            if result["stage"] == stage and result["status"] == "ok"
+        )
+        exponents[stage] = [
+            (
+                rows,
+                round(
+                    float(
+                        np.log(seconds / previous_seconds)
+                        / np.log(rows / previous_rows)
+                    ),
+                    2,
+                ),
+            )
+            for (previous_rows, previous_seconds), (rows, seconds) in zip(
+                points, points[1:]
+            )
+            if previous_seconds > 0 and seconds > 0
+        ]
+    return exponents
+
+
+def compare_with_baseline(
+    results: list[dict], baseline: list[dict], tolerance: float = DEFAULT_TOLERANCE
+) -> list[dict]:
+    """
+    Find stages which became slower, use more memory or stopped finishing.
+
+    Differences smaller than `MIN_SECONDS` and `MIN_MEMORY_MB` are noise.
+
+    Args:
+        results {list[dict]}: Current measurements.
+        baseline {list[dict]}: Saved measurements.
+        tolerance {float}: Allowed relative growth.
+
+    Returns:
+        list[dict]: Regressions with current and baseline values.
+    """
+    saved = {(result["stage"], result["rows"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = saved.get((result["stage"], result["rows"]))
+        if before is None or before["status"] != "ok":
+            continue
+        key = dict(stage=result["stage"], rows=result["rows"])
+        if result["status"] != "ok":
+            regressions.append(dict(key, metric="status", current=result["status"]))
+            continue
+        for metric, minimum in [
+            ("seconds", MIN_SECONDS),
+            ("peak_memory_mb", MIN_MEMORY_MB),
+        ]:
+            if (
+                result[metric] > before[metric] * (1 + tolerance)
+                and result[metric] - before[metric] > minimum
+            ):
+                regressions.append(
+                    dict(
+                        key,
+                        metric=metric,
+                        current=result[metric],
+                        baseline=before[metric],
+                    )
+                )
+    return regressions
+
+
+def plot_scaling(results: list[dict], path: Text) -> Text:
+    """
+    Draw time and peak memory of every stage against number of rows.
+
+    Args:
+        results {list[dict]}: Measurements from `run_benchmarks`.
+        path {Text}: Path to png file.
+
+    Returns:
+        Text: Path to png file.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figure, axes = plt.subplots(1, 2, figsize=(14, 6))
+    for stage in STAGES:
+        points = sorted(
+            (result["rows"], result["seconds"], result["peak_memory_mb"])
+            for result in results
+            if result["stage"] == stage and result["status"] == "ok"
+        )
+        if not points:
+            continue
+        rows, seconds, memory = zip(*points)
+        axes[0].loglog(rows, seconds, marker="o", label=stage)
+        axes[1].loglog(rows, memory, marker="o", label=stage)
+    for ax, label in zip(axes, ["Seconds", "Peak memory, MB"]):
+        ax.set_xlabel("Rows")
+        ax.set_ylabel(label)
+        ax.grid(True, which="both", alpha=0.3)
+    axes[0].legend(fontsize="small")
+    figure.tight_layout()
+    figure.savefig(path)
+    plt.close(figure)
+    return path
+
+
+def print_report(report: dict, regressions: list[dict]):
+    """
+    Print measurements, scaling exponents and regressions.
+
+    Args:
+        report {dict}: Output of `run_benchmarks`.
+        regressions {list[dict]}: Output of `compare_with_baseline`.
+    """
+    print(f"{'stage':32} {'rows':>11} {'seconds':>10} {'memory, MB':>11}  status")
+    for result in report["results"]:
+        print(
+            f"{result['stage']:32} {result['rows']:>11} "
+            f"{result.get('seconds', float('nan')):>10.3f} "
+            f"{result.get('peak_memory_mb', float('nan')):>11.1f}  {result['status']}"
+        )
+    print("\nScaling exponents of time (1 is linear):")
+    for stage, exponents in scaling_exponents(report["results"]).items():
+        if exponents:
+            values = ", ".join(f"{rows}: {value}" for rows, value in exponents)
+            print(f"  {stage:32} {values}")
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument("--stage", dest="stage", help=argparse.SUPPRESS)
+    args_parser.add_argument(
+        "--sizes",
+        dest="sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="numbers of bars, up to 10**8 (see README for the full range)",
+    )
+    args_parser.add_argument(
+        "--stages", dest="stages", nargs="+", choices=list(STAGES), default=None
+    )
+    args_parser.add_argument("--output", dest="output", help="json file with results")
+    args_parser.add_argument(
+        "--baseline", dest="baseline", help="json file with saved results"
+    )
+    args_parser.add_argument(
+        "--save-baseline",
+        dest="save_baseline",
+        action="store_true",
+        help="write results to baseline file instead of comparing with it",
+    )
+    args_parser.add_argument(
+        "--tolerance", dest="tolerance", type=float, default=DEFAULT_TOLERANCE
+    )
+    args_parser.add_argument("--work-dir", dest="work_dir", help="directory for data")
+    args_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args_parser.add_argument(
+        "--timeout", dest="timeout", type=float, help="seconds per stage"
+    )
+    args_parser.add_argument(
+        "--repeat", dest="repeat", type=int, default=1, help="runs of every stage"
+    )
+    args_parser.add_argument("--plot", dest="plot", help="png file with scaling curves")
+    args = args_parser.parse_args()
+
+    if args.stage:
+        print(json.dumps(measure_stage(args.stage, args.config)))
+        sys.exit(0)
+
+    stages = [stage for stage in STAGES if stage in (args.stages or STAGES)]
+    with tempfile.TemporaryDirectory() as temporary:
+        report = run_benchmarks(
+            args.config,
+            args.sizes,
+            stages,
+            args.work_dir or temporary,
+            seed=args.seed,
+            timeout=args.timeout,
+            repeat=args.repeat,
+        )
+    regressions = []
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(report, file, indent=2)
+    elif args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare_with_baseline(
+                report["results"], json.load(file)["results"], args.tolerance
+            )
+        report["regressions"] = regressions
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.plot:
+        plot_scaling(report["results"], args.plot)
+    print_report(report, regressions)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,177 @@
+"""Provides deterministic synthetic minute bars for benchmarks."""
+
+import argparse
+from typing import Iterator, Sequence, Text
+
+import numpy as np
+import pyarrow as pa
+
+CHUNK_ROWS = 1048576
+DEFAULT_START = "2015-01-01"
+DEFAULT_VOLATILITIES = (0.0002, 0.0006, 0.0015)
+DEFAULT_REGIME_LENGTH = 10080
+DEFAULT_SPIKES_PER_MILLION = 20
+BURST_SCALE = 100.0
+SCHEMA = pa.schema(
+    [
+        ("date", pa.timestamp("ns")),
+        ("open", pa.float64()),
+        ("high", pa.float64()),
+        ("low", pa.float64()),
+        ("close", pa.float64()),
+        ("volume", pa.float64()),
+    ]
+)
+
+
+def make_regimes(
+    rows: int, seed: int, regime_length: int, volatilities: Sequence[float]
+) -> np.ndarray:
+    """
+    Volatility of every regime, regimes are `regime_length` minutes long.
+
+    Args:
+        rows {int}: Number of bars.
+        seed {int}: Seed of generator.
+        regime_length {int}: Number of bars in regime.
+        volatilities {Sequence[float]}: Standard deviations of minute log returns
+            to choose from.
+
+    Returns:
+        np.ndarray: Volatility of each regime.
+    """
+    rng = np.random.default_rng([seed, 1])
+    number = rows // regime_length + 1
+    return np.asarray(volatilities)[rng.integers(len(volatilities), size=number)]
+
+
+def make_spikes(
+    rows: int, seed: int, spikes_per_million: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Spans of raised volume.
+
+    Spikes last from one to seven days, volume inside is 3 to 10 times higher, so
+    they are long enough to be found by volume anomaly search.
+
+    Args:
+        rows {int}: Number of bars.
+        seed {int}: Seed of generator.
+        spikes_per_million {float}: Number of spikes per million bars.
+
+    Returns:
+        tuple[np.ndarray]: First rows, last rows and volume multipliers of spikes.
+    """
+    rng = np.random.default_rng([seed, 2])
+    number = int(round(rows * spikes_per_million / 1e6))
+    starts = np.sort(rng.integers(rows, size=number)) if rows else np.empty(0, int)
+    ends = np.minimum(starts + rng.integers(1440, 10080, size=number), rows - 1)
+    return starts, ends, rng.uniform(3, 10, size=number)
+
+
+def generate_bars(
+    rows: int,
+    seed: int = 0,
+    start: Text = DEFAULT_START,
+    regime_length: int = DEFAULT_REGIME_LENGTH,
+    volatilities: Sequence[float] = DEFAULT_VOLATILITIES,
+    spikes_per_million: float = DEFAULT_SPIKES_PER_MILLION,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Generate OHLCV minute bars by record batches.
+
+    Close is a geometric random walk whose volatility switches between regimes,
+    volume grows with volatility and is multiplied inside injected spikes, which
+    start with a burst of `BURST_SCALE` times the usual volume. Every
+    chunk of `CHUNK_ROWS` bars has its own seed and only the last close is carried
+    over, so the same arguments give the same bars and memory does not depend on
+    the number of bars.
+
+    Args:
+        rows {int}: Number of bars.
+        seed {int}: Seed of generator.
+        start {Text}: Date of the first bar.
+        regime_length {int}: Number of bars in volatility regime.
+        volatilities {Sequence[float]}: Standard deviations of minute log returns
+            of regimes.
+        spikes_per_million {float}: Number of volume spikes per million bars.
+
+    Yields:
+        pa.RecordBatch: Bars of `SCHEMA`.
+    """
+    regimes = make_regimes(rows, seed, regime_length, volatilities)
+    spike_starts, spike_ends, spike_scales = make_spikes(rows, seed, spikes_per_million)
+    first_date = np.datetime64(start, "ns")
+    minute = np.timedelta64(1, "m")
+    lowest = min(volatilities)
+    close = 7000.0
+    for number, offset in enumerate(range(0, rows, CHUNK_ROWS)):
+        rng = np.random.default_rng([seed, 0, number])
+        index = np.arange(offset, min(offset + CHUNK_ROWS, rows))
+        volatility = regimes[index // regime_length]
+        returns = volatility * rng.standard_normal(len(index))
+        closes = close * np.exp(np.cumsum(returns))
+        opens = np.r_[close, closes[:-1]]
+        wick = volatility * np.abs(rng.standard_normal((2, len(index))))
+        highs = np.maximum(opens, closes) * (1 + wick[0])
+        lows = np.minimum(opens, closes) * (1 - wick[1])
+        volumes = rng.lognormal(1.0, 0.6, len(index)) * np.sqrt(volatility / lowest)
+
+        inside = (spike_starts <= index[-1]) & (spike_ends >= offset)
+        for first, last, scale in zip(
+            spike_starts[inside], spike_ends[inside], spike_scales[inside]
+        ):
+            volumes[max(first - offset, 0) : last - offset + 1] *= scale
+            if first >= offset:
+                volumes[first - offset] *= BURST_SCALE
+
+        yield pa.RecordBatch.from_arrays(
+            [
+                pa.array(first_date + index * minute),
+                pa.array(opens),
+                pa.array(highs),
+                pa.array(lows),
+                pa.array(closes),
+                pa.array(volumes),
+            ],
+            schema=SCHEMA,
+        )
+        close = closes[-1]
+
+
+def write_bars(path: Text, rows: int, **kwargs) -> Text:
+    """
+    Write synthetic bars to Feather file by record batches.
+
+    Args:
+        path {Text}: Path to Feather file.
+        rows {int}: Number of bars.
+        kwargs: Parameters of `generate_bars`.
+
+    Returns:
+        Text: Path to Feather file.
+    """
+    with pa.ipc.new_file(path, SCHEMA) as writer:
+        for batch in generate_bars(rows, **kwargs):
+            writer.write_batch(batch)
+    return path
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--rows", dest="rows", type=int, required=True)
+    args_parser.add_argument("--output", dest="output", required=True)
+    args_parser.add_argument("--seed", dest="seed", type=int, default=0)
+    args_parser.add_argument(
+        "--spikes-per-million",
+        dest="spikes_per_million",
+        type=float,
+        default=DEFAULT_SPIKES_PER_MILLION,
+    )
+    args = args_parser.parse_args()
+    write_bars(
+        args.output,
+        args.rows,
+        seed=args.seed,
+        spikes_per_million=args.spikes_per_million,
+    )
@@ -0,0 +1,75 @@
+"""Builds optional compiled kernels of `src/utils/kernels.py` next to their sources."""
+
+import os
+import sys
+import tempfile
+import warnings
+
+PROJECT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def extensions() -> list:
+    """
+    Extension modules of the project.
+
+    Multiply and add are not contracted, so results are the same as of NumPy.
+
+    Returns:
+        list: Setuptools extensions.
+    """
+    import numpy as np
+    from setuptools import Extension
+
+    return [
+        Extension(
+            "src.utils._kernels",
+            [os.path.join("src", "utils", "_kernels.c")],
+            include_dirs=[np.get_include()],
+            extra_compile_args=(
+                [] if sys.platform == "win32" else ["-O3", "-ffp-contract=off"]
+            ),
+        )
+    ]
+
+
+def build_inplace() -> bool:
+    """
+    Compile extensions into the source tree.
+
+    Returns:
+        bool: Extensions are built, NumPy versions are used otherwise.
+    """
+    from setuptools import Distribution
+
+    cwd = os.getcwd()
+    os.chdir(PROJECT_PATH)
+    try:
+        with tempfile.TemporaryDirectory() as build_temp:
+            distribution = Distribution(
+                {"name": "midas-kernels", "ext_modules": extensions()}
+            )
+            command = distribution.get_command_obj("build_ext")
+            command.inplace = True
+            command.build_temp = build_temp
+            command.ensure_finalized()
+            command.run()
+        return True
+    except Exception as error:
+        warnings.warn(f"Compiled kernels are not built: {error}")
+        return False
+    finally:
+        os.chdir(cwd)
+
+
+def build(setup_kwargs: dict):
+    """
+    Build hook of poetry.
+
+    Args:
+        setup_kwargs {dict}: Arguments of setup, not changed.
+    """
+    build_inplace()
+
+
+if __name__ == "__main__":
+    sys.exit(0 if build_inplace() else 1)
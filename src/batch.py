@@ -0,0 +1,221 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional, Text
+
+import pandas as pd
+from envyaml import EnvYAML
+from pandas import DataFrame
+
+warnings.filterwarnings("ignore")
+
+SUMMARY_FILE = "summary.csv"
+
+
+def list_symbols(source: Text) -> dict[Text, Text]:
+    """
+    Find raw files of symbols.
+
+    Source is a directory with `<symbol>.feather` files or a manifest with one file
+    per line, either `path` or `symbol,path`. Empty lines and lines starting with
+    `#` are skipped.
+
+    Args:
+        source {Text}: Directory or manifest.
+
+    Returns:
+        dict[Text, Text]: Paths to raw files by symbol.
+    """
+    if os.path.isdir(source):
+        return {
+            os.path.splitext(name)[0]: os.path.join(source, name)
+            for name in sorted(os.listdir(source))
+            if name.endswith(".feather")
+        }
+
+    symbols = {}
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if "," in line:
+                symbol, path = (part.strip() for part in line.split(",", 1))
+            else:
+                path = line
+                symbol = os.path.splitext(os.path.basename(path))[0]
+            symbols[symbol] = os.path.join(base, path)
+    return symbols
+
+
+def process_symbol(
+    config_path: Text,
+    symbol: Text,
+    raw_path: Text,
+    output_dir: Text,
+    chunk_size: Optional[int] = None,
+) -> dict:
+    """
+    Run trend detection, volume anomaly search and concat for one symbol.
+
+    Errors are not raised but returned in summary, so one broken file does not
+    stop the whole batch. Symbols already run in parallel processes, so
+    `base.workers` is set to 1 and the volume anomaly search of a symbol does not
+    start a pool of its own.
+
+    Args:
+        config_path {Text}: path to config
+        symbol {Text}: Name of symbol.
+        raw_path {Text}: Path to raw data of symbol.
+        output_dir {Text}: Directory for results.
+        chunk_size {Optional[int]}: Process file by chunks of this size.
+
+    Returns:
+        dict: Summary of run.
+    """
+    started = time.perf_counter()
+    result_path = os.path.join(output_dir, f"{symbol}.feather")
+    summary = {"symbol": symbol, "raw": raw_path, "result": result_path, "rows": 0}
+    try:
+        config = EnvYAML(config_path)
+        config["base"]["workers"] = 1
+        sys.path.append(config["base"]["project_path"])
+        if chunk_size:
+            from src.chunked import label_file
+
+            summary["rows"] = label_file(raw_path, result_path, config, chunk_size)
+        else:
+            from src.pipeline import process_raw
+            from src.utils.arrow_io import read_frame
+            from src.utils.labels import write_result
+
+            data = process_raw(read_frame(raw_path), config)
+            write_result(data, result_path, config)
+            summary["rows"] = len(data)
+        summary.update(status="ok", error="")
+    except Exception as error:
+        summary.update(status="failed", error=f"{type(error).__name__}: {error}")
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def run_batch(
+    config_path: Text,
+    source: Text,
+    output_dir: Text,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> DataFrame:
+    """
+    Process raw files of many symbols in parallel processes.
+
+    Files are submitted from the largest to the smallest one, so long runs start
+    first and workers finish at about the same time.
+
+    Args:
+        config_path {Text}: path to config
+        source {Text}: Directory with feather files or manifest.
+        output_dir {Text}: Directory for results and summary.
+        workers {Optional[int]}: Number of processes, number of CPUs if not set.
+        chunk_size {Optional[int]}: Process files by chunks of this size.
+
+    Returns:
+        DataFrame: Summary with rows, run time, status and error of each symbol.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.logger import get_logger
+
+    logger = get_logger("BATCH", log_level=config["base"]["log_level"])
+
+    symbols = list_symbols(source)
+    logger.info(f"Number of symbols: {len(symbols)}")
+    os.makedirs(output_dir, exist_ok=True)
+    order = sorted(
+        symbols,
+        key=lambda symbol: (
+            os.path.getsize(symbols[symbol]) if os.path.exists(symbols[symbol]) else 0
+        ),
+        reverse=True,
+    )
+
+    started = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                process_symbol,
+                config_path,
+                symbol,
+                symbols[symbol],
+                output_dir,
+                chunk_size,
+            ): symbol
+            for symbol in order
+        }
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                result = {
+                    "symbol": symbol,
+                    "raw": symbols[symbol],
+                    "result": "",
+                    "rows": 0,
+                    "status": "failed",
+                    "error": f"{type(error).__name__}: {error}",
+                    "seconds": None,
+                }
+            logger.info(
+                f"{symbol}: {result['status']} in {result['seconds']} s "
+                f"({len(results) + 1}/{len(symbols)})"
+            )
+            results.append(result)
+
+    summary = pd.DataFrame(
+        results,
+        columns=["symbol", "raw", "result", "rows", "seconds", "status", "error"],
+    ).sort_values("symbol", ignore_index=True)
+    path = os.path.join(output_dir, SUMMARY_FILE)
+    logger.info(f"Writing summary to path: {path}")
+    summary.to_csv(path, index=False)
+    failed = summary["status"] != "ok"
+    logger.info(
+        f"Processed {len(summary) - failed.sum()} symbols, {failed.sum()} failed, "
+        f"wall time {time.perf_counter() - started:.1f} s"
+    )
+    return summary
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument(
+        "--input",
+        dest="source",
+        required=True,
+        help="directory with <symbol>.feather files or manifest",
+    )
+    args_parser.add_argument("--output", dest="output_dir", required=True)
+    args_parser.add_argument(
+        "--workers", type=int, help="number of processes, number of CPUs by default"
+    )
+    args_parser.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
+        type=int,
+        help="process files by chunks of this size",
+    )
+    args = args_parser.parse_args()
+    run_batch(
+        config_path=args.config,
+        source=args.source,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+    )
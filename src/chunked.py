@@ -0,0 +1,271 @@
+import argparse
+import sys
+import warnings
+from typing import Iterator, Optional, Text
+
+import numpy as np
+import pyarrow as pa
+from envyaml import EnvYAML
+
+warnings.filterwarnings("ignore")
+
+DEFAULT_CHUNK_SIZE = 1048576
+
+
+def _segments_to_arrays(
+    segments: list[tuple],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert segments `(first row, last row[, label])` to arrays.
+
+    Args:
+        segments {list[tuple]}: Segments emitted by online detector.
+
+    Returns:
+        tuple[np.ndarray]: First rows, last rows and labels (None without labels).
+    """
+    if not segments:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype=object)
+    columns = list(zip(*segments))
+    starts = np.asarray(columns[0], dtype=np.int64)
+    ends = np.asarray(columns[1], dtype=np.int64)
+    labels = np.asarray(columns[2], dtype=object) if len(columns) > 2 else None
+    return starts, ends, labels
+
+
+def _sorted_by_start(
+    starts: np.ndarray, ends: np.ndarray, values: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sort segments by first row for `_overlapping`.
+
+    Args:
+        starts {np.ndarray}: First rows.
+        ends {np.ndarray}: Last rows.
+        values {np.ndarray}: Values painted by segments.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: First rows, last
+            rows, running maximum of last rows and values in order of first rows.
+    """
+    order = np.argsort(starts, kind="stable")
+    ends = ends[order]
+    return starts[order], ends, np.maximum.accumulate(ends), values[order]
+
+
+def _overlapping(
+    starts: np.ndarray, ends: np.ndarray, reach: np.ndarray, start: int, stop: int
+) -> np.ndarray:
+    """
+    Segments which cover any of rows `start`..`stop - 1`.
+
+    Segments before the first one whose running maximum of last rows reaches
+    `start` and segments from the first one starting at `stop` are skipped with
+    binary search, only the rest are compared.
+
+    Args:
+        starts {np.ndarray}: First rows sorted, see `_sorted_by_start`.
+        ends {np.ndarray}: Last rows in the same order.
+        reach {np.ndarray}: Running maximum of last rows.
+        start {int}: First row.
+        stop {int}: Row after the last one.
+
+    Returns:
+        np.ndarray: Positions of segments.
+    """
+    first = np.searchsorted(reach, start)
+    last = np.searchsorted(starts, stop)
+    return first + np.flatnonzero(ends[first:last] >= start)
+
+
+def label_batches(
+    batches: Iterator[pa.RecordBatch],
+    segments: list[tuple[int, int, str]],
+    anomalies: list[tuple[int, int]],
+    column_with_trend: Text,
+    column_with_anomaly: Text,
+    collectors: Optional[list] = None,
+    first_row: int = 0,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Add trend and anomaly columns to raw record batches.
+
+    Trend is written as int8 codes of `TREND_LABELS` with one shared dictionary,
+    anomaly as bit-packed boolean.
+
+    Args:
+        batches {Iterator[pa.RecordBatch]}: Raw rows by batches in file order.
+        segments {list[tuple[int, int, str]]}: Trend segments of whole history.
+        anomalies {list[tuple[int, int]]}: Anomalies of whole history.
+        column_with_trend {Text}: Name of column with trend.
+        column_with_anomaly {Text}: Name of column with anomaly.
+        collectors {Optional[list]}: `IntervalCollector` of trend and anomaly, rows
+            of every batch are added to them.
+        first_row {int}: Number of the first row of batches in history.
+
+    Yields:
+        pa.RecordBatch: Raw rows with trend and anomaly.
+    """
+    from src.utils.arrow_io import column_to_numpy
+    from src.utils.intervals import paint_intervals
+    from src.utils.labels import TREND_LABELS, trend_array, trend_codes
+
+    trend_starts, trend_ends, labels = _segments_to_arrays(segments)
+    trend_starts, trend_ends, trend_reach, codes = _sorted_by_start(
+        trend_starts, trend_ends, trend_codes(labels)
+    )
+    anomaly_starts, anomaly_ends, _ = _segments_to_arrays(anomalies)
+    anomaly_starts, anomaly_ends, anomaly_reach, _ = _sorted_by_start(
+        anomaly_starts, anomaly_ends, anomaly_starts
+    )
+    start = first_row
+    for batch in batches:
+        stop = start + batch.num_rows
+        inside = _overlapping(trend_starts, trend_ends, trend_reach, start, stop)
+        trend = paint_intervals(
+            np.zeros(batch.num_rows, dtype=np.int8),
+            trend_starts[inside] - start,
+            trend_ends[inside] - start,
+            codes[inside],
+            precedence=[
+                TREND_LABELS.index(label) for label in ["fall", "rise", "flat"]
+            ],
+        )
+        inside = _overlapping(anomaly_starts, anomaly_ends, anomaly_reach, start, stop)
+        anomaly = paint_intervals(
+            np.zeros(batch.num_rows, dtype=bool),
+            anomaly_starts[inside] - start,
+            anomaly_ends[inside] - start,
+            True,
+        )
+        if collectors:
+            dates = column_to_numpy(batch.column("date"))
+            collectors[0].add(dates, trend)
+            collectors[1].add(dates, anomaly.view(np.int8))
+        yield pa.RecordBatch.from_arrays(
+            batch.columns + [trend_array(trend), pa.array(anomaly)],
+            names=batch.schema.names + [column_with_trend, column_with_anomaly],
+        )
+        start = stop
+
+
+def label_file(
+    raw_path: Text, result_path: Text, config: EnvYAML, chunk_size: Optional[int] = None
+) -> int:
+    """
+    Run preprocessing, both detectors and concat over raw file by chunks.
+
+    Raw rows must be sorted by date. The first pass feeds record batches to online
+    detectors, which carry EWM states, rolling window tails, the last `order` values
+    of signal line for extremes and open anomaly candidates with `gap_end_date` of
+    history across chunk boundaries, and keeps only the found segments. The second
+    pass labels rows chunk by chunk and writes the result together with intervals
+    of trend and anomaly. Result is the same as the one of in-memory run. Raw rows
+    are held one chunk at a time, but segments and anomalies of the whole history
+    are kept in memory, so memory use grows with their number too.
+
+    Args:
+        raw_path {Text}: Path to raw data.
+        result_path {Text}: Path to data with trend and anomaly.
+        config {EnvYAML}: Yaml file with configurations.
+        chunk_size {Optional[int]}: Number of rows in chunk, `base.chunk_size` from
+            config if not set.
+
+    Returns:
+        int: Number of rows.
+    """
+    from src.models.online_trend_detection import OnlineTrendDetector
+    from src.models.online_volume_anomaly import OnlineVolumeAnomalyDetector
+    from src.utils.arrow_io import (
+        DEFAULT_COMPRESSION,
+        column_to_numpy,
+        iter_batches,
+        write_batches,
+    )
+    from src.utils.labels import (
+        TREND_LABELS,
+        TREND_TYPE,
+        IntervalCollector,
+        write_intervals,
+    )
+    from src.utils.logger import get_logger
+
+    logger = get_logger("CHUNKED_PIPELINE", log_level=config["base"]["log_level"])
+    chunk_size = chunk_size or config["base"].get("chunk_size", DEFAULT_CHUNK_SIZE)
+    logger.info(f"Chunk size: {chunk_size}")
+    column_for_macd = config["featurize"]["trend_detection"]["column_for_macd"]
+    column_with_trend = config["featurize"]["trend_detection"]["column_with_trend"]
+    column_with_anomaly = config["featurize"]["volume_anomaly"]["column_with_anomaly"]
+
+    trend_detector = OnlineTrendDetector.from_config(config)
+    volume_detector = OnlineVolumeAnomalyDetector.from_config(config)
+    segments, anomalies = [], []
+    rows = 0
+    for batch in iter_batches(
+        raw_path, chunk_size, ["date", "volume", column_for_macd]
+    ):
+        logger.info(f"Detect trend and anomaly in rows {rows}-{rows + len(batch)}")
+        close = column_to_numpy(batch.column(column_for_macd))
+        segments.extend(trend_detector.update(close))
+        anomalies.extend(
+            volume_detector.update(
+                column_to_numpy(batch.column("date")),
+                column_to_numpy(batch.column("volume")),
+            )
+        )
+        rows += len(batch)
+    segments.extend(trend_detector.flush())
+    anomalies.extend(volume_detector.flush())
+    logger.info(f"Found {len(segments)} trend segments and {len(anomalies)} anomalies")
+
+    schema = pa.ipc.open_file(pa.memory_map(raw_path)).schema.remove_metadata()
+    schema = schema.append(pa.field(column_with_trend, TREND_TYPE))
+    schema = schema.append(pa.field(column_with_anomaly, pa.bool_()))
+    collectors = [IntervalCollector(TREND_LABELS), IntervalCollector()]
+    logger.info(f"Writing data to path: {result_path}")
+    write_batches(
+        label_batches(
+            iter_batches(raw_path, chunk_size),
+            segments,
+            anomalies,
+            column_with_trend,
+            column_with_anomaly,
+            collectors,
+        ),
+        result_path,
+        schema,
+        compression=config["base"].get("io_compression", DEFAULT_COMPRESSION),
+    )
+    for column, collector in zip([column_with_trend, column_with_anomaly], collectors):
+        write_intervals(collector.frame(), result_path, column, rows)
+    return rows
+
+
+def run_chunked(config_path: Text, chunk_size: Optional[int] = None):
+    """
+    Run preprocessing, both detectors and concat over raw file of config by chunks.
+
+    Args:
+        config_path {Text}: path to config
+        chunk_size {Optional[int]}: Number of rows in chunk, `base.chunk_size` from
+            config if not set.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    label_file(
+        config["data"]["raw"],
+        config["data"]["result_with_trend_and_anomaly"],
+        config,
+        chunk_size,
+    )
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument(
+        "--chunk-size", dest="chunk_size", type=int, help="number of rows in chunk"
+    )
+    args = args_parser.parse_args()
+    run_chunked(config_path=args.config, chunk_size=args.chunk_size)
@@ -0,0 +1,70 @@
+"""Provides fast exponentially weighted means and MACD for whole series."""
+
+from typing import Sequence
+
+import numpy as np
+
+MacdVariant = tuple[int, int, int, int]
+
+
+def ewm_mean(values: np.ndarray, span: int, min_periods: int = 0) -> np.ndarray:
+    """
+    `Series.ewm(span=span, min_periods=min_periods, adjust=False).mean()`.
+
+    Args:
+        values {np.ndarray}: Series.
+        span {int}: Decay in terms of span.
+        min_periods {int}: Minimum number of observations to have a value.
+
+    Returns:
+        np.ndarray: Exponentially weighted mean, float64.
+    """
+    from src.utils.kernels import ewm_means
+
+    return ewm_means(values, np.array([span], dtype=np.float64), [min_periods])[0]
+
+
+def macd_lines(
+    values: np.ndarray, variants: Sequence[MacdVariant], dtype=np.float64
+) -> list[dict[str, np.ndarray]]:
+    """
+    MACD and signal line of several variants from one pass over the series.
+
+    Means of all distinct spans are computed in one pass over the series and shared
+    by all variants which use them, no DataFrame columns are created. Values are
+    computed in float64 and converted to `dtype` at the end.
+
+    Args:
+        values {np.ndarray}: Series, e.g. close price.
+        variants {Sequence[MacdVariant]}: (sm, lm, ds, ps) of each variant, see
+            `macd`.
+        dtype {np.dtype}: Type of returned arrays, float64 or float32.
+
+    Returns:
+        list[dict[str, np.ndarray]]: `macd` and `signal_line` of each variant.
+    """
+    from src.utils.kernels import ewm_means
+
+    spans = list(dict.fromkeys(span for sm, lm, _, _ in variants for span in (sm, lm)))
+    means = dict(
+        zip(
+            spans,
+            ewm_means(
+                np.ascontiguousarray(values, dtype=np.float64),
+                np.array(spans, dtype=np.float64),
+                np.array(spans, dtype=np.int64),
+            ),
+        )
+    )
+
+    lines = []
+    for sm, lm, ds, ps in variants:
+        line = means[sm] - means[lm]
+        signal_line = ewm_mean(line, ds, min_periods=ps)
+        lines.append(
+            {
+                "macd": line.astype(dtype, copy=False),
+                "signal_line": signal_line.astype(dtype, copy=False),
+            }
+        )
+    return lines
@@ -1,16 +1,26 @@
 import argparse
 import sys
 import warnings
-from typing import Optional, Text
+from typing import Optional, Sequence, Text
 
-import pandas as pd
+import numpy as np
 from envyaml import EnvYAML
 from pandas import DataFrame
 
 warnings.filterwarnings("ignore")
 
+MACD_COLUMNS = ["macd", "signal_line"]
 
-def macd(data: DataFrame, column: str, sm: int, lm: int, ds: int, ps: int) -> DataFrame:
+
+def macd(
+    data: DataFrame,
+    column: str,
+    sm: int,
+    lm: int,
+    ds: int,
+    ps: int,
+    dtype: str = "float64",
+) -> DataFrame:
     """
     Build Moving Average Convergence Divergence.
 
@@ -21,22 +31,108 @@ def macd(data: DataFrame, column: str, sm: int, lm: int, ds: int, ps: int) -> Da
         lm {int}: Decay in terms of span.
         ds {int}: Decay in terms of center of mass for signal line.
         ps {int}: Decay in terms of span for signal line.
+        dtype {str}: Type of new columns, "float64" or "float32".
 
     Returns:
         DataFrame: Result df with signal line and MACD.
     """
+    from src.features.indicators import macd_lines
 
-    data[f"sema_{column}_{sm}"] = (
-        data[column].ewm(span=sm, min_periods=sm, adjust=False).mean()
-    )
-    data[f"lema_{column}_{lm}"] = (
-        data[column].ewm(span=lm, min_periods=lm, adjust=False).mean()
-    )
+    lines = macd_lines(data[column].to_numpy(), [(sm, lm, ds, ps)], dtype)[0]
+    for name in MACD_COLUMNS:
+        data[name] = lines[name]
+    return data
 
-    data["macd"] = data[f"sema_{column}_{sm}"] - data[f"lema_{column}_{lm}"]
-    data["signal_line"] = data.macd.ewm(span=ds, min_periods=ps, adjust=False).mean()
-    data.drop([f"sema_{column}_{sm}", f"lema_{column}_{lm}"], axis=1, inplace=True)
 
+def cached_macd(
+    data: DataFrame,
+    column: str,
+    variants: Sequence[tuple[int, int, int, int]],
+    dtype: str = "float64",
+    cache=None,
+) -> list[dict[str, np.ndarray]]:
+    """
+    MACD and signal line of several variants, taken from cache when they were built
+    for the same values.
+
+    Variants which are not cached are computed together from one pass over the
+    column. Cached columns are versioned by the sources of `indicators` and of both
+    versions of the EWM kernel which computes them.
+
+    Args:
+        data {DataFrame}: Initial data.
+        column {str}: Name of column for which build MACD.
+        variants {Sequence[tuple[int, int, int, int]]}: (sm, lm, ds, ps) of each
+            variant, see `macd`.
+        dtype {str}: Type of columns, "float64" or "float32".
+        cache {Optional[ColumnCache]}: Cache of derived columns.
+
+    Returns:
+        list[dict[str, np.ndarray]]: MACD and signal line of each variant.
+    """
+    from src.features import indicators
+    from src.utils import kernels
+    from src.utils.cache import hash_array, load_columns, store_columns
+
+    values = data[column].to_numpy()
+    if cache is None:
+        return indicators.macd_lines(values, variants, dtype)
+
+    data_hash = hash_array(values)
+    code = (indicators, kernels, kernels.SOURCE_PATH)
+    params = [
+        dict(column=column, sm=sm, lm=lm, ds=ds, ps=ps, dtype=dtype)
+        for sm, lm, ds, ps in variants
+    ]
+    lines = [
+        load_columns(cache, data_hash, code, variant_params, MACD_COLUMNS)
+        for variant_params in params
+    ]
+    missing = [number for number, columns in enumerate(lines) if columns is None]
+    if missing:
+        computed = indicators.macd_lines(
+            values, [variants[number] for number in missing], dtype
+        )
+        for number, columns in zip(missing, computed):
+            store_columns(cache, data_hash, code, params[number], columns)
+            lines[number] = columns
+    return lines
+
+
+def add_macd_features(data: DataFrame, config: EnvYAML) -> DataFrame:
+    """
+    Add MACD and signal line with parameters from config.
+
+    Columns are read from the cache of derived columns when `cache_dir` is set in
+    the `base` section of config.
+
+    Args:
+        data {DataFrame}: Initial data.
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        DataFrame: Data with signal line and MACD.
+    """
+    from src.utils.cache import open_cache
+    from src.utils.instrumentation import span
+
+    decay_sm = config["featurize"]["trend_detection"]["decay_sm"]
+    decay_lm = config["featurize"]["trend_detection"]["decay_lm"]
+    decay_signal = config["featurize"]["trend_detection"]["decay_signal"]
+    period_signal = config["featurize"]["trend_detection"]["period_signal"]
+    column_for_macd = config["featurize"]["trend_detection"]["column_for_macd"]
+    macd_dtype = config["featurize"]["trend_detection"].get("macd_dtype", "float64")
+
+    with span("ewm", rows=len(data)):
+        columns = cached_macd(
+            data,
+            column_for_macd,
+            [(decay_sm, decay_lm, decay_signal, period_signal)],
+            macd_dtype,
+            open_cache(config),
+        )[0]
+    for name in MACD_COLUMNS:
+        data[name] = columns[name]
     return data
 
 
@@ -51,6 +147,8 @@ def preprocess_for_trend_detection(
     """
     config = EnvYAML(config_path)
     sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import read_frame, write_frame_with_config
+    from src.utils.instrumentation import span
     from src.utils.logger import get_logger
 
     logger = get_logger(
@@ -58,18 +156,15 @@ def preprocess_for_trend_detection(
     )
 
     logger.info("Read initial data")
-    data = pd.read_feather(config["data"]["raw"])
-
-    decay_sm = config["featurize"]["trend_detection"]["decay_sm"]
-    decay_lm = config["featurize"]["trend_detection"]["decay_lm"]
-    decay_signal = config["featurize"]["trend_detection"]["decay_signal"]
-    period_signal = config["featurize"]["trend_detection"]["period_signal"]
-    column_for_macd = config["featurize"]["trend_detection"]["column_for_macd"]
+    with span("read") as step:
+        data = read_frame(config["data"]["raw"])
+        step.add_rows(len(data))
 
-    data = macd(data, column_for_macd, decay_sm, decay_lm, decay_signal, period_signal)
+    data = add_macd_features(data, config)
     path = config["data"]["processed_trend_detection"]
     logger.info(f"Writing data to path: {path}")
-    data.to_feather(path)
+    with span("write", rows=len(data)):
+        write_frame_with_config(data, path, config)
 
 
 if __name__ == "__main__":
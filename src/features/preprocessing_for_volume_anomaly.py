@@ -1,15 +1,88 @@
 import argparse
 import sys
 import warnings
-from typing import Optional, Text
+from typing import Optional, Sequence, Text
 
-import pandas as pd
+import numpy as np
 from envyaml import EnvYAML
-from pandas import DataFrame
+from pandas import DataFrame, Series
 
 warnings.filterwarnings("ignore")
 
 
+def rolling_means(
+    volume: Series, windows: Sequence[int], cache=None
+) -> dict[int, np.ndarray]:
+    """
+    Rolling means of volume taken from cache when they were built for the same
+    volume.
+
+    Args:
+        volume {Series}: Volume.
+        windows {Sequence[int]}: Windows of rolling means.
+        cache {Optional[ColumnCache]}: Cache of derived columns.
+
+    Returns:
+        dict[int, np.ndarray]: Rolling mean by window.
+    """
+    from src.utils.cache import cached_columns, hash_array
+
+    volume_hash = hash_array(volume.to_numpy()) if cache else None
+    means = {}
+    for window in windows:
+        if window not in means:
+            name = f"rolling_mean_{window}"
+            means[window] = cached_columns(
+                cache,
+                volume_hash,
+                rolling_means,
+                dict(window=window),
+                [name],
+                lambda: {name: volume.rolling(window).mean().to_numpy()},
+            )[name]
+    return means
+
+
+def add_rolling_means(data: DataFrame, config: EnvYAML) -> DataFrame:
+    """
+    Add rolling means of volume and change of indicator mean.
+
+    Rolling means are read from the cache of derived columns when `cache_dir` is set
+    in the `base` section of config.
+
+    Args:
+        data {DataFrame}: Initial data.
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        DataFrame: Data with rolling means.
+    """
+    from src.utils.cache import open_cache
+    from src.utils.instrumentation import span
+    from src.utils.logger import get_logger
+
+    logger = get_logger(
+        "PREPROCESSING_FOR_VOLUME_DETECTION", log_level=config["base"]["log_level"]
+    )
+
+    columns_rolling_mean = config["featurize"]["volume_anomaly"]["columns_rolling_mean"]
+    logger.info(f"Columns for rolling mean: {columns_rolling_mean}")
+    mean_indicator = config["featurize"]["volume_anomaly"]["mean_indicator"]
+    logger.info(f"Window for mean which will be used like indicator: {mean_indicator}")
+    with span("rolling_means", rows=len(data)):
+        means = rolling_means(
+            data["volume"], [*columns_rolling_mean, mean_indicator], open_cache(config)
+        )
+
+    for mean in columns_rolling_mean:
+        data[f"rolling_mean_{mean}"] = means[mean]
+    data[f"rolling_mean_{mean_indicator}"] = means[mean_indicator]
+    data[f"rolling_mean_{mean_indicator}_pct_ch"] = data[
+        f"rolling_mean_{mean_indicator}"
+    ].pct_change()
+    return data
+
+
 def preprocess_for_volume_anomaly(
     config_path: Text,
 ) -> Optional[DataFrame]:
@@ -21,6 +94,8 @@ def preprocess_for_volume_anomaly(
     """
     config = EnvYAML(config_path)
     sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import read_frame, write_frame_with_config
+    from src.utils.instrumentation import span
     from src.utils.logger import get_logger
 
     logger = get_logger(
@@ -28,24 +103,15 @@ def preprocess_for_volume_anomaly(
     )
 
     logger.info("Read initial data")
-    data = pd.read_feather(config["data"]["raw"])
-    columns_rolling_mean = config["featurize"]["volume_anomaly"]["columns_rolling_mean"]
-    logger.info(f"Columns for rolling mean: {columns_rolling_mean}")
-    for mean in columns_rolling_mean:
-        data[f"rolling_mean_{mean}"] = data["volume"].rolling(mean).mean()
-
-    mean_indicator = config["featurize"]["volume_anomaly"]["mean_indicator"]
-    logger.info(f"Window for mean which will be used like indicator: {mean_indicator}")
-    data[f"rolling_mean_{mean_indicator}"] = (
-        data["volume"].rolling(mean_indicator).mean()
-    )
-    data[f"rolling_mean_{mean_indicator}_pct_ch"] = data[
-        f"rolling_mean_{mean_indicator}"
-    ].pct_change()
+    with span("read") as step:
+        data = read_frame(config["data"]["raw"], columns=["date", "volume"])
+        step.add_rows(len(data))
+    data = add_rolling_means(data, config)
 
     path = config["data"]["processed_volume_anomaly"]
     logger.info(f"Writing data to path: {path}")
-    data.to_feather(path)
+    with span("write", rows=len(data)):
+        write_frame_with_config(data, path, config)
 
 
 if __name__ == "__main__":
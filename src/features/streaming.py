@@ -0,0 +1,175 @@
+"""Provides incremental versions of pandas window functions used in preprocessing."""
+
+import collections
+import math
+from typing import Optional
+
+
+class EwmMean:
+    """
+    Incremental `Series.ewm(span=span, min_periods=min_periods, adjust=False).mean()`.
+
+    Follows the arithmetic of pandas step by step, so values are the same as in
+    batch computation.
+    """
+
+    def __init__(self, span: int, min_periods: int = 0):
+        """
+        Create empty state.
+
+        Args:
+            span {int}: Decay in terms of span.
+            min_periods {int}: Minimum number of observations to have a value.
+        """
+        com = (span - 1) / 2.0
+        self.alpha = 1.0 / (1.0 + com)
+        self.min_periods = max(int(min_periods), 1)
+        self.weighted: Optional[float] = None
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, value: float) -> float:
+        """
+        Add next value.
+
+        Args:
+            value {float}: Next value of series.
+
+        Returns:
+            float: Exponentially weighted mean, NaN until enough observations.
+        """
+        is_observation = value == value
+        self.nobs += is_observation
+        if self.weighted is None:
+            self.weighted = value
+        elif self.weighted == self.weighted:
+            self.old_wt *= 1.0 - self.alpha
+            if is_observation:
+                if self.weighted != value:
+                    self.weighted = self.old_wt * self.weighted + self.alpha * value
+                    self.weighted /= self.old_wt + self.alpha
+                self.old_wt = 1.0
+        elif is_observation:
+            self.weighted = value
+        return self.weighted if self.nobs >= self.min_periods else math.nan
+
+
+class RollingMean:
+    """
+    Incremental `Series.rolling(window).mean()`.
+
+    Keeps the last `window` values in a ring buffer and the compensated running sum
+    in the same way as pandas, so values are the same as in batch computation.
+    """
+
+    def __init__(self, window: int):
+        """
+        Create empty state.
+
+        Args:
+            window {int}: Size of window.
+        """
+        self.window = window
+        self.values: collections.deque = collections.deque(maxlen=window)
+        self.nobs = 0
+        self.neg_ct = 0
+        self.sum_x = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.num_consecutive_same_value = 0
+        self.prev_value = math.nan
+
+    def _reset(self, value: float):
+        self.nobs = 0
+        self.neg_ct = 0
+        self.sum_x = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.num_consecutive_same_value = 0
+        self.prev_value = value
+
+    def _add(self, value: float):
+        if value == value:
+            self.nobs += 1
+            y = value - self.compensation_add
+            t = self.sum_x + y
+            self.compensation_add = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, value) < 0:
+                self.neg_ct += 1
+            if value == self.prev_value:
+                self.num_consecutive_same_value += 1
+            else:
+                self.num_consecutive_same_value = 1
+            self.prev_value = value
+
+    def _remove(self, value: float):
+        if value == value:
+            self.nobs -= 1
+            y = -value - self.compensation_remove
+            t = self.sum_x + y
+            self.compensation_remove = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, value) < 0:
+                self.neg_ct -= 1
+
+    def update(self, value: float) -> float:
+        """
+        Add next value.
+
+        Args:
+            value {float}: Next value of series.
+
+        Returns:
+            float: Mean of last `window` values, NaN if any of them is missing.
+        """
+        value = float(value)
+        if not self.values or self.window == 1:
+            self.values.clear()
+            self._reset(value)
+        elif len(self.values) == self.window:
+            self._remove(self.values[0])
+        self.values.append(value)
+        self._add(value)
+
+        if self.nobs >= self.window and self.nobs > 0:
+            if self.num_consecutive_same_value >= self.nobs:
+                return self.prev_value
+            result = self.sum_x / self.nobs
+            if self.neg_ct == 0 and result < 0:
+                return 0.0
+            if self.neg_ct == self.nobs and result > 0:
+                return 0.0
+            return result
+        return math.nan
+
+
+class PctChange:
+    """Incremental `Series.pct_change()` with forward filled missing values."""
+
+    def __init__(self):
+        """Create empty state."""
+        self.previous = math.nan
+        self.last = math.nan
+
+    def update(self, value: float) -> float:
+        """
+        Add next value.
+
+        Args:
+            value {float}: Next value of series.
+
+        Returns:
+            float: Change relative to the previous value.
+        """
+        if value == value:
+            self.last = value
+        try:
+            change = self.last / self.previous - 1
+        except ZeroDivisionError:
+            if self.last != self.last or self.last == 0:
+                change = math.nan
+            else:
+                change = math.copysign(math.inf, self.last * self.previous)
+        self.previous = self.last
+        return change
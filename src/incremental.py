@@ -0,0 +1,314 @@
+import argparse
+import copy
+import json
+import os
+import pickle
+import sys
+import warnings
+from typing import Iterator, Optional, Text
+
+import numpy as np
+import pyarrow as pa
+from envyaml import EnvYAML
+
+warnings.filterwarnings("ignore")
+
+STATE_VERSION = 2
+STATE_SUFFIX = ".state.pkl"
+
+
+def state_path(result_path: Text) -> Text:
+    """
+    Path to checkpoint saved next to the result.
+
+    Args:
+        result_path {Text}: Path to data with trend and anomaly.
+
+    Returns:
+        Text: `<result without extension>.state.pkl`.
+    """
+    return f"{os.path.splitext(result_path)[0]}{STATE_SUFFIX}"
+
+
+def state_params(config: EnvYAML) -> Text:
+    """
+    Parameters the checkpoint depends on, checkpoint of other parameters is not used.
+
+    Args:
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        Text: Parameters of both detectors as JSON.
+    """
+    return json.dumps(
+        {
+            "version": STATE_VERSION,
+            "trend_detection": dict(config["featurize"]["trend_detection"]),
+            "volume_anomaly": dict(config["featurize"]["volume_anomaly"]),
+        },
+        sort_keys=True,
+        default=str,
+    )
+
+
+def keep_from(trend_detector, volume_detector) -> int:
+    """
+    First row which segments emitted after this point can cover.
+
+    Trend segments start at the last confirmed extremum, flat segments at the
+    oldest flat extremum of the rolling window (or later than the kept part of
+    signal line if there are none) and anomalies at open candidates.
+
+    Args:
+        trend_detector {OnlineTrendDetector}: Detector before `flush`.
+        volume_detector {OnlineVolumeAnomalyDetector}: Detector before `flush`.
+
+    Returns:
+        int: Row.
+    """
+    trend = trend_detector.last_extremum or 0
+    flat = (
+        trend_detector.flat_indices[0]
+        if trend_detector.flat_indices
+        else trend_detector.offset
+    )
+    anomaly = (
+        volume_detector.candidates[0][0]
+        if volume_detector.candidates
+        else volume_detector.total
+    )
+    return min(trend, flat, anomaly)
+
+
+def load_state(
+    path: Text, raw_path: Text, result_path: Text, config: EnvYAML
+) -> tuple[Optional[dict], Optional[Text]]:
+    """
+    Read checkpoint if it can continue the result.
+
+    Args:
+        path {Text}: Path to checkpoint.
+        raw_path {Text}: Path to raw data.
+        result_path {Text}: Path to data with trend and anomaly.
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        tuple[Optional[dict], Optional[Text]]: Checkpoint or None and the reason why
+            it is not used.
+    """
+    from src.utils.arrow_io import column_to_numpy, iter_batches
+    from src.utils.block_index import file_version
+
+    try:
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+    except FileNotFoundError:
+        return None, "there is no checkpoint"
+    if state.get("params") != state_params(config):
+        return None, "parameters changed"
+    if not os.path.exists(result_path) or state["result"] != file_version(result_path):
+        return None, "result was written by another run"
+    if state["rows"]:
+        batch = next(iter_batches(raw_path, 1, ["date"], start=state["rows"] - 1), None)
+        if (
+            batch is None
+            or int(column_to_numpy(batch.column("date")).view(np.int64)[0])
+            != state["last_date"]
+        ):
+            return None, "raw data does not continue the checkpoint"
+    return state, None
+
+
+def _prefix_batches(
+    reader: pa.ipc.RecordBatchFileReader, stop: int
+) -> Iterator[pa.RecordBatch]:
+    """
+    Rows of previous result before `stop`.
+
+    Args:
+        reader {pa.ipc.RecordBatchFileReader}: Previous result.
+        stop {int}: Row after the last row to keep.
+
+    Yields:
+        pa.RecordBatch: Record batches of previous result.
+    """
+    row = 0
+    for number in range(reader.num_record_batches):
+        if row >= stop:
+            return
+        batch = reader.get_batch(number)
+        yield batch.slice(0, stop - row)
+        row += batch.num_rows
+
+
+def update_result(
+    raw_path: Text,
+    result_path: Text,
+    config: EnvYAML,
+    chunk_size: Optional[int] = None,
+    checkpoint: Optional[Text] = None,
+) -> dict:
+    """
+    Bring result up to date with raw data to which new bars were appended.
+
+    Online detectors are restored from the checkpoint saved by the previous run and
+    get only the new bars. Rows before the first row which a new or not yet final
+    segment covers are copied from the previous result, the rest is labelled again,
+    intervals of trend and anomaly are saved next to the result. Without a usable
+    checkpoint the whole raw file is processed. Result is the same as the one of a
+    full run over all bars.
+
+    Args:
+        raw_path {Text}: Path to raw data sorted by date.
+        result_path {Text}: Path to data with trend and anomaly.
+        config {EnvYAML}: Yaml file with configurations.
+        chunk_size {Optional[int]}: Number of rows in chunk, `base.chunk_size` from
+            config if not set.
+        checkpoint {Optional[Text]}: Path to checkpoint, next to the result if not set.
+
+    Returns:
+        dict: Numbers of `rows`, `new_rows` and `rewritten_rows`.
+    """
+    from src.chunked import DEFAULT_CHUNK_SIZE, label_batches
+    from src.models.online_trend_detection import OnlineTrendDetector
+    from src.models.online_volume_anomaly import OnlineVolumeAnomalyDetector
+    from src.utils.arrow_io import column_to_numpy, iter_batches
+    from src.utils.block_index import file_version
+    from src.utils.instrumentation import span
+    from src.utils.labels import TREND_TYPE, write_result_batches
+    from src.utils.logger import get_logger
+
+    logger = get_logger("INCREMENTAL", log_level=config["base"]["log_level"])
+    chunk_size = chunk_size or config["base"].get("chunk_size", DEFAULT_CHUNK_SIZE)
+    checkpoint = checkpoint or state_path(result_path)
+    column_for_macd = config["featurize"]["trend_detection"]["column_for_macd"]
+    column_with_trend = config["featurize"]["trend_detection"]["column_with_trend"]
+    column_with_anomaly = config["featurize"]["volume_anomaly"]["column_with_anomaly"]
+
+    state, reason = load_state(checkpoint, raw_path, result_path, config)
+    if state is None:
+        logger.info(f"Process all rows: {reason}")
+        state = {
+            "rows": 0,
+            "trend": OnlineTrendDetector.from_config(config),
+            "volume": OnlineVolumeAnomalyDetector.from_config(config),
+            "segments": [],
+            "anomalies": [],
+            "open_from": 0,
+        }
+    trend_detector, volume_detector = state["trend"], state["volume"]
+    segments, anomalies = [], []
+    rows, last_date = state["rows"], state.get("last_date")
+
+    with span("detect") as step:
+        for batch in iter_batches(
+            raw_path, chunk_size, ["date", "volume", column_for_macd], start=rows
+        ):
+            logger.info(f"Detect trend and anomaly in rows {rows}-{rows + len(batch)}")
+            dates = column_to_numpy(batch.column("date"))
+            segments.extend(
+                trend_detector.update(column_to_numpy(batch.column(column_for_macd)))
+            )
+            anomalies.extend(
+                volume_detector.update(dates, column_to_numpy(batch.column("volume")))
+            )
+            rows += len(batch)
+            last_date = int(dates.view(np.int64)[-1])
+            step.add_rows(len(batch))
+    new_rows = rows - state["rows"]
+    if state["rows"] and not new_rows:
+        logger.info("There are no new rows")
+        return {"rows": rows, "new_rows": 0, "rewritten_rows": 0}
+
+    detectors = copy.deepcopy((trend_detector, volume_detector))
+    open_segments, open_anomalies = trend_detector.flush(), volume_detector.flush()
+    first_changed = min(
+        [state["rows"], state["open_from"]]
+        + [start for start, *_ in segments + open_segments + anomalies + open_anomalies]
+    )
+    logger.info(f"Rewrite rows {first_changed}-{rows} of {result_path}")
+
+    previous = None
+    if first_changed:
+        previous = pa.ipc.open_file(pa.memory_map(result_path))
+        schema = previous.schema.remove_metadata()
+    else:
+        schema = pa.ipc.open_file(pa.memory_map(raw_path)).schema.remove_metadata()
+        schema = schema.append(pa.field(column_with_trend, TREND_TYPE))
+        schema = schema.append(pa.field(column_with_anomaly, pa.bool_()))
+
+    def batches() -> Iterator[pa.RecordBatch]:
+        if previous is not None:
+            yield from _prefix_batches(previous, first_changed)
+        yield from label_batches(
+            iter_batches(raw_path, chunk_size, start=first_changed),
+            [segment for segment in state["segments"] if segment[1] >= first_changed]
+            + segments
+            + open_segments,
+            [anomaly for anomaly in state["anomalies"] if anomaly[1] >= first_changed]
+            + anomalies
+            + open_anomalies,
+            column_with_trend,
+            column_with_anomaly,
+            first_row=first_changed,
+        )
+
+    with span("write", rows=rows - first_changed):
+        write_result_batches(batches(), result_path, schema, config)
+
+    bound = keep_from(*detectors)
+    state = {
+        "params": state_params(config),
+        "rows": rows,
+        "last_date": last_date,
+        "result": file_version(result_path),
+        "trend": detectors[0],
+        "volume": detectors[1],
+        "segments": [
+            segment for segment in state["segments"] + segments if segment[1] >= bound
+        ],
+        "anomalies": [
+            anomaly for anomaly in state["anomalies"] + anomalies if anomaly[1] >= bound
+        ],
+        "open_from": min(
+            [rows] + [start for start, *_ in open_segments + open_anomalies]
+        ),
+    }
+    temporary = f"{checkpoint}.tmp"
+    with open(temporary, "wb") as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, checkpoint)
+    logger.info(f"Saved checkpoint to {checkpoint}")
+    return {"rows": rows, "new_rows": new_rows, "rewritten_rows": rows - first_changed}
+
+
+def run_incremental(config_path: Text, chunk_size: Optional[int] = None) -> dict:
+    """
+    Update result of config with bars appended to its raw file.
+
+    Args:
+        config_path {Text}: path to config
+        chunk_size {Optional[int]}: Number of rows in chunk, `base.chunk_size` from
+            config if not set.
+
+    Returns:
+        dict: Numbers of `rows`, `new_rows` and `rewritten_rows`.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    return update_result(
+        config["data"]["raw"],
+        config["data"]["result_with_trend_and_anomaly"],
+        config,
+        chunk_size,
+    )
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument(
+        "--chunk-size", dest="chunk_size", type=int, help="number of rows in chunk"
+    )
+    args = args_parser.parse_args()
+    run_incremental(config_path=args.config, chunk_size=args.chunk_size)
@@ -1,14 +1,271 @@
 import argparse
 import sys
 import warnings
-from typing import Optional, Text
+from typing import Iterable, Iterator, Optional, Sequence, Text
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from envyaml import EnvYAML
 from pandas import DataFrame
 
 warnings.filterwarnings("ignore")
 
+DEFAULT_CHUNK_SIZE = 1048576
+
+
+def is_sorted(dates: np.ndarray) -> bool:
+    """
+    Check that dates do not decrease.
+
+    Args:
+        dates {np.ndarray}: Dates as int64.
+
+    Returns:
+        bool: True if dates are sorted.
+    """
+    return bool(np.all(dates[1:] >= dates[:-1]))
+
+
+def merge_positions(dates: np.ndarray, source_dates: np.ndarray) -> np.ndarray:
+    """
+    Find rows of source with the same dates by merge-join of two sorted columns.
+
+    Stable sort of two concatenated sorted runs is a single linear merge, rows of
+    source go before rows with the same date, so the last source row at or before
+    every row is its match when dates are equal.
+
+    Args:
+        dates {np.ndarray}: Sorted dates as int64.
+        source_dates {np.ndarray}: Sorted dates of source as int64.
+
+    Returns:
+        np.ndarray: Position in source of each row, -1 if there is no such date.
+    """
+    order = np.argsort(np.concatenate([source_dates, dates]), kind="stable")
+    from_source = order < len(source_dates)
+    last_source = np.maximum.accumulate(np.where(from_source, order, -1))
+    positions = np.empty(len(dates), dtype=np.int64)
+    positions[order[~from_source] - len(source_dates)] = last_source[~from_source]
+    found = positions >= 0
+    found[found] = source_dates[positions[found]] == dates[found]
+    positions[~found] = -1
+    return positions
+
+
+def make_source(dates: np.ndarray, columns: dict[Text, np.ndarray]) -> dict:
+    """
+    Prepare columns of result to be joined by date.
+
+    Args:
+        dates {np.ndarray}: Dates of rows.
+        columns {dict[Text, np.ndarray]}: Columns to join by name.
+
+    Returns:
+        dict: `dates` as sorted int64 and `columns` in the same order.
+    """
+    dates = np.asarray(dates).view(np.int64)
+    if not is_sorted(dates):
+        order = np.argsort(dates, kind="stable")
+        dates = dates[order]
+        columns = {name: values[order] for name, values in columns.items()}
+    return {"dates": dates, "columns": columns}
+
+
+def read_source(path: Text, columns: Sequence[Text]) -> dict:
+    """
+    Read only dates and requested columns of result, from their intervals if they
+    are saved next to it.
+
+    Args:
+        path {Text}: Path to result.
+        columns {Sequence[Text]}: Columns to join.
+
+    Returns:
+        dict: Source, see `make_source`.
+    """
+    from src.utils.arrow_io import read_arrays
+    from src.utils.labels import read_labels
+
+    dates = read_arrays(path, ["date"])["date"]
+    return make_source(
+        dates, {column: read_labels(path, column, len(dates)) for column in columns}
+    )
+
+
+def join_positions(dates: np.ndarray, source: dict) -> np.ndarray:
+    """
+    Find rows of source with the same dates as sorted rows.
+
+    Only the part of source between the first and the last dates is merged, when
+    it has exactly the same dates rows are zipped by position.
+
+    Args:
+        dates {np.ndarray}: Sorted dates as int64.
+        source {dict}: Source, see `make_source`.
+
+    Returns:
+        np.ndarray: Position in source of each row, -1 if there is no such date.
+    """
+    if len(dates) == 0:
+        return np.empty(0, dtype=np.int64)
+    start = np.searchsorted(source["dates"], dates[0])
+    stop = np.searchsorted(source["dates"], dates[-1], side="right")
+    part = source["dates"][start:stop]
+    if len(part) == len(dates) and np.array_equal(part, dates):
+        return np.arange(start, stop)
+    positions = merge_positions(dates, part)
+    return np.where(positions >= 0, positions + start, -1)
+
+
+def take_rows(values: np.ndarray, positions: np.ndarray) -> pd.Series:
+    """
+    Take rows of source column, rows without match are missing.
+
+    Args:
+        values {np.ndarray}: Column of source.
+        positions {np.ndarray}: Positions from `join_positions`.
+
+    Returns:
+        pd.Series: Joined column.
+    """
+    found = positions >= 0
+    if found.all():
+        return pd.Series(values[positions])
+    column = pd.Series(values[positions[found]], index=np.flatnonzero(found))
+    return column.reindex(np.arange(len(positions)))
+
+
+def joined_schema(schema: pa.Schema, sources: list[dict]) -> pa.Schema:
+    """
+    Schema of batches with columns of sources.
+
+    Args:
+        schema {pa.Schema}: Schema of sorted batches.
+        sources {list[dict]}: Sources, see `make_source`.
+
+    Returns:
+        pa.Schema: Schema with fields of joined columns.
+    """
+    for source in sources:
+        for name, values in source["columns"].items():
+            empty = take_rows(values, np.empty(0, dtype=np.int64))
+            schema = schema.append(pa.field(name, pa.Array.from_pandas(empty).type))
+    return schema
+
+
+def join_batches(
+    batches: Iterable[pa.RecordBatch], sources: list[dict], schema: pa.Schema
+) -> Iterator[pa.RecordBatch]:
+    """
+    Add columns of sources to sorted record batches.
+
+    Joined columns get types of their fields in schema, so a batch without
+    matching dates has the same schema as others.
+
+    Args:
+        batches {Iterable[pa.RecordBatch]}: Rows sorted by date.
+        sources {list[dict]}: Sources, see `make_source`.
+        schema {pa.Schema}: Schema of joined batches.
+
+    Yields:
+        pa.RecordBatch: Rows with columns of all sources.
+    """
+    from src.utils.arrow_io import column_to_numpy
+
+    for batch in batches:
+        dates = column_to_numpy(batch.column("date")).view(np.int64)
+        columns = list(batch.columns)
+        for source in sources:
+            positions = join_positions(dates, source)
+            for name, values in source["columns"].items():
+                columns.append(
+                    pa.array(
+                        take_rows(values, positions),
+                        type=schema.field(name).type,
+                        from_pandas=True,
+                    )
+                )
+        yield pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def add_anomaly_to_trend(
+    data_trend: DataFrame, data_volume: DataFrame, config: EnvYAML
+) -> DataFrame:
+    """
+    Add column with volume anomaly to DataFrame with trend.
+
+    Rows are joined by date with `join_positions`, trend is sorted by date first if
+    it is not.
+
+    Args:
+        data_trend {DataFrame}: Result of trend detection.
+        data_volume {DataFrame}: Result of volume anomaly search.
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        DataFrame: Data with trend and anomaly.
+    """
+    from src.utils.logger import get_logger
+
+    logger = get_logger("CONCAT", log_level=config["base"]["log_level"])
+    column_with_anomaly = config["featurize"]["volume_anomaly"]["column_with_anomaly"]
+
+    dates = data_trend["date"].to_numpy().view(np.int64)
+    if not is_sorted(dates):
+        logger.info("Sort trend data by date")
+        data_trend = data_trend.iloc[np.argsort(dates, kind="stable")]
+        dates = data_trend["date"].to_numpy().view(np.int64)
+    data_trend = data_trend.reset_index(drop=True)
+
+    logger.info("Add to Trend DataFrame column with anomaly")
+    source = make_source(
+        data_volume["date"].to_numpy(),
+        {column_with_anomaly: data_volume[column_with_anomaly].to_numpy()},
+    )
+    data_trend[column_with_anomaly] = take_rows(
+        source["columns"][column_with_anomaly], join_positions(dates, source)
+    )
+    return data_trend
+
+
+def counted_batches(
+    batches: Iterable[pa.RecordBatch], step
+) -> Iterator[pa.RecordBatch]:
+    """
+    Pass batches through and count their rows in span.
+
+    Args:
+        batches {Iterable[pa.RecordBatch]}: Record batches.
+        step {Span}: Span which counts rows.
+
+    Yields:
+        pa.RecordBatch: The same batches.
+    """
+    for batch in batches:
+        step.add_rows(batch.num_rows)
+        yield batch
+
+
+def concat_sources(config: EnvYAML) -> list[tuple[Text, list[Text]]]:
+    """
+    Results whose columns are joined to the trend result.
+
+    Args:
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        list[tuple[Text, list[Text]]]: Path and columns of each result,
+            `data.concat_sources` or anomaly of volume result if it is not set.
+    """
+    sources = config["data"].get("concat_sources")
+    if not sources:
+        column_with_anomaly = config["featurize"]["volume_anomaly"][
+            "column_with_anomaly"
+        ]
+        return [(config["data"]["result_volume_anomaly"], [column_with_anomaly])]
+    return [(source["path"], list(source["columns"])) for source in sources]
+
 
 def concat(
     config_path: Text,
@@ -16,38 +273,55 @@ def concat(
     """
     Concat results from dataframe with trend and dataframe with volume anomaly.
 
+    Only dates and joined columns are read from other results, from intervals saved
+    next to them when they are there. Trend result is read and written in one pass
+    by record batches of `base.chunk_size` rows, it is sorted in memory only if its
+    dates are not sorted.
+
     Args:
         config_path {Text}: path to config
     """
     config = EnvYAML(config_path)
     sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import iter_batches, read_arrays, read_table
+    from src.utils.instrumentation import span
+    from src.utils.labels import write_result_batches
     from src.utils.logger import get_logger
 
     logger = get_logger("CONCAT", log_level=config["base"]["log_level"])
+    chunk_size = config["base"].get("chunk_size", DEFAULT_CHUNK_SIZE)
 
-    logger.info("Read volume data")
-    data_volume = pd.read_feather(config["data"]["result_volume_anomaly"])
-    logger.info("Read trend data")
-    data_trend = pd.read_feather(config["data"]["result_trend_detection"])
-    column_with_anomaly = config["featurize"]["volume_anomaly"]["column_with_anomaly"]
-
-    logger.info("Set index as `date`")
-    data_volume = data_volume.set_index("date")
-    data_trend = data_trend.set_index("date")
+    sources = []
+    for path, columns in concat_sources(config):
+        logger.info(f"Read {columns} from {path}")
+        with span("read") as step:
+            sources.append(read_source(path, columns))
+            step.add_rows(len(sources[-1]["dates"]))
 
-    logger.info("Sort dataframes by index")
-    data_volume = data_volume.sort_index()
-    data_trend = data_trend.sort_index()
+    path_trend = config["data"]["result_trend_detection"]
+    if is_sorted(read_arrays(path_trend, ["date"])["date"].view(np.int64)):
+        logger.info("Read trend data by batches")
+        batches = iter_batches(path_trend, chunk_size)
+    else:
+        logger.info("Sort trend data by date")
+        table = read_table(path_trend)
+        order = np.argsort(table.column("date").to_numpy(), kind="stable")
+        batches = table.take(order).to_batches(max_chunksize=chunk_size)
 
-    logger.info("Add to Trend DataFrame column with anomaly")
-    data_trend[column_with_anomaly] = data_volume[column_with_anomaly]
-
-    logger.info("Reset index")
-    data_trend.reset_index(inplace=True)
+    schema = joined_schema(
+        pa.ipc.open_file(pa.memory_map(path_trend)).schema.remove_metadata(), sources
+    )
 
     path = config["data"]["result_with_trend_and_anomaly"]
     logger.info(f"Writing data to path: {path}")
-    data_trend.to_feather(path)
+
+    with span("join_and_write") as step:
+        write_result_batches(
+            join_batches(counted_batches(batches, step), sources, schema),
+            path,
+            schema,
+            config,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,312 @@
+"""Provides online trend detection for a stream of bars."""
+
+import collections
+import math
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+from src.features.streaming import EwmMean, PctChange, RollingMean
+from src.models.trend_detection import define_trend
+
+Segment = tuple[int, int, str]
+
+
+class _ExtremumTracker:
+    """Confirms local extremes of given order as soon as all neighbours are known."""
+
+    def __init__(self, order: int):
+        """
+        Create empty state.
+
+        Args:
+            order {int}: Number of points for comparison.
+        """
+        self.order = order
+        self.next_center = 0
+        self.total = 0
+        self.last_missing = -1
+        self.values: collections.deque = collections.deque(maxlen=2 * order + 1)
+        self.centers: collections.deque = collections.deque(maxlen=order + 1)
+        self.largest: collections.deque = collections.deque()
+        self.smallest: collections.deque = collections.deque()
+        self.largest_before: collections.deque = collections.deque(maxlen=order + 1)
+        self.smallest_before: collections.deque = collections.deque(maxlen=order + 1)
+
+    def update(self, value: float) -> Optional[tuple[int, str, float]]:
+        """
+        Add next value and check the center `order` values before it.
+
+        Comparison is strict like `argrelextrema` with `np.greater`/`np.less`, a
+        center with NaN in its neighbourhood is not an extremum. Extremes of the
+        last `order` values before the center and of the last `order` values are
+        kept in monotonic wedges, so the cost of a value does not depend on order.
+
+        Args:
+            value {float}: Next value.
+
+        Returns:
+            Optional[tuple[int, str, float]]: Position, "min" or "max" and value of
+                confirmed extremum.
+        """
+        order, largest, smallest = self.order, self.largest, self.smallest
+        position = self.total
+        self.total += 1
+        if value != value:
+            self.last_missing = position
+            for_max, for_min = -math.inf, math.inf
+        else:
+            for_max = for_min = value
+        while largest and largest[-1][1] <= for_max:
+            largest.pop()
+        largest.append((position, for_max))
+        if largest[0][0] <= position - order:
+            largest.popleft()
+        while smallest and smallest[-1][1] >= for_min:
+            smallest.pop()
+        smallest.append((position, for_min))
+        if smallest[0][0] <= position - order:
+            smallest.popleft()
+        self.values.append(value)
+        self.centers.append(value)
+
+        center = position - order
+        extremum = None
+        if center >= 1 and self.last_missing < max(center - order, 0):
+            center_value = self.centers[0]
+            if center_value > self.largest_before[0] and center_value > largest[0][1]:
+                extremum = (center, "max", center_value)
+            elif (
+                center_value < self.smallest_before[0] and center_value < smallest[0][1]
+            ):
+                extremum = (center, "min", center_value)
+        self.largest_before.append(largest[0][1])
+        self.smallest_before.append(smallest[0][1])
+        if center >= self.next_center:
+            self.next_center = center + 1
+        return extremum
+
+    def flush(self) -> list[tuple[int, str, float]]:
+        """
+        Check the last `order` centers, series is over.
+
+        Points near the end are compared with the available neighbours only.
+
+        Returns:
+            list[tuple[int, str, float]]: Positions, "min" or "max" and values of
+                extremes.
+        """
+        from src.utils.extremes import relative_extremes
+
+        first_center = max(self.next_center, 1)
+        self.next_center = max(self.next_center, self.total)
+        if first_center >= self.total:
+            return []
+
+        offset = self.total - len(self.values)
+        start = max(first_center - self.order, 0)
+        values = np.array(self.values)[start - offset :]
+        indices_min, indices_max = relative_extremes(values, self.order)
+        extremes = [(int(index) + start, "min") for index in indices_min]
+        extremes += [(int(index) + start, "max") for index in indices_max]
+        return [
+            (index, kind, float(values[index - start]))
+            for index, kind in sorted(extremes)
+            if index >= first_center
+        ]
+
+
+class OnlineTrendDetector:
+    """
+    Online version of `preprocess_for_trend_detection` and `detect_trend`.
+
+    Takes bars one by one (or by micro-batches) and emits labelled segments
+    `(first row, last row, label)`. Rise and fall segments are emitted when the
+    extremum closing them is confirmed, i.e. `order_for_fall_rise` bars later, and
+    flat segments `order_for_flat` bars after the extremum closing them. After
+    `flush` the segments painted with flat over rise/fall give the same column as
+    the batch pipeline.
+    """
+
+    def __init__(
+        self,
+        decay_sm: int,
+        decay_lm: int,
+        decay_signal: int,
+        period_signal: int,
+        order_for_fall_rise: int,
+        order_for_flat: int,
+        window_size_for_rolling_mean: int,
+        left_border_for_flat_detection: float,
+        right_border_for_flat_detection: float,
+    ):
+        """
+        Create detector.
+
+        Args:
+            decay_sm {int}: Decay in terms of span for short EMA.
+            decay_lm {int}: Decay in terms of span for long EMA.
+            decay_signal {int}: Decay in terms of span for signal line.
+            period_signal {int}: Minimum number of periods for signal line.
+            order_for_fall_rise {int}: Number of points for comparison of extremes.
+            order_for_flat {int}: Number of points for comparison of flat extremes.
+            window_size_for_rolling_mean {int}: Window size for rolling mean.
+            left_border_for_flat_detection {float}: Left border for flat detection.
+            right_border_for_flat_detection {float}: Right border for flat detection.
+        """
+        self.short_ema = EwmMean(decay_sm, min_periods=decay_sm)
+        self.long_ema = EwmMean(decay_lm, min_periods=decay_lm)
+        self.signal_ema = EwmMean(decay_signal, min_periods=period_signal)
+        self.trend_extremes = _ExtremumTracker(order_for_fall_rise)
+        self.flat_extremes = _ExtremumTracker(order_for_flat)
+        self.window_size_for_rolling_mean = window_size_for_rolling_mean
+        self.left_border_for_flat_detection = left_border_for_flat_detection
+        self.right_border_for_flat_detection = right_border_for_flat_detection
+
+        self.total = 0
+
+        self.last_extremum = None
+        self.last_direction = None
+
+        self.flat_indices: collections.deque = collections.deque(
+            maxlen=window_size_for_rolling_mean + 1
+        )
+        self.flat_pct_change = PctChange()
+        self.flat_rolling_mean = RollingMean(window_size_for_rolling_mean)
+
+    @classmethod
+    def from_config(cls, config) -> "OnlineTrendDetector":
+        """
+        Create detector with parameters from config.
+
+        Args:
+            config {EnvYAML}: Yaml file with configurations.
+
+        Returns:
+            OnlineTrendDetector: Detector.
+        """
+        params = config["featurize"]["trend_detection"]
+        return cls(
+            params["decay_sm"],
+            params["decay_lm"],
+            params["decay_signal"],
+            params["period_signal"],
+            params["order_for_fall_rise"],
+            params["order_for_flat"],
+            params["window_size_for_rolling_mean"],
+            params["left_border_for_flat_detection"],
+            params["right_border_for_flat_detection"],
+        )
+
+    @property
+    def current_trend(self) -> str:
+        """Provisional direction of the latest bar: opposite to the last closed one."""
+        if self.last_direction is None:
+            return "null"
+        return "rise" if self.last_direction == "fall" else "fall"
+
+    def _signal(self, close: float) -> float:
+        macd = self.short_ema.update(close) - self.long_ema.update(close)
+        return self.signal_ema.update(macd)
+
+    def _trend_segments(self, extremes: list[tuple[int, str, float]]) -> list[Segment]:
+        segments = []
+        for index, kind, _ in extremes:
+            direction = define_trend(kind)
+            start = 0 if self.last_extremum is None else self.last_extremum
+            segments.append((start, index - 1, direction))
+            self.last_extremum = index
+            self.last_direction = direction
+        return segments
+
+    def _flat_segments(self, extremes: list[tuple[int, str, float]]) -> list[Segment]:
+        segments = []
+        for index, _, signal in extremes:
+            self.flat_indices.append(index)
+            mean = self.flat_rolling_mean.update(self.flat_pct_change.update(signal))
+            if (
+                self.left_border_for_flat_detection
+                < mean
+                < self.right_border_for_flat_detection
+            ):
+                segments.append((self.flat_indices[0], index, "flat"))
+        return segments
+
+    @property
+    def offset(self) -> int:
+        """First row whose signal line can still be needed by the trackers."""
+        return max(
+            0,
+            min(
+                self.trend_extremes.next_center - self.trend_extremes.order,
+                self.flat_extremes.next_center - self.flat_extremes.order,
+            ),
+        )
+
+    def update(self, close: Union[float, Iterable[float]]) -> list[Segment]:
+        """
+        Add next bar or micro-batch of bars.
+
+        Args:
+            close {Union[float, Iterable[float]]}: Close price of bars.
+
+        Returns:
+            list[Segment]: Segments which became final.
+        """
+        close = np.atleast_1d(np.asarray(close, dtype=np.float64))
+        trend, flat = [], []
+        for value in close.tolist():
+            signal = self._signal(value)
+            extremum = self.trend_extremes.update(signal)
+            if extremum is not None:
+                trend.append(extremum)
+            extremum = self.flat_extremes.update(signal)
+            if extremum is not None:
+                flat.append(extremum)
+        self.total += len(close)
+        return self._trend_segments(trend) + self._flat_segments(flat)
+
+    def flush(self) -> list[Segment]:
+        """
+        Finish history: check the last bars and close the last trend.
+
+        Returns:
+            list[Segment]: Remaining segments.
+        """
+        segments = self._trend_segments(self.trend_extremes.flush())
+        segments += self._flat_segments(self.flat_extremes.flush())
+        if self.last_extremum is not None:
+            segments.append((self.last_extremum, self.total - 1, self.current_trend))
+        return segments
+
+
+def label_history(
+    detector: OnlineTrendDetector,
+    close: np.ndarray,
+    batch_size: int = 1,
+) -> np.ndarray:
+    """
+    Replay history through detector and build trend column.
+
+    Args:
+        detector {OnlineTrendDetector}: Fresh detector.
+        close {np.ndarray}: Close prices.
+        batch_size {int}: Number of bars passed to detector at once.
+
+    Returns:
+        np.ndarray: Trend labels, the same as `detect_trend` makes.
+    """
+    from src.utils.intervals import paint_intervals
+
+    segments = []
+    for start in range(0, len(close), batch_size):
+        segments.extend(detector.update(close[start : start + batch_size]))
+    segments.extend(detector.flush())
+
+    trend = np.full(len(close), "null", dtype=object)
+    if segments:
+        starts, ends, labels = zip(*segments)
+        paint_intervals(
+            trend, starts, ends, labels, precedence=["fall", "rise", "flat"]
+        )
+    return trend
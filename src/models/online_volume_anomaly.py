@@ -0,0 +1,277 @@
+"""Provides online volume anomaly detection for a stream of bars."""
+
+import collections
+from typing import Iterable, Union
+
+import numpy as np
+
+from src.features.streaming import PctChange, RollingMean
+from src.models.volume_anomaly import lap_end_offsets, thresholds_for_laps
+from src.utils.exceptions import UnsortedDates
+from src.utils.kernels import first_detected_laps
+from src.utils.range_index import NANOSECONDS_IN_MINUTE, dates_to_int64
+
+Anomaly = tuple[int, int]
+
+
+class _History:
+    """Dates and cumulative volume of recent rows in a growable buffer."""
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Create empty buffer.
+
+        Args:
+            capacity {int}: Initial number of rows.
+        """
+        self.dates = np.empty(capacity, dtype=np.int64)
+        self.cumulative_volume = np.empty(capacity, dtype=np.float64)
+        self.cumulative_count = np.empty(capacity, dtype=np.int64)
+        self.first_row = 0
+        self.start = 0
+        self.stop = 0
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getstate__(self) -> dict:
+        """Only rows which are kept are pickled, not the whole buffer."""
+        state = self.__dict__.copy()
+        for name in ("dates", "cumulative_volume", "cumulative_count"):
+            state[name] = getattr(self, name)[self.start : self.stop].copy()
+        state["start"], state["stop"] = 0, len(self)
+        return state
+
+    def append(self, date: int, cumulative_volume: float, cumulative_count: int):
+        """
+        Add row with cumulative volume and count of rows before it.
+
+        Args:
+            date {int}: Int64 timestamp of row.
+            cumulative_volume {float}: Volume of all previous rows.
+            cumulative_count {int}: Number of previous rows with volume.
+        """
+        if self.stop == len(self.dates):
+            size = len(self)
+            capacity = max(len(self.dates), 2 * size, 1)
+            for name in ("dates", "cumulative_volume", "cumulative_count"):
+                values = getattr(self, name)
+                resized = np.empty(capacity, dtype=values.dtype)
+                resized[:size] = values[self.start : self.stop]
+                setattr(self, name, resized)
+            self.start, self.stop = 0, size
+        self.dates[self.stop] = date
+        self.cumulative_volume[self.stop] = cumulative_volume
+        self.cumulative_count[self.stop] = cumulative_count
+        self.stop += 1
+
+    def drop_before(self, date: int):
+        """
+        Forget rows which are earlier than date.
+
+        Args:
+            date {int}: Int64 timestamp of the first row to keep.
+        """
+        dropped = np.searchsorted(self.dates[self.start : self.stop], date)
+        self.start += dropped
+        self.first_row += dropped
+
+
+class OnlineVolumeAnomalyDetector:
+    """
+    Online version of `preprocess_for_volume_anomaly` and `find_volume_anomaly`.
+
+    Rolling means are updated in O(1) with ring buffers, rows which passed the
+    indicator are kept as open candidates. A candidate is resolved with the same
+    laps/thresholds schedule as in batch mode once its longest window is complete,
+    i.e. when a bar later than `gap_end_date` minutes after it arrives. Emitted
+    anomalies `(first row, last row)` are the same as in the batch pipeline.
+    """
+
+    def __init__(
+        self,
+        columns_rolling_mean: list[int],
+        mean_indicator: int,
+        threshold_indicator: float,
+        gap_end_date: int,
+        step_to_end_date: int,
+        laps: list[int],
+        thresholds: list[float],
+    ):
+        """
+        Create detector.
+
+        Args:
+            columns_rolling_mean {list[int]}: Windows of rolling means for comparing.
+            mean_indicator {int}: Window of rolling mean used like indicator.
+            threshold_indicator {float}: Threshold of indicator for anomaly candidate.
+            gap_end_date {int}: Number of minutes between start date and end date.
+            step_to_end_date {int}: Step of iteration from end date to start date.
+            laps {list[int]}: Laps where threshold is switched to the next one.
+            thresholds {list[float]}: Thresholds for anomaly detection.
+        """
+        self.rolling_means = [RollingMean(window) for window in columns_rolling_mean]
+        self.indicator_mean = RollingMean(mean_indicator)
+        self.indicator = PctChange()
+        self.threshold_indicator = threshold_indicator
+        self.gap = gap_end_date * NANOSECONDS_IN_MINUTE
+        self.offsets = lap_end_offsets(gap_end_date, step_to_end_date)
+        self.offsets = self.offsets * NANOSECONDS_IN_MINUTE
+        self.lap_thresholds = thresholds_for_laps(laps, thresholds, len(self.offsets))
+
+        self.total = 0
+        self.cumulative_volume = 0.0
+        self.cumulative_count = 0
+        self.last_date = None
+        self.history = _History()
+        self.candidates: collections.deque = collections.deque()
+
+    @classmethod
+    def from_config(cls, config) -> "OnlineVolumeAnomalyDetector":
+        """
+        Create detector with parameters from config.
+
+        Args:
+            config {EnvYAML}: Yaml file with configurations.
+
+        Returns:
+            OnlineVolumeAnomalyDetector: Detector.
+        """
+        params = config["featurize"]["volume_anomaly"]
+        return cls(
+            params["columns_rolling_mean"],
+            params["mean_indicator"],
+            params["threshold_indicator"],
+            params["gap_end_date"],
+            params["step_to_end_date"],
+            params["laps"],
+            params["thresholds"],
+        )
+
+    @property
+    def open_candidates(self) -> int:
+        """Number of candidates which are not resolved yet."""
+        return len(self.candidates)
+
+    def _add(self, date: int, volume: float):
+        if self.last_date is not None and date < self.last_date:
+            raise UnsortedDates
+        self.last_date = date
+        self.history.append(date, self.cumulative_volume, self.cumulative_count)
+        means = [rolling_mean.update(volume) for rolling_mean in self.rolling_means]
+        indicator = self.indicator.update(self.indicator_mean.update(volume))
+        if indicator > self.threshold_indicator:
+            self.candidates.append((self.total, date, means))
+        if volume == volume:
+            self.cumulative_volume += volume
+            self.cumulative_count += 1
+        self.total += 1
+
+    def _cumulative_at(self, positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        history = self.history
+        inside = positions < len(history)
+        rows = history.start + np.where(inside, positions, 0)
+        volume = np.where(
+            inside, history.cumulative_volume[rows], self.cumulative_volume
+        )
+        count = np.where(inside, history.cumulative_count[rows], self.cumulative_count)
+        return volume, count
+
+    def _resolve(self, final: bool) -> list[Anomaly]:
+        resolved = []
+        while self.candidates and (
+            final or self.last_date > self.candidates[0][1] + self.gap
+        ):
+            resolved.append(self.candidates.popleft())
+        if not resolved:
+            if not self.candidates and len(self.history) > 1024:
+                self.history.drop_before(self.last_date)
+            return []
+
+        history = self.history
+        dates = history.dates[history.start : history.stop]
+        candidate_dates = np.array([date for _, date, _ in resolved])
+        lo = np.searchsorted(dates, candidate_dates, side="left")[:, None]
+        hi = np.searchsorted(
+            dates, candidate_dates[:, None] + self.offsets, side="right"
+        )
+        volume_lo, count_lo = self._cumulative_at(lo)
+        volume_hi, count_hi = self._cumulative_at(hi)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            current_means = (volume_hi - volume_lo) / (count_hi - count_lo)
+        means = np.array([means for _, _, means in resolved], dtype=np.float64)
+        first_lap = first_detected_laps(current_means, means, self.lap_thresholds)
+        anomalies = []
+        for number in np.flatnonzero(first_lap >= 0):
+            end = history.first_row + hi[number, first_lap[number]] - 1
+            anomalies.append((resolved[number][0], int(end)))
+
+        history.drop_before(
+            self.candidates[0][1] if self.candidates else self.last_date
+        )
+        return anomalies
+
+    def update(
+        self,
+        date: Union[object, Iterable[object]],
+        volume: Union[float, Iterable[float]],
+    ) -> list[Anomaly]:
+        """
+        Add next bar or micro-batch of bars.
+
+        Args:
+            date {Union[object, Iterable[object]]}: Dates of bars in increasing order.
+            volume {Union[float, Iterable[float]]}: Volume of bars.
+
+        Returns:
+            list[Anomaly]: Anomalies which became known.
+        """
+        if np.ndim(volume) == 0:
+            self._add(int(dates_to_int64(date)), float(volume))
+        else:
+            dates = dates_to_int64(date).tolist()
+            for current_date, current_volume in zip(dates, np.asarray(volume).tolist()):
+                self._add(current_date, float(current_volume))
+        return self._resolve(final=False)
+
+    def flush(self) -> list[Anomaly]:
+        """
+        Finish history: resolve candidates with the windows available.
+
+        Returns:
+            list[Anomaly]: Remaining anomalies.
+        """
+        return self._resolve(final=True)
+
+
+def flag_history(
+    detector: OnlineVolumeAnomalyDetector,
+    dates: np.ndarray,
+    volume: np.ndarray,
+    batch_size: int = 1,
+) -> np.ndarray:
+    """
+    Replay history through detector and build anomaly column.
+
+    Args:
+        detector {OnlineVolumeAnomalyDetector}: Fresh detector.
+        dates {np.ndarray}: Sorted dates of bars.
+        volume {np.ndarray}: Volume of bars.
+        batch_size {int}: Number of bars passed to detector at once.
+
+    Returns:
+        np.ndarray: Anomaly flags, the same as `find_volume_anomaly` makes.
+    """
+    from src.utils.intervals import paint_intervals
+
+    anomalies = []
+    for start in range(0, len(volume), batch_size):
+        stop = start + batch_size
+        anomalies.extend(detector.update(dates[start:stop], volume[start:stop]))
+    anomalies.extend(detector.flush())
+
+    flags = np.zeros(len(volume), dtype=bool)
+    if anomalies:
+        starts, ends = zip(*anomalies)
+        paint_intervals(flags, starts, ends, True)
+    return flags
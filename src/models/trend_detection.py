@@ -1,5 +1,4 @@
 import argparse
-import collections
 import sys
 import warnings
 from typing import Dict, Optional, Text
@@ -8,7 +7,6 @@ import numpy as np
 import pandas as pd
 from envyaml import EnvYAML
 from pandas import DataFrame
-from scipy.signal import argrelextrema
 
 warnings.filterwarnings("ignore")
 
@@ -33,6 +31,9 @@ def get_indices_of_extremes(signal_line: np.ndarray, order: int) -> tuple[np.nda
     """
     Find indices of local extremes.
 
+    Same as `argrelextrema` with `np.less` and `np.greater`, but the cost does not
+    depend on order.
+
     Args:
         signal_line {np.ndarray}: Signal line.
         order {int}: Number of points for comparison.
@@ -40,9 +41,9 @@ def get_indices_of_extremes(signal_line: np.ndarray, order: int) -> tuple[np.nda
     Return:
         Tuple[np.ndarray]
     """
-    indices_max = argrelextrema(signal_line, np.greater, order=order)
-    indices_min = argrelextrema(signal_line, np.less, order=order)
-    return indices_min[0], indices_max[0]
+    from src.utils.extremes import relative_extremes
+
+    return relative_extremes(signal_line, order)
 
 
 def make_directions_from_indices(
@@ -58,21 +59,13 @@ def make_directions_from_indices(
     Returns:
         Dict[tuple(int), str]: Dictionary with indices of stock price and detecting fall it or rise.
     """
-    directions = {}
-    for id_min in indices_min:
-        directions[id_min] = "min"
-
-    for id_max in indices_max:
-        directions[id_max] = "max"
+    from src.utils.kernels import trend_bounds
 
-    od = collections.OrderedDict(sorted(directions.items()))
-    directions = {}
-    prev_key = 0
-    for curr_key, value in od.items():
-        directions[(prev_key, curr_key)] = define_trend(value)
-        prev_key = curr_key
-
-    return directions
+    starts, ends, rising = trend_bounds(np.sort(indices_min), np.sort(indices_max))
+    return {
+        (start, end): "rise" if is_rise else "fall"
+        for start, end, is_rise in zip(starts.tolist(), ends.tolist(), rising.tolist())
+    }
 
 
 def make_directions_from_indices_for_flat(
@@ -97,75 +90,95 @@ def make_directions_from_indices_for_flat(
     Returns:
         tuple(int): Tuple with indices where stock price flatting.
     """
+    from src.utils.kernels import flat_bounds
 
     indices = np.sort(np.concatenate([indices_min, indices_max]))
-    extremes_signals = data["signal_line"][indices]
-    extremes_signals_pct_change = extremes_signals.pct_change()
-    extremes_signals_pct_change_rolling_mean = extremes_signals_pct_change.rolling(
-        window_size_for_rolling_mean
-    ).mean()
-    flats = []
-
-    for ind, (signal_pct_change, index) in enumerate(
-        zip(extremes_signals_pct_change_rolling_mean, indices)
-    ):
-        if (
-            left_border_for_flat_detection
-            < signal_pct_change
-            < right_border_for_flat_detection
-        ):
-            flats.append((indices[ind - window_size_for_rolling_mean], index))
-    return flats
+    starts, ends = flat_bounds(
+        data["signal_line"].to_numpy()[indices],
+        indices,
+        window_size_for_rolling_mean,
+        left_border_for_flat_detection,
+        right_border_for_flat_detection,
+    )
+    return list(zip(starts.tolist(), ends.tolist()))
 
 
-def detect_trend(
-    config_path: Text,
-) -> Optional[DataFrame]:
+def label_trends(
+    signal_line: np.ndarray,
+    extremes_for_fall_rise: tuple[np.ndarray, np.ndarray],
+    extremes_for_flat: tuple[np.ndarray, np.ndarray],
+    window_size_for_rolling_mean: int,
+    left_border_for_flat_detection: float,
+    right_border_for_flat_detection: float,
+) -> pd.Categorical:
     """
-    Detection of trend of stock market price.
+    Label every row with trend using already found extremes.
 
     Args:
-        config_path {Text}: path to config
+        signal_line {np.ndarray}: Signal line.
+        extremes_for_fall_rise {tuple[np.ndarray, np.ndarray]}: Indices of local min
+            and max extremes for falling and rising price.
+        extremes_for_flat {tuple[np.ndarray, np.ndarray]}: Indices of local min and
+            max extremes for flatting price.
+        window_size_for_rolling_mean {int}: Window size for rolling mean.
+        left_border_for_flat_detection {float}: Left border for flat detection.
+        right_border_for_flat_detection {float}: Right border for flat detection.
+
+    Returns:
+        pd.Categorical: Trend of each row, categories are `TREND_LABELS`.
     """
-    config = EnvYAML(config_path)
-    sys.path.append(config["base"]["project_path"])
-    from src.utils.logger import get_logger
+    from src.utils.intervals import paint_intervals
+    from src.utils.kernels import flat_bounds, trend_bounds
+    from src.utils.labels import TREND_LABELS, trend_categorical
+
+    rise, fall = TREND_LABELS.index("rise"), TREND_LABELS.index("fall")
+    starts, ends, rising = trend_bounds(*extremes_for_fall_rise)
+    last_trend = fall if rising[-1] else rise
+    trend = np.zeros(len(signal_line), dtype=np.int8)
+    paint_intervals(
+        trend,
+        np.r_[starts, ends[-1]],
+        np.r_[ends, len(signal_line) - 1],
+        np.r_[np.where(rising, rise, fall), last_trend].astype(np.int8),
+    )
 
-    logger = get_logger("DETECT_TREND", log_level=config["base"]["log_level"])
+    indices = np.sort(np.concatenate(extremes_for_flat))
+    flat_starts, flat_ends = flat_bounds(
+        np.asarray(signal_line)[indices],
+        indices,
+        window_size_for_rolling_mean,
+        left_border_for_flat_detection,
+        right_border_for_flat_detection,
+    )
+    paint_intervals(trend, flat_starts, flat_ends, TREND_LABELS.index("flat"))
+    return trend_categorical(trend)
 
-    logger.info("Read preprocessed data")
-    data = pd.read_feather(config["data"]["processed_trend_detection"])
 
-    order_for_fall_rise = config["featurize"]["trend_detection"]["order_for_fall_rise"]
-    logger.info("Find local extrema for falling and rising price")
-    indices_min, indices_max = get_indices_of_extremes(
-        np.array(data.signal_line), order_for_fall_rise
-    )
-    logger.info("Find directions of price using local extremes")
-    directions = make_directions_from_indices(indices_min, indices_max)
+def add_trend(data: DataFrame, config: EnvYAML) -> DataFrame:
+    """
+    Add column with trend to preprocessed data.
 
-    logger.info("Define last direction of trend")
-    last_trend = "rise" if tuple(directions.values())[-1] == "fall" else "fall"
-    directions[(tuple(directions.keys())[-1][1], data.index[-1])] = last_trend
+    Args:
+        data {DataFrame}: Data with signal line.
+        config {EnvYAML}: Yaml file with configurations.
 
-    logger.info("Creating new column `trend`")
-    column_with_trend = config["featurize"]["trend_detection"]["column_with_trend"]
-    data[column_with_trend] = "null"
-    for key, value in directions.items():
-        if value == "fall":
-            data.loc[
-                (data.index >= key[0]) & (data.index <= key[1]), column_with_trend
-            ] = "fall"
-        else:
-            data.loc[
-                (data.index >= key[0]) & (data.index <= key[1]), column_with_trend
-            ] = "rise"
-
-    logger.info("Find local extrema for flatting price")
+    Returns:
+        DataFrame: Data with trend and without signal line & MACD.
+    """
+    from src.utils.extremes import find_extremes
+    from src.utils.instrumentation import span
+    from src.utils.logger import get_logger
+
+    logger = get_logger("DETECT_TREND", log_level=config["base"]["log_level"])
+    signal_line = np.array(data.signal_line)
+
+    order_for_fall_rise = config["featurize"]["trend_detection"]["order_for_fall_rise"]
     order_for_flat = config["featurize"]["trend_detection"]["order_for_flat"]
-    indices_min_flat, indices_max_flat = get_indices_of_extremes(
-        np.array(data.signal_line), order_for_flat
-    )
+    logger.info("Find local extrema for falling, rising and flatting price")
+    with span("extrema", rows=len(signal_line)):
+        extremes = find_extremes(signal_line, [order_for_fall_rise, order_for_flat])
+    extremes_for_fall_rise = extremes[order_for_fall_rise]
+    extremes_for_flat = extremes[order_for_flat]
 
     window_size_for_rolling_mean = config["featurize"]["trend_detection"][
         "window_size_for_rolling_mean"
@@ -179,26 +192,52 @@ def detect_trend(
         "right_border_for_flat_detection"
     ]
     logger.info(f"Right border for flat detection: {right_border_for_flat_detection}")
-    indices_flat = make_directions_from_indices_for_flat(
-        data,
-        indices_min_flat,
-        indices_max_flat,
-        window_size_for_rolling_mean,
-        left_border_for_flat_detection,
-        right_border_for_flat_detection,
-    )
-    logger.info("Found indices where data flatting")
-    logger.info(f"Fill {column_with_trend} column with `flat`")
-    for flat in indices_flat:
-        data.loc[
-            (data.index >= flat[0]) & (data.index <= flat[-1]), column_with_trend
-        ] = "flat"
+
+    column_with_trend = config["featurize"]["trend_detection"]["column_with_trend"]
+    logger.info(f"Fill {column_with_trend} column with directions and `flat`")
+    with span("interval_fill", rows=len(signal_line)):
+        data[column_with_trend] = label_trends(
+            signal_line,
+            extremes_for_fall_rise,
+            extremes_for_flat,
+            window_size_for_rolling_mean,
+            left_border_for_flat_detection,
+            right_border_for_flat_detection,
+        )
 
     logger.info("Drop unnecessary columns: `signal_line` & `macd`")
     data.drop(["signal_line", "macd"], axis=1, inplace=True)
+    return data
+
+
+def detect_trend(
+    config_path: Text,
+) -> Optional[DataFrame]:
+    """
+    Detection of trend of stock market price.
+
+    Args:
+        config_path {Text}: path to config
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import read_frame
+    from src.utils.instrumentation import span
+    from src.utils.labels import write_result
+    from src.utils.logger import get_logger
+
+    logger = get_logger("DETECT_TREND", log_level=config["base"]["log_level"])
+
+    logger.info("Read preprocessed data")
+    with span("read") as step:
+        data = read_frame(config["data"]["processed_trend_detection"])
+        step.add_rows(len(data))
+    data = add_trend(data, config)
+
     path = config["data"]["result_trend_detection"]
     logger.info(f"Writing data to path: {path}")
-    data.to_feather(path)
+    with span("write", rows=len(data)):
+        write_result(data, path, config)
 
 
 if __name__ == "__main__":
@@ -5,13 +5,13 @@ from datetime import timedelta
 from typing import Optional, Text
 
 import numpy as np
-import pandas as pd
 from envyaml import EnvYAML
 from pandas import DataFrame, Timestamp
-from tqdm import tqdm
 
 warnings.filterwarnings("ignore")
 
+SHARDS_PER_WORKER = 4
+
 
 def pct_change_mean(current_mean: float, args: tuple[float, np.nan]) -> list[float]:
     """
@@ -110,23 +110,282 @@ def check_for_anomaly_in_window(
             return end_anomaly_date
 
 
-def find_volume_anomaly(
-    config_path: Text,
-) -> Optional[DataFrame]:
+def lap_end_offsets(gap_end_date: int, step_to_end_date: int) -> np.ndarray:
     """
-    Data preparation for binary classification.
+    Offsets of window ends from the checked date in the order of `daterange`.
 
     Args:
-        config_path {Text}: path to config
+        gap_end_date {int}: Number of minutes between start date and end date.
+        step_to_end_date {int}: Step of iteration from end date to start date.
+
+    Returns:
+        np.ndarray: Offsets in minutes.
     """
-    config = EnvYAML(config_path)
-    sys.path.append(config["base"]["project_path"])
+    return gap_end_date - np.arange(
+        0, gap_end_date - step_to_end_date, step_to_end_date
+    )
+
+
+def thresholds_for_laps(
+    laps: list[int], thresholds: list[float], number_of_laps: int
+) -> np.ndarray:
+    """
+    Threshold which is used on each lap of the window check.
+
+    Args:
+        laps {list[int]}: Laps where threshold is switched to the next one.
+        thresholds {list[float]}: Thresholds for anomaly detection.
+        number_of_laps {int}: Number of laps in the window check.
+
+    Returns:
+        np.ndarray: Threshold for each lap.
+    """
+    lap = np.arange(number_of_laps)
+    id_of_threshold = np.searchsorted(laps, lap, side="right")
+    id_of_threshold[lap >= laps[-1]] = -1
+    return np.asarray(thresholds, dtype=np.float64)[id_of_threshold]
+
+
+def max_pct_change_mean(current_means: np.ndarray, means: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `max(pct_change_mean(current_mean, means))`.
+
+    Zero means are skipped like in `pct_change_mean`. The builtin `max` keeps the
+    first value when it is NaN and skips NaN otherwise, the same is done here.
+
+    Args:
+        current_means {np.ndarray}: Means of current windows, shape (candidates, laps).
+        means {np.ndarray}: Means for comparing, shape (candidates, windows).
+
+    Returns:
+        np.ndarray: Largest change for each candidate and lap.
+    """
+    used = means != 0
+    current_means = current_means[:, :, None]
+    changes = (current_means - means[:, None, :]) / current_means
+    largest = np.nanmax(np.where(used[:, None, :], changes, -np.inf), axis=2)
+    first_used = np.argmax(used, axis=1)[:, None, None]
+    first = np.take_along_axis(changes, first_used, axis=2)[:, :, 0]
+    largest[np.isnan(first)] = np.nan
+    return largest
+
+
+def _intervals_of_candidates(
+    volume_index,
+    rows: np.ndarray,
+    means: np.ndarray,
+    offsets: np.ndarray,
+    lap_thresholds: np.ndarray,
+    block_size: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Check candidates by blocks and collect found anomalies.
+
+    Args:
+        volume_index {VolumeRangeIndex}: Index over volume of sorted rows.
+        rows {np.ndarray}: Positions of candidates in index.
+        means {np.ndarray}: Rolling means of candidates, shape (candidates, windows).
+        offsets {np.ndarray}: Offsets of lap ends from candidate date in nanoseconds.
+        lap_thresholds {np.ndarray}: Threshold of each lap.
+        block_size {int}: Number of candidates processed at once.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: First and last (inclusive) positions of anomalies.
+    """
+    from src.utils.kernels import first_detected_laps
+
+    dates = volume_index.dates
+    starts = [np.empty(0, dtype=np.int64)]
+    ends = [np.empty(0, dtype=np.int64)]
+    for block in range(0, len(rows), block_size):
+        block_rows = rows[block : block + block_size]
+        lo, hi = volume_index.bounds(
+            dates[block_rows, None], dates[block_rows, None] + offsets
+        )
+        current_means = volume_index.mean_between(lo, hi)
+        lo = lo[:, 0]
+        first_lap = first_detected_laps(
+            current_means, means[block : block + block_size], lap_thresholds
+        )
+        found = first_lap >= 0
+        starts.append(lo[found])
+        ends.append(hi[found, first_lap[found]] - 1)
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def _intervals_of_shard(
+    arrays: dict[Text, np.ndarray],
+    first: int,
+    last: int,
+    gap: int,
+    offsets: np.ndarray,
+    lap_thresholds: np.ndarray,
+    block_size: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Check candidates [first, last) using only rows of their windows.
+
+    Rows from the first candidate date to `gap` after the last one are used, sums
+    are taken from the cumulative arrays of the whole index.
+
+    Args:
+        arrays {dict[Text, np.ndarray]}: Index arrays, candidates and their means.
+        first {int}: Number of first candidate of shard.
+        last {int}: Number after last candidate of shard.
+        gap {int}: Longest window in nanoseconds.
+        offsets {np.ndarray}: Offsets of lap ends from candidate date in nanoseconds.
+        lap_thresholds {np.ndarray}: Threshold of each lap.
+        block_size {int}: Number of candidates processed at once.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: First and last (inclusive) positions of anomalies.
+    """
+    from src.utils.range_index import VolumeRangeIndex
+
+    dates = arrays["dates"]
+    rows = arrays["candidates"][first:last]
+    lo = np.searchsorted(dates, dates[rows[0]], side="left")
+    hi = np.searchsorted(dates, dates[rows[-1]] + gap, side="right")
+    shard = VolumeRangeIndex.from_cumulative(
+        dates, arrays["cumulative_volume"], arrays["cumulative_count"]
+    ).slice(lo, hi)
+    starts, ends = _intervals_of_candidates(
+        shard,
+        rows - lo,
+        arrays["means"][first:last],
+        offsets,
+        lap_thresholds,
+        block_size,
+    )
+    return starts + lo, ends + lo
+
+
+def _intervals_of_shared_shard(specs: dict, *args) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Attach to shared memory in worker process and check shard of candidates.
+
+    Args:
+        specs {dict}: Shared memory specs of index arrays, candidates and means.
+        args: Arguments of `_intervals_of_shard` after arrays.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: First and last (inclusive) positions of anomalies.
+    """
+    from src.utils.shared_arrays import attach_arrays
+
+    arrays, blocks = attach_arrays(specs)
+    intervals = _intervals_of_shard(arrays, *args)
+    arrays.clear()
+    for block in blocks:
+        block.close()
+    return intervals
+
+
+def find_anomaly_intervals(
+    volume_index,
+    indicator: np.ndarray,
+    means: np.ndarray,
+    threshold_indicator: float,
+    gap_end_date: int,
+    step_to_end_date: int,
+    laps: list[int],
+    thresholds: list[float],
+    block_size: int = 65536,
+    workers: int = 1,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find volume anomalies for all candidates at once.
+
+    Gives the same intervals as calling `check_for_anomaly_in_window` for each row,
+    but window means are taken from cumulative volume and window ends are found
+    with `searchsorted`. With several workers candidates are split into time shards
+    which are checked in worker processes over index arrays in shared memory, each
+    shard sees rows up to `gap_end_date` after its last candidate. Intervals are
+    merged in shard order, so the result does not depend on number of workers.
+
+    Args:
+        volume_index {VolumeRangeIndex}: Index over volume of sorted rows.
+        indicator {np.ndarray}: Change of indicator rolling mean.
+        means {np.ndarray}: Rolling means for comparing, shape (rows, windows).
+        threshold_indicator {float}: Threshold of indicator for anomaly candidate.
+        gap_end_date {int}: Number of minutes between start date and end date.
+        step_to_end_date {int}: Step of iteration from end date to start date.
+        laps {list[int]}: Laps where threshold is switched to the next one.
+        thresholds {list[float]}: Thresholds for anomaly detection.
+        block_size {int}: Number of candidates processed at once.
+        workers {int}: Number of worker processes.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: First and last (inclusive) positions of anomalies.
+    """
+    from src.utils.range_index import NANOSECONDS_IN_MINUTE
+
+    candidates = np.flatnonzero(indicator > threshold_indicator)
+    offsets = lap_end_offsets(gap_end_date, step_to_end_date) * NANOSECONDS_IN_MINUTE
+    lap_thresholds = thresholds_for_laps(laps, thresholds, len(offsets))
+
+    shards = min(workers * SHARDS_PER_WORKER, len(candidates) // block_size + 1)
+    if workers <= 1 or shards <= 1:
+        return _intervals_of_candidates(
+            volume_index,
+            candidates,
+            means[candidates],
+            offsets,
+            lap_thresholds,
+            block_size,
+        )
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    from src.utils.shared_arrays import SharedArrays
+
+    bounds = np.linspace(0, len(candidates), shards + 1).astype(np.int64)
+    gap = gap_end_date * NANOSECONDS_IN_MINUTE
+    with SharedArrays(
+        {
+            "dates": volume_index.dates,
+            "cumulative_volume": volume_index.cumulative_volume,
+            "cumulative_count": volume_index.cumulative_count,
+            "candidates": candidates,
+            "means": means[candidates],
+        }
+    ) as shared, ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _intervals_of_shared_shard,
+                shared.specs,
+                first,
+                last,
+                gap,
+                offsets,
+                lap_thresholds,
+                block_size,
+            )
+            for first, last in zip(bounds[:-1], bounds[1:])
+        ]
+        results = [future.result() for future in futures]
+    starts, ends = zip(*results)
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def add_volume_anomaly(data: DataFrame, config: EnvYAML) -> DataFrame:
+    """
+    Add column with volume anomaly to preprocessed data.
+
+    Args:
+        data {DataFrame}: Data with rolling means.
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        DataFrame: Data with anomaly flags and without rolling means.
+    """
+    from src.utils.instrumentation import span
+    from src.utils.intervals import paint_intervals
     from src.utils.logger import get_logger
+    from src.utils.range_index import VolumeRangeIndex, dates_to_int64
 
     logger = get_logger("FIND_VOLUME_ANOMALY", log_level=config["base"]["log_level"])
 
-    logger.info("Read preprocessed data")
-    data = pd.read_feather(config["data"]["processed_volume_anomaly"])
     data.set_index("date", inplace=True)
     logger.info("Set date colums as index")
     mean_indicator = config["featurize"]["volume_anomaly"]["mean_indicator"]
@@ -137,33 +396,34 @@ def find_volume_anomaly(
     logger.info(f"Treshold indicator: {threshold_indicator}")
     columns_rolling_mean = config["featurize"]["volume_anomaly"]["columns_rolling_mean"]
     logger.info(f"Windows for rolling means: {columns_rolling_mean}")
-    anomaly_dates = []
-    for current_date, checking_pct_change in tqdm(
-        zip(data.index, data[column_for_indicating])
-    ):
-        if checking_pct_change > threshold_indicator:
-            means = []
-            for mean in columns_rolling_mean:
-                means.append(
-                    data.loc[data.index == current_date, f"rolling_mean_{mean}"].values[
-                        0
-                    ]
-                )
-            end_of_anomaly = check_for_anomaly_in_window(
-                config, data, current_date, *means
-            )
-            if end_of_anomaly:
-                anomaly_dates.append((current_date, end_of_anomaly))
-    logger.info(f"Number of found anomalies: {len(anomaly_dates)}")
+
+    logger.info("Build index over volume")
+    with span("index", rows=len(data)):
+        order = np.argsort(dates_to_int64(data.index), kind="stable")
+        volume_index = VolumeRangeIndex(data.index[order], data["volume"].values[order])
+    columns_for_comparing = [f"rolling_mean_{mean}" for mean in columns_rolling_mean]
+    with span("anomaly_search", rows=len(data)):
+        starts, ends = find_anomaly_intervals(
+            volume_index,
+            data[column_for_indicating].values[order],
+            data[columns_for_comparing].values[order],
+            threshold_indicator,
+            config["featurize"]["volume_anomaly"]["gap_end_date"],
+            config["featurize"]["volume_anomaly"]["step_to_end_date"],
+            config["featurize"]["volume_anomaly"]["laps"],
+            config["featurize"]["volume_anomaly"]["thresholds"],
+            workers=config["base"].get("workers", 1),
+        )
+    logger.info(f"Number of found anomalies: {len(starts)}")
     column_with_anomaly_detection = config["featurize"]["volume_anomaly"][
         "column_with_anomaly"
     ]
-    data[column_with_anomaly_detection] = False
-    for start_date, end_date in tqdm(anomaly_dates):
-        data.loc[
-            (data.index >= start_date) & (data.index <= end_date),
-            column_with_anomaly_detection,
-        ] = True
+    with span("interval_fill", rows=len(data)):
+        anomaly = np.zeros(len(data), dtype=bool)
+        anomaly[order] = paint_intervals(
+            np.zeros(len(data), dtype=bool), starts, ends, True
+        )
+    data[column_with_anomaly_detection] = anomaly
     logger.info(f"Created new column {column_with_anomaly_detection}")
     for mean in columns_rolling_mean:
         data.drop([f"rolling_mean_{mean}"], axis=1, inplace=True)
@@ -176,9 +436,37 @@ def find_volume_anomaly(
 
     data.reset_index(inplace=True)
     logger.info("Reset index")
+    return data
+
+
+def find_volume_anomaly(
+    config_path: Text,
+) -> Optional[DataFrame]:
+    """
+    Data preparation for binary classification.
+
+    Args:
+        config_path {Text}: path to config
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import read_frame
+    from src.utils.instrumentation import span
+    from src.utils.labels import write_result
+    from src.utils.logger import get_logger
+
+    logger = get_logger("FIND_VOLUME_ANOMALY", log_level=config["base"]["log_level"])
+
+    logger.info("Read preprocessed data")
+    with span("read") as step:
+        data = read_frame(config["data"]["processed_volume_anomaly"])
+        step.add_rows(len(data))
+    data = add_volume_anomaly(data, config)
+
     path = config["data"]["result_volume_anomaly"]
-    data.to_feather(path)
-    data.info(f"Write data to {path}")
+    with span("write", rows=len(data)):
+        write_result(data, path, config)
+    logger.info(f"Write data to {path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+import argparse
+import sys
+import warnings
+from typing import Optional, Text
+
+from envyaml import EnvYAML
+from pandas import DataFrame
+
+warnings.filterwarnings("ignore")
+
+
+def write_stage_result(data: DataFrame, config: EnvYAML, name: Text, logger):
+    """
+    Write intermediate result to the path of DVC stage output.
+
+    Intervals of trend and anomaly columns are saved next to result files.
+
+    Args:
+        data {DataFrame}: Result of stage.
+        config {EnvYAML}: Yaml file with configurations.
+        name {Text}: Name of path in `data` section of config.
+        logger {logging.Logger}: Logger of pipeline.
+    """
+    from src.utils.instrumentation import span
+    from src.utils.labels import write_result
+
+    path = config["data"][name]
+    logger.info(f"Writing data to path: {path}")
+    with span(f"write_{name}", rows=len(data)):
+        write_result(data, path, config)
+
+
+def process_raw(data: DataFrame, config: EnvYAML, persist: bool = False) -> DataFrame:
+    """
+    Run preprocessing, both detectors and concat on raw data of one symbol.
+
+    Args:
+        data {DataFrame}: Raw data.
+        config {EnvYAML}: Yaml file with configurations.
+        persist {bool}: Write processed and result files of every stage.
+
+    Returns:
+        DataFrame: Data with trend and anomaly.
+    """
+    from src.features.preprocessing_for_trend_detection import add_macd_features
+    from src.features.preprocessing_for_volume_anomaly import add_rolling_means
+    from src.models.concat import add_anomaly_to_trend
+    from src.models.trend_detection import add_trend
+    from src.models.volume_anomaly import add_volume_anomaly
+    from src.utils.instrumentation import span
+    from src.utils.logger import get_logger
+
+    logger = get_logger("PIPELINE", log_level=config["base"]["log_level"])
+
+    logger.info("Trend detection")
+    data_trend = add_macd_features(data.copy(), config)
+    if persist:
+        write_stage_result(data_trend, config, "processed_trend_detection", logger)
+    data_trend = add_trend(data_trend, config)
+    if persist:
+        write_stage_result(data_trend, config, "result_trend_detection", logger)
+
+    logger.info("Volume anomaly search")
+    data_volume = add_rolling_means(data[["date", "volume"]].copy(), config)
+    if persist:
+        write_stage_result(data_volume, config, "processed_volume_anomaly", logger)
+    data_volume = add_volume_anomaly(data_volume, config)
+    if persist:
+        write_stage_result(data_volume, config, "result_volume_anomaly", logger)
+
+    with span("join", rows=len(data_trend)):
+        return add_anomaly_to_trend(data_trend, data_volume, config)
+
+
+def run_pipeline(
+    config_path: Text, persist: bool = False, reports: bool = False
+) -> Optional[DataFrame]:
+    """
+    Run preprocessing, both detectors and concat in one process.
+
+    Raw data is read once, all stages work on in-memory frames. Intermediate files
+    of DVC stages are written only when `persist` is set.
+
+    Args:
+        config_path {Text}: path to config
+        persist {bool}: Write processed and result files of every stage.
+        reports {bool}: Plot trends and volume after concat.
+
+    Returns:
+        DataFrame: Data with trend and anomaly.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import read_frame
+    from src.utils.instrumentation import span
+    from src.utils.labels import write_result
+    from src.utils.logger import get_logger
+
+    logger = get_logger("PIPELINE", log_level=config["base"]["log_level"])
+
+    logger.info("Read initial data")
+    with span("read") as step:
+        data = read_frame(config["data"]["raw"])
+        step.add_rows(len(data))
+    data = process_raw(data, config, persist)
+    path = config["data"]["result_with_trend_and_anomaly"]
+    logger.info(f"Writing data to path: {path}")
+    with span("write", rows=len(data)):
+        write_result(data, path, config)
+
+    if reports:
+        from src.visualization.plots_for_trend import render_trend_plots
+        from src.visualization.plots_for_volume import render_volume_plots
+
+        render_trend_plots(data.copy(), config)
+        render_volume_plots(data.copy(), config)
+    return data
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument(
+        "--persist",
+        action="store_true",
+        help="write processed and result files of every stage",
+    )
+    args_parser.add_argument(
+        "--reports", action="store_true", help="plot trends and volume"
+    )
+    args = args_parser.parse_args()
+    run_pipeline(config_path=args.config, persist=args.persist, reports=args.reports)
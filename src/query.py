@@ -0,0 +1,254 @@
+import argparse
+import os
+import sys
+import warnings
+from typing import Optional, Sequence, Text
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from envyaml import EnvYAML
+from pandas import DataFrame
+
+warnings.filterwarnings("ignore")
+
+
+def result_path(
+    config: EnvYAML, symbol: Optional[Text] = None, results_dir: Optional[Text] = None
+) -> Text:
+    """
+    Path to result with trend and anomaly.
+
+    Args:
+        config {EnvYAML}: Yaml file with configurations.
+        symbol {Optional[Text]}: Name of symbol processed by `src/batch.py`.
+        results_dir {Optional[Text]}: Output directory of `src/batch.py`.
+
+    Returns:
+        Text: `<results_dir>/<symbol>.feather` if symbol is set, path of
+            `result_with_trend_and_anomaly` otherwise.
+    """
+    if symbol is None:
+        return config["data"]["result_with_trend_and_anomaly"]
+    if results_dir is None:
+        results_dir = os.path.dirname(config["data"]["result_with_trend_and_anomaly"])
+    return os.path.join(results_dir, f"{symbol}.feather")
+
+
+def select_rows(
+    index,
+    start=None,
+    end=None,
+    columns: Optional[Sequence[Text]] = None,
+    trends: Optional[Sequence[Text]] = None,
+    anomaly: Optional[bool] = None,
+    column_with_trend: Text = "trend",
+    column_with_anomaly: Text = "volume_anomaly",
+) -> DataFrame:
+    """
+    Rows of result between two dates, filtered by trend and anomaly.
+
+    Args:
+        index {BlockIndex}: Index of result.
+        start: First date, inclusive, from the first row if not set.
+        end: Last date, inclusive, to the last row if not set.
+        columns {Optional[Sequence[Text]]}: Columns to return, all if not set.
+        trends {Optional[Sequence[Text]]}: Keep only rows with these trends.
+        anomaly {Optional[bool]}: Keep only rows with this anomaly flag.
+        column_with_trend {Text}: Name of trend column.
+        column_with_anomaly {Text}: Name of anomaly column.
+
+    Returns:
+        DataFrame: Selected rows.
+    """
+    needed = None
+    if columns:
+        needed = list(columns)
+        for column, used in (
+            (column_with_trend, trends),
+            (column_with_anomaly, anomaly),
+        ):
+            if used is not None and column not in needed:
+                needed.append(column)
+
+    table = index.read_rows(*index.find_rows(start, end), needed)
+    if trends is not None:
+        table = table.filter(pc.is_in(table[column_with_trend], pa.array(trends)))
+    if anomaly is not None:
+        table = table.filter(pc.equal(table[column_with_anomaly], anomaly))
+    if columns:
+        table = table.select(list(columns))
+    return table.to_pandas()
+
+
+def select_intervals(
+    index,
+    column: Text,
+    start=None,
+    end=None,
+    labels: Optional[Sequence] = None,
+) -> DataFrame:
+    """
+    Intervals of trend or anomaly column between two dates.
+
+    Intervals saved next to result are used when they are there and are cut by the
+    first and the last rows between dates, otherwise they are collected from rows
+    between dates. Dates without rows between them give no intervals.
+
+    Args:
+        index {BlockIndex}: Index of result.
+        column {Text}: Trend or anomaly column.
+        start: First date, inclusive, from the first row if not set.
+        end: Last date, inclusive, to the last row if not set.
+        labels {Optional[Sequence]}: Keep only intervals with these labels.
+
+    Returns:
+        DataFrame: Intervals, see `IntervalCollector.frame`.
+    """
+    from src.utils.labels import (
+        TREND_LABELS,
+        IntervalCollector,
+        _array_codes,
+        read_intervals,
+    )
+
+    begin, stop = index.find_rows(start, end)
+    intervals = read_intervals(index.path, column, index.rows)
+    if intervals is None:
+        table = index.read_rows(begin, stop, ["date", column])
+        boolean = pa.types.is_boolean(index.schema.field(column).type)
+        collector = IntervalCollector(None if boolean else TREND_LABELS)
+        collector.rows = begin
+        for batch in table.to_batches():
+            collector.add(
+                batch.column("date").to_numpy(zero_copy_only=False),
+                _array_codes(batch.column(column)),
+            )
+        intervals = collector.frame()
+    elif begin >= stop:
+        intervals = intervals.iloc[:0]
+    else:
+        first = np.searchsorted(intervals["end_row"].to_numpy(), begin, side="left")
+        last = np.searchsorted(intervals["start_row"].to_numpy(), stop, side="left")
+        intervals = intervals.iloc[first:last].reset_index(drop=True)
+        if len(intervals):
+            if intervals.at[0, "start_row"] < begin:
+                intervals.at[0, "start_row"] = begin
+                intervals.at[0, "start"] = index.dates_at([begin])[0]
+            if intervals.at[len(intervals) - 1, "end_row"] > stop - 1:
+                intervals.at[len(intervals) - 1, "end_row"] = stop - 1
+                intervals.at[len(intervals) - 1, "end"] = index.dates_at([stop - 1])[0]
+
+    if labels is not None:
+        intervals = intervals[intervals["label"].isin(labels)].reset_index(drop=True)
+    return intervals
+
+
+def query(
+    config_path: Text,
+    start=None,
+    end=None,
+    symbol: Optional[Text] = None,
+    results_dir: Optional[Text] = None,
+    trends: Optional[Sequence[Text]] = None,
+    anomaly: Optional[bool] = None,
+    columns: Optional[Sequence[Text]] = None,
+    intervals: Optional[Text] = None,
+) -> DataFrame:
+    """
+    Trend and anomaly of symbol between two dates without reading the whole result.
+
+    Sparse index of dates is saved next to the result on the first query and is
+    rebuilt when the result changes, see `BlockIndex`.
+
+    Args:
+        config_path {Text}: path to config
+        start: First date, inclusive, from the first row if not set.
+        end: Last date, inclusive, to the last row if not set.
+        symbol {Optional[Text]}: Name of symbol processed by `src/batch.py`, result
+            of DVC pipeline if not set.
+        results_dir {Optional[Text]}: Output directory of `src/batch.py`.
+        trends {Optional[Sequence[Text]]}: Keep only rows or intervals with these
+            trends.
+        anomaly {Optional[bool]}: Keep only rows or intervals with this anomaly
+            flag.
+        columns {Optional[Sequence[Text]]}: Columns of rows, all if not set.
+        intervals {Optional[Text]}: Return intervals of this trend or anomaly column
+            instead of rows.
+
+    Returns:
+        DataFrame: Rows or intervals.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.block_index import DEFAULT_BLOCK_SIZE, BlockIndex
+    from src.utils.logger import get_logger
+
+    logger = get_logger("QUERY", log_level=config["base"]["log_level"])
+    column_with_trend = config["featurize"]["trend_detection"]["column_with_trend"]
+    column_with_anomaly = config["featurize"]["volume_anomaly"]["column_with_anomaly"]
+
+    path = result_path(config, symbol, results_dir)
+    logger.info(f"Open index of {path}")
+    index = BlockIndex.open(
+        path, config["base"].get("query_block_size", DEFAULT_BLOCK_SIZE)
+    )
+    if intervals is not None:
+        labels = trends if intervals == column_with_trend else None
+        if intervals == column_with_anomaly and anomaly is not None:
+            labels = [anomaly]
+        result = select_intervals(index, intervals, start, end, labels)
+    else:
+        result = select_rows(
+            index,
+            start,
+            end,
+            columns,
+            trends,
+            anomaly,
+            column_with_trend,
+            column_with_anomaly,
+        )
+    logger.info(f"Found {len(result)} {'intervals' if intervals else 'rows'}")
+    return result
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument("--start", dest="start", default=None)
+    args_parser.add_argument("--end", dest="end", default=None)
+    args_parser.add_argument("--symbol", dest="symbol", default=None)
+    args_parser.add_argument("--results-dir", dest="results_dir", default=None)
+    args_parser.add_argument("--trend", dest="trends", nargs="+", default=None)
+    args_parser.add_argument(
+        "--anomaly",
+        dest="anomaly",
+        choices=["true", "false"],
+        default=None,
+        help="Keep only rows with or without volume anomaly",
+    )
+    args_parser.add_argument("--columns", dest="columns", nargs="+", default=None)
+    args_parser.add_argument(
+        "--intervals",
+        dest="intervals",
+        default=None,
+        help="Return intervals of this trend or anomaly column instead of rows",
+    )
+    args_parser.add_argument("--output", dest="output", default=None)
+    args = args_parser.parse_args()
+    result = query(
+        config_path=args.config,
+        start=args.start,
+        end=args.end,
+        symbol=args.symbol,
+        results_dir=args.results_dir,
+        trends=args.trends,
+        anomaly=None if args.anomaly is None else args.anomaly == "true",
+        columns=args.columns,
+        intervals=args.intervals,
+    )
+    if args.output:
+        result.to_csv(args.output, index=False)
+    else:
+        print(result.to_string(index=False))
@@ -0,0 +1,493 @@
+import argparse
+import collections
+import json
+import sys
+import time
+import warnings
+from typing import Optional, Sequence, Text
+
+import numpy as np
+import pyarrow as pa
+from envyaml import EnvYAML
+from pandas import DataFrame
+
+warnings.filterwarnings("ignore")
+
+
+class ReplayRecorder:
+    """
+    Point-in-time labels of bars replayed through online detectors.
+
+    Every bar gets the label shown when it arrived: the provisional trend of the
+    detector and whether it became an anomaly candidate. Segments and anomalies
+    emitted later change the shown labels; every change is counted as a revision of
+    the bar together with the row after which its label did not change any more.
+    Emitted segments and anomalies are kept with the row at which they became known.
+
+    Detectors emit a rise or fall segment when the extremum closing it is confirmed,
+    `order_for_fall_rise` bars after it, a flat segment `order_for_flat` bars after
+    its last extremum and resolve an anomaly candidate at the first bar later than
+    `gap_end_date` minutes after it. So the row at which an interval became known
+    does not depend on how many bars the detectors got at once, and bars can be
+    replayed by large chunks.
+    """
+
+    def __init__(self, rows: int, trend_order: int, flat_order: int, gap: int):
+        """
+        Create empty record.
+
+        Args:
+            rows {int}: Number of bars to replay.
+            trend_order {int}: Order of extremes of rise and fall.
+            flat_order {int}: Order of extremes of flat.
+            gap {int}: Time to resolve anomaly candidate, in nanoseconds.
+        """
+        from src.utils.labels import TREND_LABELS
+
+        self.trend_order = trend_order
+        self.flat_order = flat_order
+        self.gap = gap
+        self.rows = 0
+        self.dates = np.empty(rows, dtype=np.int64)
+        self.trend_live = np.zeros(rows, dtype=np.int8)
+        self.trend = np.zeros(rows, dtype=np.int8)
+        self.flat = np.zeros(rows, dtype=bool)
+        self.trend_revisions = np.zeros(rows, dtype=np.int32)
+        self.trend_final_row = np.full(rows, -1, dtype=np.int64)
+        self.current_trend = TREND_LABELS.index("null")
+        self.anomaly_live = np.zeros(rows, dtype=bool)
+        self.anomaly = np.zeros(rows, dtype=bool)
+        self.flagged = np.zeros(rows, dtype=bool)
+        self.anomaly_revisions = np.zeros(rows, dtype=np.int32)
+        self.anomaly_final_row = np.full(rows, -1, dtype=np.int64)
+        self.candidates: collections.deque = collections.deque()
+        self.intervals = []
+
+    def add_bars(self, dates: np.ndarray):
+        """
+        Add dates of next bars.
+
+        Args:
+            dates {np.ndarray}: Int64 dates.
+        """
+        begin, self.rows = self.rows, self.rows + len(dates)
+        self.dates[begin : self.rows] = dates
+        self.trend_final_row[begin : self.rows] = np.arange(begin, self.rows)
+        self.anomaly_final_row[begin : self.rows] = np.arange(begin, self.rows)
+
+    def _known_trend(self, segments: Sequence[tuple]) -> np.ndarray:
+        return np.array(
+            [
+                end + (self.flat_order if label == "flat" else self.trend_order + 1)
+                for _, end, label in segments
+            ],
+            dtype=np.int64,
+        )
+
+    def observe_trend(self, begin: int, segments: Sequence[tuple]):
+        """
+        Record trend of new bars as it is shown when the bars arrive.
+
+        The latest bar gets the direction opposite to the last closed rise or fall,
+        like `OnlineTrendDetector.current_trend`.
+
+        Args:
+            begin {int}: First new row.
+            segments {Sequence[tuple]}: Segments emitted after the new bars.
+        """
+        from src.utils.labels import TREND_LABELS
+
+        known = self._known_trend(segments)
+        closed = [
+            number for number, segment in enumerate(segments) if segment[2] != "flat"
+        ]
+        closed.sort(key=lambda number: known[number])
+        codes = [self.current_trend] + [
+            TREND_LABELS.index("rise" if segments[number][2] == "fall" else "fall")
+            for number in closed
+        ]
+        positions = np.searchsorted(
+            known[closed], np.arange(begin, self.rows), side="right"
+        )
+        self.trend_live[begin : self.rows] = np.asarray(codes, np.int8)[positions]
+        self.trend[begin : self.rows] = self.trend_live[begin : self.rows]
+        self.current_trend = codes[-1]
+
+    def emit_trend(self, segments: Sequence[tuple], flushed: bool = False):
+        """
+        Apply trend segments in the order they became known.
+
+        Flat segments override rise and fall like in the batch pipeline.
+
+        Args:
+            segments {Sequence[tuple]}: Segments `(first row, last row, label)`.
+            flushed {bool}: Segments were emitted at the end of history and became
+                known at the last row.
+        """
+        from src.utils.labels import TREND_LABELS
+
+        known = self._known_trend(segments)
+        if flushed:
+            known[:] = self.rows - 1
+        for number in np.argsort(known, kind="stable"):
+            start, end, label = segments[number]
+            rows = slice(start, end + 1)
+            mask = ~self.flat[rows]
+            if label == "flat":
+                self.flat[rows] = True
+            code = TREND_LABELS.index(label)
+            shown = self.trend[rows]
+            changed = mask & (shown != code)
+            self.trend_revisions[rows] += changed
+            self.trend_final_row[rows][changed] = known[number]
+            shown[mask] = code
+            self.intervals.append(
+                ("trend", label, start, end, int(known[number]), flushed)
+            )
+
+    def _known_anomaly(self, start: int) -> int:
+        return int(
+            np.searchsorted(
+                self.dates[: self.rows], self.dates[start] + self.gap, side="right"
+            )
+        )
+
+    def add_candidates(self, candidates: Sequence[int]):
+        """
+        Record anomaly candidates, they are shown as anomaly until resolved.
+
+        Args:
+            candidates {Sequence[int]}: Rows of new candidates.
+        """
+        for row in candidates:
+            self.anomaly_live[row] = self.anomaly[row] = True
+            self.candidates.append(row)
+
+    def emit_anomalies(self, anomalies: Sequence[tuple], flushed: bool = False):
+        """
+        Apply anomalies, they come in the order they became known.
+
+        Args:
+            anomalies {Sequence[tuple]}: Anomalies `(first row, last row)`.
+            flushed {bool}: Anomalies were emitted at the end of history and became
+                known at the last row.
+        """
+        for start, end in anomalies:
+            known = self.rows - 1 if flushed else self._known_anomaly(start)
+            rows = slice(start, end + 1)
+            self.flagged[rows] = True
+            changed = ~self.anomaly[rows]
+            self.anomaly_revisions[rows] += changed
+            self.anomaly_final_row[rows][changed] = known
+            self.anomaly[rows] = True
+            self.intervals.append(("anomaly", True, start, end, known, flushed))
+
+    def resolve(self, first_open: int, flushed: bool = False):
+        """
+        Clear candidates which were resolved without anomaly.
+
+        Anomalies which cover a candidate start at earlier candidates, so they are
+        applied by then.
+
+        Args:
+            first_open {int}: Row of the oldest candidate which is still open.
+            flushed {bool}: Candidates were resolved at the end of history.
+        """
+        while self.candidates and self.candidates[0] < first_open:
+            candidate = self.candidates.popleft()
+            if not self.flagged[candidate]:
+                self.anomaly[candidate] = False
+                self.anomaly_revisions[candidate] += 1
+                self.anomaly_final_row[candidate] = (
+                    self.rows - 1 if flushed else self._known_anomaly(candidate)
+                )
+
+    def frame(self, column_with_trend: Text, column_with_anomaly: Text) -> DataFrame:
+        """
+        Labels of every bar.
+
+        Args:
+            column_with_trend {Text}: Name of trend column.
+            column_with_anomaly {Text}: Name of anomaly column.
+
+        Returns:
+            DataFrame: `date`, live and final labels, numbers of revisions and rows
+                after which labels became final.
+        """
+        from src.utils.labels import trend_categorical
+
+        return DataFrame(
+            {
+                "date": self.dates.view("datetime64[ns]"),
+                f"{column_with_trend}_live": trend_categorical(self.trend_live),
+                column_with_trend: trend_categorical(self.trend),
+                f"{column_with_trend}_revisions": self.trend_revisions,
+                f"{column_with_trend}_final_row": self.trend_final_row,
+                f"{column_with_anomaly}_live": self.anomaly_live,
+                column_with_anomaly: self.anomaly,
+                f"{column_with_anomaly}_revisions": self.anomaly_revisions,
+                f"{column_with_anomaly}_final_row": self.anomaly_final_row,
+            }
+        )
+
+    def interval_frame(self) -> DataFrame:
+        """
+        Segments and anomalies with their detection delay.
+
+        Returns:
+            DataFrame: `kind`, `label`, rows and dates of `start`, `end` and the
+                moment the interval became `known`, delay after start and end in bars
+                and time, `flushed` for intervals emitted at the end of history.
+        """
+        intervals = DataFrame(
+            self.intervals,
+            columns=["kind", "label", "start_row", "end_row", "known_row", "flushed"],
+        )
+        dates = self.dates.view("datetime64[ns]")
+        for name in ["start", "end", "known"]:
+            intervals[name] = dates[intervals[f"{name}_row"].to_numpy(np.int64)]
+        for name in ["start", "end"]:
+            intervals[f"bars_after_{name}"] = (
+                intervals["known_row"] - intervals[f"{name}_row"]
+            )
+            intervals[f"time_after_{name}"] = intervals["known"] - intervals[name]
+        return intervals
+
+    def summary(self, intervals: DataFrame) -> dict:
+        """
+        Agreement of point-in-time labels with final ones and detection delays.
+
+        Args:
+            intervals {DataFrame}: Result of `interval_frame`.
+
+        Returns:
+            dict: Statistics of trend and anomaly.
+        """
+        from src.utils.labels import TREND_LABELS
+
+        def delays(kind: Text, label=None) -> dict:
+            known = intervals[(intervals["kind"] == kind) & ~intervals["flushed"]]
+            if label is not None:
+                known = known[known["label"] == label]
+            result = {"intervals": len(known)}
+            for name in ["start", "end"]:
+                bars = known[f"bars_after_{name}"].to_numpy()
+                for statistic, q in (("p50", 50), ("p90", 90), ("max", 100)):
+                    result[f"bars_after_{name}_{statistic}"] = (
+                        float(np.percentile(bars, q)) if len(bars) else None
+                    )
+            return result
+
+        rows = len(self.dates)
+        return {
+            "rows": rows,
+            "trend": {
+                "live_agreement": (
+                    float(np.mean(self.trend_live == self.trend)) if rows else None
+                ),
+                "revised_bars": int(np.count_nonzero(self.trend_revisions)),
+                "revisions": int(self.trend_revisions.sum()),
+                **{label: delays("trend", label) for label in TREND_LABELS[1:]},
+            },
+            "anomaly": {
+                "candidates": int(self.anomaly_live.sum()),
+                "false_alarms": int(
+                    np.count_nonzero(self.anomaly_live & ~self.anomaly)
+                ),
+                "late_bars": int(np.count_nonzero(~self.anomaly_live & self.anomaly)),
+                "revised_bars": int(np.count_nonzero(self.anomaly_revisions)),
+                "revisions": int(self.anomaly_revisions.sum()),
+                **delays("anomaly"),
+            },
+        }
+
+
+def count_rows(path: Text) -> int:
+    """
+    Number of rows of Feather file without reading columns.
+
+    Args:
+        path {Text}: Path to Feather file.
+
+    Returns:
+        int: Number of rows.
+    """
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    return sum(
+        reader.get_batch(number).num_rows for number in range(reader.num_record_batches)
+    )
+
+
+def replay(
+    raw_path: Text, config: EnvYAML, chunk_size: Optional[int] = None
+) -> ReplayRecorder:
+    """
+    Walk raw data in time order and record what live detectors showed at each bar.
+
+    Online detectors keep their state between chunks, so every bar is processed
+    once and no future bar is used for labels shown before it. Volume detector gets
+    a chunk by parts not longer than `gap_end_date` minutes, so candidates are seen
+    before they are resolved. Final labels are the same as the ones of the batch
+    pipeline.
+
+    Args:
+        raw_path {Text}: Path to raw data sorted by date.
+        config {EnvYAML}: Yaml file with configurations.
+        chunk_size {Optional[int]}: Number of rows read at once, `base.chunk_size`
+            from config if not set.
+
+    Returns:
+        ReplayRecorder: Point-in-time labels and intervals.
+    """
+    from src.chunked import DEFAULT_CHUNK_SIZE
+    from src.models.online_trend_detection import OnlineTrendDetector
+    from src.models.online_volume_anomaly import OnlineVolumeAnomalyDetector
+    from src.utils.arrow_io import column_to_numpy, iter_batches
+    from src.utils.range_index import dates_to_int64
+
+    chunk_size = chunk_size or config["base"].get("chunk_size", DEFAULT_CHUNK_SIZE)
+    column_for_macd = config["featurize"]["trend_detection"]["column_for_macd"]
+    trend_detector = OnlineTrendDetector.from_config(config)
+    volume_detector = OnlineVolumeAnomalyDetector.from_config(config)
+    recorder = ReplayRecorder(
+        count_rows(raw_path),
+        trend_detector.trend_extremes.order,
+        trend_detector.flat_extremes.order,
+        volume_detector.gap,
+    )
+
+    for batch in iter_batches(
+        raw_path, chunk_size, ["date", "volume", column_for_macd]
+    ):
+        begin = recorder.rows
+        dates = dates_to_int64(column_to_numpy(batch.column("date")))
+        volumes = column_to_numpy(batch.column("volume"))
+        recorder.add_bars(dates)
+
+        segments = trend_detector.update(column_to_numpy(batch.column(column_for_macd)))
+        recorder.observe_trend(begin, segments)
+        recorder.emit_trend(segments)
+
+        start = 0
+        while start < len(dates):
+            stop = int(
+                np.searchsorted(dates, dates[start] + volume_detector.gap, "right")
+            )
+            anomalies = volume_detector.update(dates[start:stop], volumes[start:stop])
+            candidates = []
+            for row, *_ in reversed(volume_detector.candidates):
+                if row < begin + start:
+                    break
+                candidates.append(row)
+            recorder.add_candidates(candidates[::-1])
+            recorder.emit_anomalies(anomalies)
+            recorder.resolve(
+                volume_detector.candidates[0][0]
+                if volume_detector.candidates
+                else volume_detector.total
+            )
+            start = stop
+
+    recorder.emit_trend(trend_detector.flush(), flushed=True)
+    recorder.emit_anomalies(volume_detector.flush(), flushed=True)
+    recorder.resolve(recorder.rows, flushed=True)
+    return recorder
+
+
+def run_replay(
+    config_path: Text,
+    raw_path: Optional[Text] = None,
+    chunk_size: Optional[int] = None,
+    output: Optional[Text] = None,
+    intervals_output: Optional[Text] = None,
+) -> dict:
+    """
+    Backtest live labels over raw data and save them.
+
+    Args:
+        config_path {Text}: path to config
+        raw_path {Optional[Text]}: Path to raw data, `data.raw` if not set.
+        chunk_size {Optional[int]}: Number of rows read at once.
+        output {Optional[Text]}: Feather file for labels of every bar.
+        intervals_output {Optional[Text]}: CSV file for segments and anomalies.
+
+    Returns:
+        dict: Summary, see `ReplayRecorder.summary`.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import write_frame_with_config
+    from src.utils.instrumentation import span
+    from src.utils.logger import get_logger
+
+    logger = get_logger("REPLAY", log_level=config["base"]["log_level"])
+    column_with_trend = config["featurize"]["trend_detection"]["column_with_trend"]
+    column_with_anomaly = config["featurize"]["volume_anomaly"]["column_with_anomaly"]
+    raw_path = raw_path or config["data"]["raw"]
+
+    logger.info(f"Replay {raw_path}")
+    started = time.perf_counter()
+    with span("replay") as replay_span:
+        recorder = replay(raw_path, config, chunk_size)
+        replay_span.add_rows(len(recorder.dates))
+    seconds = time.perf_counter() - started
+    intervals = recorder.interval_frame()
+    summary = {
+        "seconds": seconds,
+        "bars_per_second": len(recorder.dates) / seconds if seconds else None,
+        **recorder.summary(intervals),
+    }
+    logger.info(
+        f"Replayed {summary['rows']} bars in {seconds:.1f} s, "
+        f"{summary['trend']['revised_bars']} bars changed trend and "
+        f"{summary['anomaly']['revised_bars']} bars changed anomaly after they came"
+    )
+
+    if output:
+        with span("write", rows=len(recorder.dates)):
+            write_frame_with_config(
+                recorder.frame(column_with_trend, column_with_anomaly), output, config
+            )
+        logger.info(f"Saved labels of bars to {output}")
+    if intervals_output:
+        intervals.to_csv(intervals_output, index=False)
+        logger.info(f"Saved intervals to {intervals_output}")
+    return summary
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument(
+        "--input",
+        dest="raw_path",
+        default=None,
+        help="raw feather, data.raw by default",
+    )
+    args_parser.add_argument(
+        "--chunk-size", dest="chunk_size", type=int, help="number of rows read at once"
+    )
+    args_parser.add_argument(
+        "--output", dest="output", default=None, help="feather with labels of bars"
+    )
+    args_parser.add_argument(
+        "--intervals",
+        dest="intervals",
+        default=None,
+        help="csv with segments and anomalies and their delays",
+    )
+    args_parser.add_argument(
+        "--summary", dest="summary", default=None, help="json with summary"
+    )
+    args = args_parser.parse_args()
+    summary = run_replay(
+        config_path=args.config,
+        raw_path=args.raw_path,
+        chunk_size=args.chunk_size,
+        output=args.output,
+        intervals_output=args.intervals,
+    )
+    if args.summary:
+        with open(args.summary, "w") as file:
+            json.dump(summary, file, indent=2)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,632 @@
+import argparse
+import asyncio
+import collections
+import json
+import pickle
+import sys
+import time
+import warnings
+from typing import Optional, Text
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+from envyaml import EnvYAML
+
+warnings.filterwarnings("ignore")
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_MAX_BATCH = 1024
+DEFAULT_SLICE_MS = 5.0
+FIRST_SLICE = 64
+READ_SLICE = 256
+DEFAULT_RECENT_INTERVALS = 1000
+LATENCY_WINDOW = 10000
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found"}
+
+
+def parse_bar(line, column_for_macd: Text) -> tuple[int, float, float]:
+    """
+    Read bar sent as JSON object with `date`, price column and `volume`.
+
+    Args:
+        line {Union[Text, bytes, dict]}: JSON line or decoded object, date is an ISO
+            string or int64 nanoseconds since epoch.
+        column_for_macd {Text}: Name of price column.
+
+    Returns:
+        tuple[int, float, float]: Date as int64, price and volume.
+    """
+    bar = line if isinstance(line, dict) else json.loads(line)
+    date = bar["date"]
+    if not isinstance(date, (int, float)):
+        date = pd.Timestamp(date).value
+    return int(date), float(bar[column_for_macd]), float(bar["volume"])
+
+
+def format_date(date: Optional[int]) -> Optional[Text]:
+    """
+    Date for JSON responses.
+
+    Args:
+        date {Optional[int]}: Int64 timestamp.
+
+    Returns:
+        Optional[Text]: ISO date or None if it is not known.
+    """
+    return None if date is None else pd.Timestamp(date).isoformat()
+
+
+class LiveDetector:
+    """
+    Trend and volume anomaly of a stream of bars.
+
+    Wraps online detectors, which may be restored from the checkpoint of
+    `src/incremental.py`, and keeps dates of rows that segments emitted later can
+    still cover, recent segments and anomalies as intervals of dates and latency of
+    the last bars.
+    """
+
+    def __init__(
+        self, config: EnvYAML, recent: int = DEFAULT_RECENT_INTERVALS, state=None
+    ):
+        """
+        Create detector.
+
+        Args:
+            config {EnvYAML}: Yaml file with configurations.
+            recent {int}: Number of recent trend segments and anomalies to keep.
+            state {Optional[dict]}: Checkpoint of `src/incremental.py`.
+        """
+        from src.models.online_trend_detection import OnlineTrendDetector
+        from src.models.online_volume_anomaly import OnlineVolumeAnomalyDetector
+
+        if state is None:
+            self.trend = OnlineTrendDetector.from_config(config)
+            self.volume = OnlineVolumeAnomalyDetector.from_config(config)
+            self.rows = 0
+            self.last_date = None
+        else:
+            self.trend, self.volume, self.rows = (
+                state["trend"],
+                state["volume"],
+                state["rows"],
+            )
+            self.last_date = state.get("last_date")
+        self.dates = np.empty(0, dtype=np.int64)
+        self.dates_offset = self.rows
+        self.last_bar = None
+        self.trend_intervals = collections.deque(maxlen=recent)
+        self.anomaly_intervals = collections.deque(maxlen=recent)
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def date_at(self, row: int) -> Optional[int]:
+        """
+        Date of row if it is still kept.
+
+        Args:
+            row {int}: Number of row.
+
+        Returns:
+            Optional[int]: Int64 timestamp.
+        """
+        if self.dates_offset <= row < self.rows:
+            return int(self.dates[row - self.dates_offset])
+        return None
+
+    def _interval(self, start: int, end: int, label) -> dict:
+        return {
+            "start": format_date(self.date_at(start)),
+            "end": format_date(self.date_at(end)),
+            "start_row": start,
+            "end_row": end,
+            "label": label,
+        }
+
+    def update(self, dates: np.ndarray, prices: np.ndarray, volumes: np.ndarray):
+        """
+        Add next bars.
+
+        Args:
+            dates {np.ndarray}: Int64 dates of bars in increasing order.
+            prices {np.ndarray}: Price of bars.
+            volumes {np.ndarray}: Volume of bars.
+        """
+        from src.incremental import keep_from
+
+        segments = self.trend.update(prices)
+        anomalies = self.volume.update(dates, volumes)
+        self.dates = np.concatenate([self.dates, dates])
+        self.rows += len(dates)
+        self.last_bar = (int(dates[-1]), float(prices[-1]), float(volumes[-1]))
+        self.last_date = self.last_bar[0]
+        for start, end, label in segments:
+            self.trend_intervals.append(self._interval(start, end, label))
+        for start, end in anomalies:
+            self.anomaly_intervals.append(self._interval(start, end, True))
+
+        bound = keep_from(self.trend, self.volume)
+        if bound > self.dates_offset:
+            self.dates = self.dates[bound - self.dates_offset :]
+            self.dates_offset = bound
+
+    def rejected(self, date: int, last_date: Optional[int]) -> Optional[Text]:
+        """
+        Reason why bar can not be added after the last one.
+
+        Args:
+            date {int}: Int64 date of bar.
+            last_date {Optional[int]}: Date of the last accepted bar.
+
+        Returns:
+            Optional[Text]: Error or None if bar is accepted.
+        """
+        if last_date is not None and date < last_date:
+            return (
+                f"Date {format_date(date)} is before the date of the last bar "
+                f"{format_date(last_date)}"
+            )
+        return None
+
+    def snapshot(self) -> dict:
+        """
+        Current state.
+
+        Rows before `final_from_row` have final labels, the latest rows have the
+        provisional trend opposite to the last closed one until the next extremum is
+        confirmed.
+
+        Returns:
+            dict: State for JSON response.
+        """
+        from src.incremental import keep_from
+
+        latencies = np.array(self.latencies, dtype=np.float64) / 1e6
+        date, price, volume = self.last_bar or (None, None, None)
+        final_from = keep_from(self.trend, self.volume)
+        return {
+            "rows": self.rows,
+            "date": format_date(date),
+            "price": price,
+            "volume": volume,
+            "trend": self.trend.current_trend,
+            "final_from_row": final_from,
+            "final_from": format_date(self.date_at(final_from)),
+            "open_candidates": self.volume.open_candidates,
+            "latency_ms": {
+                name: float(np.percentile(latencies, q)) if len(latencies) else None
+                for name, q in (("p50", 50), ("p99", 99), ("max", 100))
+            },
+        }
+
+    def intervals(self, kind: Text, limit: int) -> list[dict]:
+        """
+        Recent trend segments or anomalies.
+
+        Args:
+            kind {Text}: "trend" or "anomaly".
+            limit {int}: Maximum number of intervals.
+
+        Returns:
+            list[dict]: Intervals from the oldest to the latest.
+        """
+        intervals = self.trend_intervals if kind == "trend" else self.anomaly_intervals
+        return list(intervals)[-limit:] if limit > 0 else []
+
+
+def reply(writer: Optional[asyncio.StreamWriter], body: dict):
+    """
+    Send JSON line to connection which sent bars.
+
+    Args:
+        writer {Optional[asyncio.StreamWriter]}: Connection, None for file sources.
+        body {dict}: Answer.
+    """
+    if writer is not None and not writer.is_closing():
+        writer.write(json.dumps(body).encode() + b"\n")
+
+
+async def consume(
+    queue: asyncio.Queue,
+    detector: LiveDetector,
+    max_batch: int,
+    slice_ms: float = DEFAULT_SLICE_MS,
+    logger=None,
+):
+    """
+    Feed bars from queue to detector by micro-batches.
+
+    All bars waiting in queue, up to `max_batch`, are taken at once, so the
+    detector keeps up when bars arrive faster than one by one. A batch is processed
+    by slices which take about `slice_ms` milliseconds, with the time per bar of
+    the previous slices, and requests are answered between slices. Sources which
+    sent bars of a slice get the number of processed rows back. A bar dated before
+    the last one is rejected with an error line, so is a slice whose update failed.
+
+    Args:
+        queue {asyncio.Queue}: Bars with time of receipt and connection to ack.
+        detector {LiveDetector}: Detector.
+        max_batch {int}: Maximum number of bars in micro-batch.
+        slice_ms {float}: Time budget of detector update between answers.
+        logger {Optional[logging.Logger]}: Logger of failed updates.
+    """
+    seconds_per_bar = None
+    while True:
+        bars = [await queue.get()]
+        while len(bars) < max_batch and not queue.empty():
+            bars.append(queue.get_nowait())
+
+        accepted, last_date = [], detector.last_date
+        for bar in bars:
+            error = detector.rejected(bar[0], last_date)
+            if error is None:
+                accepted.append(bar)
+                last_date = bar[0]
+            else:
+                reply(bar[4], {"error": error})
+
+        start = 0
+        while start < len(accepted):
+            size = (
+                FIRST_SLICE
+                if seconds_per_bar is None
+                else max(1, int(slice_ms / 1e3 / seconds_per_bar))
+            )
+            part = accepted[start : start + size]
+            start += len(part)
+            dates, prices, volumes, received, writers = zip(*part)
+            started = time.perf_counter()
+            try:
+                detector.update(
+                    np.array(dates, dtype=np.int64),
+                    np.array(prices, dtype=np.float64),
+                    np.array(volumes, dtype=np.float64),
+                )
+            except Exception as error:
+                if logger is not None:
+                    logger.exception(f"Bars of {format_date(dates[0])} are rejected")
+                for writer in set(writers):
+                    reply(writer, {"error": f"Bars are not processed: {error}"})
+            else:
+                now = time.perf_counter_ns()
+                detector.latencies.extend(now - moment for moment in received)
+                for writer in set(writers):
+                    reply(writer, {"rows": detector.rows})
+            seconds_per_bar = (time.perf_counter() - started) / len(part)
+            await asyncio.sleep(0)
+
+        for _ in bars:
+            queue.task_done()
+
+
+async def replay_source(
+    queue: asyncio.Queue,
+    path: Text,
+    column_for_macd: Text,
+    speed: float = 0.0,
+    batch_size: int = DEFAULT_MAX_BATCH,
+):
+    """
+    Replay raw Feather file as a stream.
+
+    Args:
+        queue {asyncio.Queue}: Queue of bars.
+        path {Text}: Path to raw data sorted by date.
+        column_for_macd {Text}: Name of price column.
+        speed {float}: Times faster than real time, as fast as possible if 0.
+        batch_size {int}: Number of rows read from file at once.
+    """
+    from src.utils.arrow_io import column_to_numpy, iter_batches
+
+    first, started = None, time.monotonic()
+    for batch in iter_batches(path, batch_size, ["date", "volume", column_for_macd]):
+        dates = column_to_numpy(batch.column("date")).view(np.int64).tolist()
+        prices = column_to_numpy(batch.column(column_for_macd)).tolist()
+        volumes = column_to_numpy(batch.column("volume")).tolist()
+        for date, price, volume in zip(dates, prices, volumes):
+            if speed > 0:
+                first = date if first is None else first
+                delay = (date - first) / 1e9 / speed - (time.monotonic() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await queue.put((date, price, volume, time.perf_counter_ns(), None))
+        await asyncio.sleep(0)
+
+
+async def tail_source(
+    queue: asyncio.Queue,
+    path: Text,
+    column_for_macd: Text,
+    poll: float = 0.1,
+    logger=None,
+):
+    """
+    Follow file to which bars are appended as JSON lines.
+
+    File is read in a thread, so a slow disk does not stop answers to requests, and
+    other tasks run after every `READ_SLICE` lines. Lines which are not bars are
+    skipped and logged.
+
+    Args:
+        queue {asyncio.Queue}: Queue of bars.
+        path {Text}: Path to file.
+        column_for_macd {Text}: Name of price column.
+        poll {float}: Seconds between checks for new lines.
+        logger {Optional[logging.Logger]}: Logger of rejected lines.
+    """
+    with open(path, "rb") as file:
+        rest, number = b"", 0
+        while True:
+            chunk = await asyncio.to_thread(file.read, 1 << 16)
+            if not chunk:
+                await asyncio.sleep(poll)
+                continue
+            *lines, rest = (rest + chunk).split(b"\n")
+            for line in lines:
+                number += 1
+                if line.strip():
+                    try:
+                        bar = parse_bar(line, column_for_macd)
+                    except (ValueError, KeyError, TypeError) as error:
+                        if logger is not None:
+                            logger.warning(
+                                f"Line {number} of {path} is not read: {error!r}"
+                            )
+                    else:
+                        await queue.put((*bar, time.perf_counter_ns(), None))
+                if number % READ_SLICE == 0:
+                    await asyncio.sleep(0)
+
+
+async def socket_source(
+    queue: asyncio.Queue,
+    column_for_macd: Text,
+    host: Optional[Text] = None,
+    port: Optional[int] = None,
+    path: Optional[Text] = None,
+):
+    """
+    Accept bars as JSON lines from TCP or Unix socket connections.
+
+    Every connection gets `{"rows": N}` lines back when its bars are processed and
+    `{"error": ...}` lines for bars which are rejected. Lines are not read while
+    queue is full, so senders are slowed down by the socket buffers instead of bars
+    piling up in memory, and other tasks run after every `READ_SLICE` lines.
+
+    Args:
+        queue {asyncio.Queue}: Queue of bars.
+        column_for_macd {Text}: Name of price column.
+        host {Optional[Text]}: Host of TCP socket.
+        port {Optional[int]}: Port of TCP socket.
+        path {Optional[Text]}: Path of Unix socket, used instead of TCP if set.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lines = 0
+        try:
+            async for line in reader:
+                if line.strip():
+                    try:
+                        bar = parse_bar(line, column_for_macd)
+                    except (ValueError, KeyError, TypeError) as error:
+                        reply(writer, {"error": f"Bar is not read: {error!r}"})
+                    else:
+                        await queue.put((*bar, time.perf_counter_ns(), writer))
+                await writer.drain()
+                lines += 1
+                if lines % READ_SLICE == 0:
+                    await asyncio.sleep(0)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if path:
+        server = await asyncio.start_unix_server(handle, path=path)
+    else:
+        server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def route(detector: LiveDetector, queue: asyncio.Queue, target: Text):
+    """
+    Answer request.
+
+    Args:
+        detector {LiveDetector}: Detector.
+        queue {asyncio.Queue}: Queue of bars.
+        target {Text}: Path with query string, `/state`, `/health` or
+            `/intervals?kind=trend|anomaly&limit=N`.
+
+    Returns:
+        tuple[int, object]: Status and body.
+    """
+    url = urlsplit(target)
+    query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+    if url.path == "/state":
+        return 200, detector.snapshot()
+    if url.path == "/health":
+        return 200, {"rows": detector.rows, "queue": queue.qsize()}
+    if url.path == "/intervals":
+        kind = query.get("kind", "trend")
+        if kind not in ("trend", "anomaly") or not query.get("limit", "0").isdigit():
+            return 400, {"error": "kind must be trend or anomaly, limit a number"}
+        return 200, detector.intervals(kind, int(query.get("limit", 100)))
+    return 404, {"error": f"Unknown path {url.path}"}
+
+
+async def handle_http(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    detector: LiveDetector,
+    queue: asyncio.Queue,
+):
+    """
+    Serve JSON over HTTP/1.1 with keep-alive.
+
+    Args:
+        reader {asyncio.StreamReader}: Connection.
+        writer {asyncio.StreamWriter}: Connection.
+        detector {LiveDetector}: Detector.
+        queue {asyncio.Queue}: Queue of bars.
+    """
+    try:
+        while True:
+            request = await reader.readline()
+            if not request:
+                break
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            parts = request.decode("latin-1").split()
+            if len(parts) != 3 or parts[0] != "GET":
+                status, body = 400, {"error": "Only GET requests are served"}
+            else:
+                status, body = route(detector, queue, parts[1])
+            payload = json.dumps(body).encode()
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(
+    config: EnvYAML,
+    source: Text,
+    source_path: Optional[Text] = None,
+    speed: float = 0.0,
+    checkpoint: Optional[Text] = None,
+):
+    """
+    Run detectors over stream of bars and serve their state.
+
+    Args:
+        config {EnvYAML}: Yaml file with configurations.
+        source {Text}: "replay", "tail", "tcp" or "unix".
+        source_path {Optional[Text]}: Raw Feather file for replay, file with JSON
+            lines for tail, `host:port` for tcp or socket path for unix.
+        speed {float}: Speed of replay, as fast as possible if 0.
+        checkpoint {Optional[Text]}: Checkpoint of `src/incremental.py` to continue.
+    """
+    from src.incremental import state_params
+    from src.utils.logger import get_logger
+
+    logger = get_logger("SERVICE", log_level=config["base"]["log_level"])
+    settings = config["service"]
+    column_for_macd = config["featurize"]["trend_detection"]["column_for_macd"]
+
+    state = None
+    if checkpoint:
+        with open(checkpoint, "rb") as file:
+            state = pickle.load(file)
+        if state.get("params") != state_params(config):
+            raise ValueError(f"Checkpoint {checkpoint} has other parameters")
+        logger.info(f"Continue from row {state['rows']} of {checkpoint}")
+    detector = LiveDetector(
+        config, settings.get("recent_intervals", DEFAULT_RECENT_INTERVALS), state
+    )
+    queue = asyncio.Queue(maxsize=settings.get("queue_size", DEFAULT_QUEUE_SIZE))
+
+    if source == "replay":
+        feed = replay_source(
+            queue, source_path or config["data"]["raw"], column_for_macd, speed
+        )
+    elif source == "tail":
+        feed = tail_source(queue, source_path, column_for_macd, logger=logger)
+    elif source == "tcp":
+        host, _, port = source_path.rpartition(":")
+        feed = socket_source(queue, column_for_macd, host or None, int(port))
+    else:
+        feed = socket_source(queue, column_for_macd, path=source_path)
+
+    def http(reader, writer):
+        return handle_http(reader, writer, detector, queue)
+
+    if settings.get("unix_socket"):
+        server = await asyncio.start_unix_server(http, path=settings["unix_socket"])
+        logger.info(f"Serve state on {settings['unix_socket']}")
+    else:
+        server = await asyncio.start_server(http, settings["host"], settings["port"])
+        logger.info(f"Serve state on http://{settings['host']}:{settings['port']}")
+    logger.info(f"Read bars from {source} {source_path or ''}")
+    async with server:
+        await asyncio.gather(
+            server.serve_forever(),
+            consume(
+                queue,
+                detector,
+                settings.get("max_batch", DEFAULT_MAX_BATCH),
+                settings.get("slice_ms", DEFAULT_SLICE_MS),
+                logger,
+            ),
+            feed,
+        )
+
+
+def run_service(
+    config_path: Text,
+    source: Text,
+    source_path: Optional[Text] = None,
+    speed: float = 0.0,
+    checkpoint: Optional[Text] = None,
+):
+    """
+    Run live service until it is stopped.
+
+    Args:
+        config_path {Text}: path to config
+        source {Text}: "replay", "tail", "tcp" or "unix".
+        source_path {Optional[Text]}: Where bars come from, see `serve`.
+        speed {float}: Speed of replay, as fast as possible if 0.
+        checkpoint {Optional[Text]}: Checkpoint of `src/incremental.py` to continue.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    try:
+        asyncio.run(serve(config, source, source_path, speed, checkpoint))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument(
+        "--source",
+        dest="source",
+        choices=["replay", "tail", "tcp", "unix"],
+        default="replay",
+    )
+    args_parser.add_argument(
+        "--input",
+        dest="source_path",
+        default=None,
+        help="raw feather for replay (data.raw by default), JSON lines file for "
+        "tail, host:port for tcp or socket path for unix",
+    )
+    args_parser.add_argument(
+        "--speed",
+        dest="speed",
+        type=float,
+        default=0.0,
+        help="replay speed relative to real time, as fast as possible if 0",
+    )
+    args_parser.add_argument("--checkpoint", dest="checkpoint", default=None)
+    args = args_parser.parse_args()
+    run_service(
+        config_path=args.config,
+        source=args.source,
+        source_path=args.source_path,
+        speed=args.speed,
+        checkpoint=args.checkpoint,
+    )
@@ -0,0 +1,453 @@
+import argparse
+import itertools
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Optional, Text
+
+import numpy as np
+import yaml
+from envyaml import EnvYAML
+from pandas import DataFrame, Series
+
+warnings.filterwarnings("ignore")
+
+MACD_PARAMETERS = [
+    "column_for_macd",
+    "decay_sm",
+    "decay_lm",
+    "decay_signal",
+    "period_signal",
+    "macd_dtype",
+]
+SWEPT_PARAMETERS = {
+    "trend_detection": MACD_PARAMETERS
+    + [
+        "order_for_fall_rise",
+        "order_for_flat",
+        "window_size_for_rolling_mean",
+        "left_border_for_flat_detection",
+        "right_border_for_flat_detection",
+    ],
+    "volume_anomaly": [
+        "mean_indicator",
+        "threshold_indicator",
+        "columns_rolling_mean",
+        "gap_end_date",
+        "step_to_end_date",
+        "laps",
+        "thresholds",
+    ],
+}
+DEFAULT_PARAMETERS = {"trend_detection": {"macd_dtype": "float64"}}
+LIST_PARAMETERS = ["columns_rolling_mean", "laps", "thresholds"]
+TRENDS = ["fall", "rise", "flat", "null"]
+
+
+def load_grid(path: Text) -> dict[Text, dict[Text, list]]:
+    """
+    Read grid of parameters.
+
+    Grid is a yaml file with `trend_detection` and `volume_anomaly` sections of
+    `featurize`, each parameter has a list of values to try. A single value is the
+    same as a list with one value, list parameters like `thresholds` take a list of
+    lists.
+
+    Args:
+        path {Text}: Path to yaml file with grid.
+
+    Returns:
+        dict[Text, dict[Text, list]]: Values of parameters by section.
+    """
+    from src.utils.exceptions import UnknownSweepParameter
+
+    with open(path) as file:
+        grid = yaml.safe_load(file) or {}
+
+    values = {}
+    for section, parameters in grid.items():
+        for name, options in (parameters or {}).items():
+            if name not in SWEPT_PARAMETERS.get(section, []):
+                raise UnknownSweepParameter(f"{section}.{name}")
+            single = not isinstance(options, list) or (
+                name in LIST_PARAMETERS
+                and not all(isinstance(option, list) for option in options)
+            )
+            values.setdefault(section, {})[name] = [options] if single else options
+    return values
+
+
+def expand_grid(defaults: dict, grid: dict[Text, list]) -> list[dict]:
+    """
+    All combinations of swept values, other parameters are taken from defaults.
+
+    Args:
+        defaults {dict}: Section of `featurize` in config.
+        grid {dict[Text, list]}: Values of swept parameters of the section.
+
+    Returns:
+        list[dict]: Parameters of each grid point.
+    """
+    names = list(grid)
+    return [
+        {**defaults, **dict(zip(names, combination))}
+        for combination in itertools.product(*(grid[name] for name in names))
+    ]
+
+
+def _run_shared(function: Callable, specs: dict, *args):
+    """
+    Attach to shared arrays in worker process and call function with them.
+
+    Args:
+        function {Callable}: Module level function which takes arrays first.
+        specs {dict}: Shared memory specs of arrays.
+        args: Other arguments of function.
+
+    Returns:
+        Result of function.
+    """
+    from src.utils.shared_arrays import attach_arrays
+
+    arrays, blocks = attach_arrays(specs)
+    try:
+        return function(arrays, *args)
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+
+
+def _run_all(
+    function: Callable,
+    tasks: list[tuple],
+    arrays: dict[Text, np.ndarray],
+    executor: Optional[ProcessPoolExecutor] = None,
+    specs: Optional[dict] = None,
+) -> list:
+    """
+    Call function for every task in this process or in worker processes.
+
+    Args:
+        function {Callable}: Module level function which takes arrays first.
+        tasks {list[tuple]}: Other arguments of each call.
+        arrays {dict[Text, np.ndarray]}: Shared intermediates.
+        executor {Optional[ProcessPoolExecutor]}: Pool of workers.
+        specs {Optional[dict]}: Shared memory specs of arrays.
+
+    Returns:
+        list: Results in the order of tasks.
+    """
+    if executor is None:
+        return [function(arrays, *task) for task in tasks]
+    futures = [executor.submit(_run_shared, function, specs, *task) for task in tasks]
+    return [future.result() for future in futures]
+
+
+def _find_extremes(
+    arrays: dict[Text, np.ndarray], signal_line: Text, orders: list[int]
+) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """
+    Find local extremes of one signal line for all orders at once.
+
+    Args:
+        arrays {dict[Text, np.ndarray]}: Shared intermediates.
+        signal_line {Text}: Name of signal line.
+        orders {list[int]}: Numbers of points for comparison.
+
+    Returns:
+        dict[int, tuple[np.ndarray, np.ndarray]]: Indices of local min and max
+            extremes by order.
+    """
+    from src.utils.extremes import find_extremes
+
+    return find_extremes(arrays[signal_line], orders)
+
+
+def _summarize_trend(
+    arrays: dict[Text, np.ndarray],
+    signal_line: Text,
+    extremes_for_fall_rise: tuple[np.ndarray, np.ndarray],
+    extremes_for_flat: tuple[np.ndarray, np.ndarray],
+    params: dict,
+) -> dict:
+    """
+    Label trends of one grid point and count them.
+
+    Args:
+        arrays {dict[Text, np.ndarray]}: Shared intermediates.
+        signal_line {Text}: Name of signal line.
+        extremes_for_fall_rise {tuple}: Extremes for falling and rising price.
+        extremes_for_flat {tuple}: Extremes for flatting price.
+        params {dict}: Parameters of trend detection.
+
+    Returns:
+        dict: Number of rows of each trend and number of trend segments.
+    """
+    from src.models.trend_detection import label_trends
+    from src.utils.labels import TREND_LABELS
+
+    trend = label_trends(
+        arrays[signal_line],
+        extremes_for_fall_rise,
+        extremes_for_flat,
+        params["window_size_for_rolling_mean"],
+        params["left_border_for_flat_detection"],
+        params["right_border_for_flat_detection"],
+    )
+    codes = trend.codes
+    counts = np.bincount(codes, minlength=len(TREND_LABELS))
+    summary = {label: int(counts[TREND_LABELS.index(label)]) for label in TRENDS}
+    summary["trend_segments"] = int(np.count_nonzero(codes[1:] != codes[:-1])) + 1
+    return summary
+
+
+def _summarize_volume(arrays: dict[Text, np.ndarray], params: dict) -> dict:
+    """
+    Find volume anomalies of one grid point and count them.
+
+    Args:
+        arrays {dict[Text, np.ndarray]}: Shared intermediates.
+        params {dict}: Parameters of volume anomaly search.
+
+    Returns:
+        dict: Number of merged anomaly intervals and anomaly rows.
+    """
+    from src.models.volume_anomaly import find_anomaly_intervals
+    from src.utils.intervals import paint_intervals
+    from src.utils.range_index import VolumeRangeIndex
+
+    volume_index = VolumeRangeIndex.from_cumulative(
+        arrays["dates"], arrays["cumulative_volume"], arrays["cumulative_count"]
+    )
+    indicator = f"rolling_mean_{params['mean_indicator']}_pct_ch"
+    means = np.column_stack(
+        [arrays[f"rolling_mean_{mean}"] for mean in params["columns_rolling_mean"]]
+    )
+    starts, ends = find_anomaly_intervals(
+        volume_index,
+        arrays[indicator],
+        means,
+        params["threshold_indicator"],
+        params["gap_end_date"],
+        params["step_to_end_date"],
+        params["laps"],
+        params["thresholds"],
+    )
+    anomaly = paint_intervals(np.zeros(len(means), dtype=bool), starts, ends, True)
+    first_rows = anomaly & ~np.concatenate([[False], anomaly[:-1]])
+    return {
+        "anomaly_intervals": int(np.count_nonzero(first_rows)),
+        "anomaly_rows": int(np.count_nonzero(anomaly)),
+    }
+
+
+def sweep_intermediates(
+    data: DataFrame, trend_points: list[dict], volume_points: list[dict], cache=None
+) -> tuple[dict[Text, np.ndarray], list[Text]]:
+    """
+    Compute work which does not depend on swept thresholds once for all points.
+
+    A signal line is built for every distinct set of MACD decays, sets of one column
+    in one pass over it, and a rolling mean for every distinct window. Both are
+    taken from the cache of derived columns when it is given. Rows are sorted by
+    date for the volume index like in `add_volume_anomaly`.
+
+    Args:
+        data {DataFrame}: Raw data.
+        trend_points {list[dict]}: Parameters of trend detection grid points.
+        volume_points {list[dict]}: Parameters of volume anomaly grid points.
+        cache {Optional[ColumnCache]}: Cache of derived columns.
+
+    Returns:
+        tuple: Arrays by name and name of signal line of each trend point.
+    """
+    from src.features.preprocessing_for_trend_detection import cached_macd
+    from src.features.preprocessing_for_volume_anomaly import rolling_means
+    from src.utils.range_index import VolumeRangeIndex, dates_to_int64
+
+    arrays = {}
+    signal_lines = {}
+    variants = {}
+    for params in trend_points:
+        key = tuple(params[name] for name in MACD_PARAMETERS)
+        if key not in signal_lines:
+            signal_lines[key] = f"signal_line_{len(signal_lines)}"
+            variants.setdefault((key[0], key[-1]), []).append(key)
+    for (column, dtype), keys in variants.items():
+        lines = cached_macd(data, column, [key[1:-1] for key in keys], dtype, cache)
+        for key, columns in zip(keys, lines):
+            arrays[signal_lines[key]] = columns["signal_line"].astype(np.float64)
+
+    order = np.argsort(dates_to_int64(data["date"]), kind="stable")
+    volume_index = VolumeRangeIndex(
+        data["date"].values[order], data["volume"].values[order]
+    )
+    arrays["dates"] = volume_index.dates
+    arrays["cumulative_volume"] = volume_index.cumulative_volume
+    arrays["cumulative_count"] = volume_index.cumulative_count
+    windows = [
+        window
+        for params in volume_points
+        for window in [*params["columns_rolling_mean"], params["mean_indicator"]]
+    ]
+    means = rolling_means(data["volume"], windows, cache)
+    for window, mean in means.items():
+        arrays[f"rolling_mean_{window}"] = mean[order]
+    for window in {params["mean_indicator"] for params in volume_points}:
+        indicator = Series(means[window]).pct_change().to_numpy()
+        arrays[f"rolling_mean_{window}_pct_ch"] = indicator[order]
+
+    names = [
+        signal_lines[tuple(params[name] for name in MACD_PARAMETERS)]
+        for params in trend_points
+    ]
+    return arrays, names
+
+
+def run_sweep(
+    config_path: Text,
+    grid_path: Text,
+    output_path: Text,
+    raw_path: Optional[Text] = None,
+    workers: Optional[int] = None,
+) -> DataFrame:
+    """
+    Evaluate grid of trend detection and volume anomaly parameters on one symbol.
+
+    Signal lines, rolling means and the volume index are computed once and shared
+    with workers through shared memory, extremes of all orders are found in one call
+    per signal line. Trend and volume anomaly parameters do not affect each other,
+    so every trend point and every volume point is evaluated once and the table
+    holds all their combinations.
+
+    Args:
+        config_path {Text}: path to config
+        grid_path {Text}: Path to yaml file with grid.
+        output_path {Text}: Path to csv table with counts of each configuration.
+        raw_path {Optional[Text]}: Raw data, `data.raw` from config if not set.
+        workers {Optional[int]}: Number of processes, `base.workers` if not set.
+
+    Returns:
+        DataFrame: Swept parameters with number of rows of each trend, trend
+            segments, anomaly intervals and anomaly rows.
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import read_frame
+    from src.utils.cache import open_cache
+    from src.utils.logger import get_logger
+    from src.utils.shared_arrays import SharedArrays
+
+    logger = get_logger("SWEEP", log_level=config["base"]["log_level"])
+    workers = workers or config["base"].get("workers", 1)
+
+    grid = load_grid(grid_path)
+    points = {
+        section: expand_grid(
+            {**DEFAULT_PARAMETERS.get(section, {}), **config["featurize"][section]},
+            grid.get(section, {}),
+        )
+        for section in SWEPT_PARAMETERS
+    }
+    trend_points = points["trend_detection"]
+    volume_points = points["volume_anomaly"]
+    logger.info(
+        f"Grid points: {len(trend_points)} for trend, {len(volume_points)} for "
+        f"volume, {len(trend_points) * len(volume_points)} configurations"
+    )
+
+    started = time.perf_counter()
+    columns = {"date", "volume"}
+    columns.update(params["column_for_macd"] for params in trend_points)
+    data = read_frame(raw_path or config["data"]["raw"], columns=sorted(columns))
+    logger.info("Compute shared intermediates")
+    arrays, signal_lines = sweep_intermediates(
+        data, trend_points, volume_points, open_cache(config)
+    )
+    del data
+
+    orders = {}
+    for signal_line, params in zip(signal_lines, trend_points):
+        orders.setdefault(signal_line, set()).update(
+            [params["order_for_fall_rise"], params["order_for_flat"]]
+        )
+    extremes_tasks = [(name, sorted(orders[name])) for name in sorted(orders)]
+    logger.info(f"Find extremes of {len(extremes_tasks)} signal lines")
+    with ExitStack() as stack:
+        executor, specs = None, None
+        if workers > 1:
+            specs = stack.enter_context(SharedArrays(arrays)).specs
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+        run = dict(arrays=arrays, executor=executor, specs=specs)
+        extremes = dict(
+            zip(sorted(orders), _run_all(_find_extremes, extremes_tasks, **run))
+        )
+        logger.info("Label trends and search volume anomalies")
+        trend_tasks = [
+            (
+                signal_line,
+                extremes[signal_line][params["order_for_fall_rise"]],
+                extremes[signal_line][params["order_for_flat"]],
+                params,
+            )
+            for signal_line, params in zip(signal_lines, trend_points)
+        ]
+        trend_summaries = _run_all(_summarize_trend, trend_tasks, **run)
+        volume_summaries = _run_all(
+            _summarize_volume, [(params,) for params in volume_points], **run
+        )
+
+    trend_table = DataFrame(
+        [
+            {
+                **{name: params[name] for name in grid.get("trend_detection", {})},
+                **summary,
+            }
+            for params, summary in zip(trend_points, trend_summaries)
+        ]
+    )
+    volume_table = DataFrame(
+        [
+            {
+                **{
+                    name: str(params[name]) if name in LIST_PARAMETERS else params[name]
+                    for name in grid.get("volume_anomaly", {})
+                },
+                **summary,
+            }
+            for params, summary in zip(volume_points, volume_summaries)
+        ]
+    )
+    summary = trend_table.merge(volume_table, how="cross")
+    logger.info(f"Writing {len(summary)} configurations to path: {output_path}")
+    summary.to_csv(output_path, index=False)
+    logger.info(f"Wall time {time.perf_counter() - started:.1f} s")
+    return summary
+
+
+if __name__ == "__main__":
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument("--config", dest="config", required=True)
+    args_parser.add_argument(
+        "--grid", dest="grid", required=True, help="yaml file with values to try"
+    )
+    args_parser.add_argument(
+        "--output", dest="output", required=True, help="csv table with results"
+    )
+    args_parser.add_argument(
+        "--input", dest="raw", help="raw data, data.raw from config by default"
+    )
+    args_parser.add_argument(
+        "--workers", type=int, help="number of processes, base.workers by default"
+    )
+    args = args_parser.parse_args()
+    run_sweep(
+        config_path=args.config,
+        grid_path=args.grid,
+        output_path=args.output,
+        raw_path=args.raw,
+        workers=args.workers,
+    )
@@ -0,0 +1,388 @@
+/*
+ * Compiled versions of the loops of `src/utils/kernels.py`.
+ *
+ * Every function gives the same output as its NumPy version, floating point
+ * operations are done in the same order, so the module is built without
+ * contraction of multiply and add (see `build.py`).
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION
+#include <numpy/arrayobject.h>
+
+#include <math.h>
+
+static PyArrayObject *as_array(PyObject *object, int type, int ndim)
+{
+    PyArrayObject *array = (PyArrayObject *)PyArray_FROMANY(
+        object, type, ndim, ndim, NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST);
+    return array;
+}
+
+static PyObject *first_detected_laps(PyObject *self, PyObject *args)
+{
+    PyObject *current_object, *means_object, *thresholds_object;
+    if (!PyArg_ParseTuple(args, "OOO", &current_object, &means_object,
+                          &thresholds_object))
+        return NULL;
+
+    PyArrayObject *current = as_array(current_object, NPY_FLOAT64, 2);
+    PyArrayObject *means = as_array(means_object, NPY_FLOAT64, 2);
+    PyArrayObject *thresholds = as_array(thresholds_object, NPY_FLOAT64, 1);
+    PyArrayObject *result = NULL;
+    if (current == NULL || means == NULL || thresholds == NULL)
+        goto done;
+
+    npy_intp candidates = PyArray_DIM(current, 0);
+    npy_intp laps = PyArray_DIM(current, 1);
+    npy_intp windows = PyArray_DIM(means, 1);
+    if (PyArray_DIM(means, 0) != candidates || PyArray_DIM(thresholds, 0) != laps) {
+        PyErr_SetString(PyExc_ValueError, "shapes of means and thresholds differ");
+        goto done;
+    }
+
+    result = (PyArrayObject *)PyArray_SimpleNew(1, &candidates, NPY_INT64);
+    if (result == NULL)
+        goto done;
+    const double *current_data = (const double *)PyArray_DATA(current);
+    const double *means_data = (const double *)PyArray_DATA(means);
+    const double *thresholds_data = (const double *)PyArray_DATA(thresholds);
+    npy_int64 *result_data = (npy_int64 *)PyArray_DATA(result);
+
+    Py_BEGIN_ALLOW_THREADS
+    for (npy_intp candidate = 0; candidate < candidates; candidate++) {
+        const double *previous = means_data + candidate * windows;
+        const double *row = current_data + candidate * laps;
+        npy_int64 found = -1;
+        for (npy_intp lap = 0; lap < laps && found < 0; lap++) {
+            double mean = row[lap];
+            int used = 0;
+            double largest = -INFINITY;
+            for (npy_intp window = 0; window < windows; window++) {
+                if (previous[window] == 0)
+                    continue;
+                double change = (mean - previous[window]) / mean;
+                if (!used && isnan(change))
+                    break;
+                used = 1;
+                if (change > largest)
+                    largest = change;
+            }
+            if (used && largest >= thresholds_data[lap])
+                found = lap;
+        }
+        result_data[candidate] = found;
+    }
+    Py_END_ALLOW_THREADS
+
+done:
+    Py_XDECREF(current);
+    Py_XDECREF(means);
+    Py_XDECREF(thresholds);
+    return (PyObject *)result;
+}
+
+static PyObject *trend_bounds(PyObject *self, PyObject *args)
+{
+    PyObject *min_object, *max_object;
+    if (!PyArg_ParseTuple(args, "OO", &min_object, &max_object))
+        return NULL;
+
+    PyArrayObject *minimums = as_array(min_object, NPY_INT64, 1);
+    PyArrayObject *maximums = as_array(max_object, NPY_INT64, 1);
+    PyArrayObject *starts = NULL, *ends = NULL, *rising = NULL;
+    PyObject *result = NULL;
+    if (minimums == NULL || maximums == NULL)
+        goto done;
+
+    npy_intp size_min = PyArray_DIM(minimums, 0);
+    npy_intp size_max = PyArray_DIM(maximums, 0);
+    npy_intp size = size_min + size_max;
+    starts = (PyArrayObject *)PyArray_SimpleNew(1, &size, NPY_INT64);
+    ends = (PyArrayObject *)PyArray_SimpleNew(1, &size, NPY_INT64);
+    rising = (PyArrayObject *)PyArray_SimpleNew(1, &size, NPY_BOOL);
+    if (starts == NULL || ends == NULL || rising == NULL)
+        goto done;
+
+    const npy_int64 *min_data = (const npy_int64 *)PyArray_DATA(minimums);
+    const npy_int64 *max_data = (const npy_int64 *)PyArray_DATA(maximums);
+    npy_int64 *starts_data = (npy_int64 *)PyArray_DATA(starts);
+    npy_int64 *ends_data = (npy_int64 *)PyArray_DATA(ends);
+    npy_bool *rising_data = (npy_bool *)PyArray_DATA(rising);
+    npy_intp i = 0, j = 0, count = 0;
+    npy_int64 previous = 0;
+    while (i < size_min || j < size_max) {
+        npy_int64 index;
+        npy_bool is_max;
+        if (j >= size_max || (i < size_min && min_data[i] < max_data[j])) {
+            index = min_data[i++];
+            is_max = 0;
+        } else {
+            if (i < size_min && min_data[i] == max_data[j])
+                i++;
+            index = max_data[j++];
+            is_max = 1;
+        }
+        starts_data[count] = previous;
+        ends_data[count] = index;
+        rising_data[count] = is_max;
+        previous = index;
+        count++;
+    }
+    PyArray_Dims shape = {&count, 1};
+    if (PyArray_Resize(starts, &shape, 0, NPY_CORDER) == NULL ||
+        PyArray_Resize(ends, &shape, 0, NPY_CORDER) == NULL ||
+        PyArray_Resize(rising, &shape, 0, NPY_CORDER) == NULL)
+        goto done;
+    result = PyTuple_Pack(3, starts, ends, rising);
+
+done:
+    Py_XDECREF(minimums);
+    Py_XDECREF(maximums);
+    Py_XDECREF(starts);
+    Py_XDECREF(ends);
+    Py_XDECREF(rising);
+    return result;
+}
+
+typedef struct {
+    npy_intp nobs;
+    npy_intp neg_ct;
+    double sum_x;
+    double compensation_add;
+    double compensation_remove;
+    npy_intp num_consecutive_same_value;
+    double prev_value;
+} RollingState;
+
+static void add_mean(RollingState *state, double value)
+{
+    if (isnan(value))
+        return;
+    state->nobs++;
+    double y = value - state->compensation_add;
+    double t = state->sum_x + y;
+    state->compensation_add = t - state->sum_x - y;
+    state->sum_x = t;
+    if (signbit(value))
+        state->neg_ct++;
+    if (value == state->prev_value)
+        state->num_consecutive_same_value++;
+    else
+        state->num_consecutive_same_value = 1;
+    state->prev_value = value;
+}
+
+static void remove_mean(RollingState *state, double value)
+{
+    if (isnan(value))
+        return;
+    state->nobs--;
+    double y = -value - state->compensation_remove;
+    double t = state->sum_x + y;
+    state->compensation_remove = t - state->sum_x - y;
+    state->sum_x = t;
+    if (signbit(value))
+        state->neg_ct--;
+}
+
+static double calc_mean(const RollingState *state, npy_intp window)
+{
+    if (state->nobs < window || state->nobs <= 0)
+        return NAN;
+    if (state->num_consecutive_same_value >= state->nobs)
+        return state->prev_value;
+    double result = state->sum_x / (double)state->nobs;
+    if (state->neg_ct == 0 && result < 0)
+        return 0;
+    if (state->neg_ct == state->nobs && result > 0)
+        return 0;
+    return result;
+}
+
+static PyObject *flat_bounds(PyObject *self, PyObject *args)
+{
+    PyObject *values_object, *indices_object;
+    Py_ssize_t window;
+    double left, right;
+    if (!PyArg_ParseTuple(args, "OOndd", &values_object, &indices_object, &window,
+                          &left, &right))
+        return NULL;
+    if (window < 1) {
+        PyErr_SetString(PyExc_ValueError, "window must be positive");
+        return NULL;
+    }
+
+    PyArrayObject *values = as_array(values_object, NPY_FLOAT64, 1);
+    PyArrayObject *indices = as_array(indices_object, NPY_INT64, 1);
+    PyArrayObject *starts = NULL, *ends = NULL, *changes = NULL;
+    PyObject *result = NULL;
+    if (values == NULL || indices == NULL)
+        goto done;
+
+    npy_intp size = PyArray_DIM(values, 0);
+    if (PyArray_DIM(indices, 0) != size) {
+        PyErr_SetString(PyExc_ValueError, "values and indices differ in length");
+        goto done;
+    }
+    starts = (PyArrayObject *)PyArray_SimpleNew(1, &size, NPY_INT64);
+    ends = (PyArrayObject *)PyArray_SimpleNew(1, &size, NPY_INT64);
+    changes = (PyArrayObject *)PyArray_SimpleNew(1, &size, NPY_FLOAT64);
+    if (starts == NULL || ends == NULL || changes == NULL)
+        goto done;
+
+    const double *values_data = (const double *)PyArray_DATA(values);
+    const npy_int64 *indices_data = (const npy_int64 *)PyArray_DATA(indices);
+    npy_int64 *starts_data = (npy_int64 *)PyArray_DATA(starts);
+    npy_int64 *ends_data = (npy_int64 *)PyArray_DATA(ends);
+    double *change = (double *)PyArray_DATA(changes);
+
+    /* pct_change of forward filled values, infinite changes are missing for
+       rolling functions of pandas */
+    double last = NAN;
+    for (npy_intp i = 0; i < size; i++) {
+        double previous = last;
+        if (!isnan(values_data[i]))
+            last = values_data[i];
+        change[i] = last / previous - 1;
+        if (isinf(change[i]))
+            change[i] = NAN;
+    }
+
+    /* rolling(window).mean() with the running sums of pandas */
+    RollingState state = {0, 0, 0.0, 0.0, 0.0, 0, NAN};
+    npy_intp count = 0;
+    for (npy_intp i = 0; i < size; i++) {
+        npy_intp start = i - window + 1 > 0 ? i - window + 1 : 0;
+        if (i == 0 || window == 1) {
+            RollingState empty = {0, 0, 0.0, 0.0, 0.0, 0, change[start]};
+            state = empty;
+            for (npy_intp j = start; j <= i; j++)
+                add_mean(&state, change[j]);
+        } else {
+            if (start > 0)
+                remove_mean(&state, change[start - 1]);
+            add_mean(&state, change[i]);
+        }
+        double mean = calc_mean(&state, window);
+        if (left < mean && mean < right) {
+            npy_intp first = i - window;
+            starts_data[count] = indices_data[first < 0 ? first + size : first];
+            ends_data[count] = indices_data[i];
+            count++;
+        }
+    }
+    PyArray_Dims shape = {&count, 1};
+    if (PyArray_Resize(starts, &shape, 0, NPY_CORDER) == NULL ||
+        PyArray_Resize(ends, &shape, 0, NPY_CORDER) == NULL)
+        goto done;
+    result = PyTuple_Pack(2, starts, ends);
+
+done:
+    Py_XDECREF(values);
+    Py_XDECREF(indices);
+    Py_XDECREF(starts);
+    Py_XDECREF(ends);
+    Py_XDECREF(changes);
+    return result;
+}
+
+static PyObject *ewm_means(PyObject *self, PyObject *args)
+{
+    PyObject *values_object, *spans_object, *min_periods_object;
+    if (!PyArg_ParseTuple(args, "OOO", &values_object, &spans_object,
+                          &min_periods_object))
+        return NULL;
+
+    PyArrayObject *values = as_array(values_object, NPY_FLOAT64, 1);
+    PyArrayObject *spans = as_array(spans_object, NPY_FLOAT64, 1);
+    PyArrayObject *min_periods = as_array(min_periods_object, NPY_INT64, 1);
+    PyArrayObject *result = NULL;
+    double *state = NULL;
+    if (values == NULL || spans == NULL || min_periods == NULL)
+        goto done;
+
+    npy_intp size = PyArray_DIM(values, 0);
+    npy_intp count = PyArray_DIM(spans, 0);
+    if (PyArray_DIM(min_periods, 0) != count) {
+        PyErr_SetString(PyExc_ValueError, "spans and min_periods differ in length");
+        goto done;
+    }
+    npy_intp shape[2] = {count, size};
+    result = (PyArrayObject *)PyArray_SimpleNew(2, shape, NPY_FLOAT64);
+    state = PyMem_Malloc((count * 3 + 1) * sizeof(double));
+    if (result == NULL || state == NULL) {
+        Py_CLEAR(result);
+        if (!PyErr_Occurred())
+            PyErr_NoMemory();
+        goto done;
+    }
+    const double *values_data = (const double *)PyArray_DATA(values);
+    const double *spans_data = (const double *)PyArray_DATA(spans);
+    const npy_int64 *min_periods_data = (const npy_int64 *)PyArray_DATA(min_periods);
+    double *result_data = (double *)PyArray_DATA(result);
+    double *alpha = state, *weighted = state + count, *old_wt = state + 2 * count;
+
+    Py_BEGIN_ALLOW_THREADS
+    /* ewm(adjust=False).mean() of pandas in its order of operations, means of all
+       spans are updated at every value */
+    for (npy_intp k = 0; k < count; k++)
+        alpha[k] = 1. / (1. + (spans_data[k] - 1) / 2.0);
+    npy_intp nobs = 0;
+    for (npy_intp i = 0; i < size; i++) {
+        double cur = values_data[i];
+        int is_observation = cur == cur;
+        nobs += is_observation;
+        for (npy_intp k = 0; k < count; k++) {
+            if (i == 0) {
+                weighted[k] = cur;
+                old_wt[k] = 1.;
+            } else if (weighted[k] == weighted[k]) {
+                old_wt[k] *= 1. - alpha[k];
+                if (is_observation) {
+                    /* mean is kept when it equals the value */
+                    if (weighted[k] != cur) {
+                        weighted[k] = old_wt[k] * weighted[k] + alpha[k] * cur;
+                        weighted[k] /= (old_wt[k] + alpha[k]);
+                    }
+                    old_wt[k] = 1.;
+                }
+            } else if (is_observation) {
+                weighted[k] = cur;
+            }
+            npy_int64 minp = min_periods_data[k] > 1 ? min_periods_data[k] : 1;
+            result_data[k * size + i] = nobs >= minp ? weighted[k] : NAN;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+done:
+    PyMem_Free(state);
+    Py_XDECREF(values);
+    Py_XDECREF(spans);
+    Py_XDECREF(min_periods);
+    return (PyObject *)result;
+}
+
+static PyMethodDef methods[] = {
+    {"first_detected_laps", first_detected_laps, METH_VARARGS,
+     "First lap at which each anomaly candidate is detected, -1 if none."},
+    {"trend_bounds", trend_bounds, METH_VARARGS,
+     "Rise and fall segments between sorted local extremes."},
+    {"flat_bounds", flat_bounds, METH_VARARGS,
+     "Flat segments from signal line at sorted extremes."},
+    {"ewm_means", ewm_means, METH_VARARGS,
+     "Exponentially weighted means of several spans in one pass."},
+    {NULL, NULL, 0, NULL},
+};
+
+static struct PyModuleDef module = {
+    PyModuleDef_HEAD_INIT, "_kernels", "Compiled hot loops of midas.", -1, methods,
+};
+
+PyMODINIT_FUNC PyInit__kernels(void)
+{
+    import_array();
+    return PyModule_Create(&module);
+}
@@ -0,0 +1,180 @@
+"""Provides memory-mapped, column-projected reading and writing of Feather files."""
+
+from typing import Iterable, Iterator, Optional, Sequence, Text, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+from pandas import DataFrame
+
+DEFAULT_COMPRESSION = "uncompressed"
+DEFAULT_BATCH_SIZE = None
+
+
+def read_table(path: Text, columns: Optional[Sequence[Text]] = None) -> pa.Table:
+    """
+    Open Feather file memory-mapped and read only requested columns.
+
+    Args:
+        path {Text}: Path to Feather file.
+        columns {Optional[Sequence[Text]]}: Columns to read, all if not set.
+
+    Returns:
+        pa.Table: Arrow table backed by the mapped file when it is uncompressed.
+    """
+    return feather.read_table(
+        path, columns=list(columns) if columns else None, memory_map=True
+    )
+
+
+def read_frame(path: Text, columns: Optional[Sequence[Text]] = None) -> DataFrame:
+    """
+    Read only requested columns of Feather file into DataFrame.
+
+    Args:
+        path {Text}: Path to Feather file.
+        columns {Optional[Sequence[Text]]}: Columns to read, all if not set.
+
+    Returns:
+        DataFrame: Data from file.
+    """
+    return read_table(path, columns).to_pandas(split_blocks=True, self_destruct=True)
+
+
+def column_to_numpy(column: Union[pa.Array, pa.ChunkedArray]) -> np.ndarray:
+    """
+    Convert Arrow column to NumPy without copy when it is possible.
+
+    Numeric and timestamp columns without nulls stored in one chunk are returned as
+    read-only views on Arrow memory, other columns are copied.
+
+    Args:
+        column {Union[pa.Array, pa.ChunkedArray]}: Column of table or record batch.
+
+    Returns:
+        np.ndarray: Values of column.
+    """
+    chunks = column.chunks if isinstance(column, pa.ChunkedArray) else [column]
+    if len(chunks) == 1 and column.null_count == 0:
+        try:
+            return chunks[0].to_numpy(zero_copy_only=True)
+        except pa.ArrowInvalid:
+            pass
+    if isinstance(column, pa.ChunkedArray):
+        return column.to_numpy()
+    return column.to_numpy(zero_copy_only=False)
+
+
+def read_arrays(path: Text, columns: Sequence[Text]) -> dict[Text, np.ndarray]:
+    """
+    Read requested columns of Feather file as NumPy arrays.
+
+    Args:
+        path {Text}: Path to Feather file.
+        columns {Sequence[Text]}: Columns to read.
+
+    Returns:
+        dict[Text, np.ndarray]: Arrays by column name, views on the mapped file
+            where dtype allows and the file is uncompressed.
+    """
+    table = read_table(path, columns)
+    return {name: column_to_numpy(table.column(name)) for name in columns}
+
+
+def iter_batches(
+    path: Text,
+    batch_size: int,
+    columns: Optional[Sequence[Text]] = None,
+    start: int = 0,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Iterate over rows of Feather file by record batches.
+
+    Record batches of file are read one at a time and split into slices of
+    `batch_size` rows. Batches of uncompressed file are views on the mapped file, so
+    only pages of the current batch have to be in memory.
+
+    Args:
+        path {Text}: Path to Feather file.
+        batch_size {int}: Maximum number of rows in batch.
+        columns {Optional[Sequence[Text]]}: Columns to read, all if not set.
+        start {int}: First row, record batches before it are not read.
+
+    Yields:
+        pa.RecordBatch: Next rows of file.
+    """
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    row = 0
+    for number in range(reader.num_record_batches):
+        batch = reader.get_batch(number)
+        row += batch.num_rows
+        if row <= start:
+            continue
+        batch = batch.slice(max(start - row + batch.num_rows, 0))
+        if columns:
+            batch = batch.select(list(columns))
+        for offset in range(0, batch.num_rows, batch_size):
+            yield batch.slice(offset, batch_size)
+
+
+def write_batches(
+    batches: Iterable[pa.RecordBatch],
+    path: Text,
+    schema: pa.Schema,
+    compression: Text = DEFAULT_COMPRESSION,
+):
+    """
+    Write record batches one by one to Feather (Arrow IPC) file.
+
+    Args:
+        batches {Iterable[pa.RecordBatch]}: Batches with the same schema.
+        path {Text}: Path to Feather file.
+        schema {pa.Schema}: Schema of batches.
+        compression {Text}: "uncompressed", "lz4" or "zstd".
+    """
+    options = pa.ipc.IpcWriteOptions(
+        compression=None if compression == "uncompressed" else compression
+    )
+    with pa.ipc.new_file(path, schema, options=options) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def write_frame(
+    data: DataFrame,
+    path: Text,
+    compression: Text = DEFAULT_COMPRESSION,
+    batch_size: Optional[int] = DEFAULT_BATCH_SIZE,
+):
+    """
+    Write DataFrame to Feather (Arrow IPC) file.
+
+    Columns of uncompressed file written as one record batch can be read back as
+    NumPy views on the mapped file, LZ4 files are smaller.
+
+    Args:
+        data {DataFrame}: Data to write.
+        path {Text}: Path to Feather file.
+        compression {Text}: "uncompressed", "lz4" or "zstd".
+        batch_size {Optional[int]}: Number of rows in record batch, one batch if not set.
+    """
+    feather.write_feather(
+        data, path, compression=compression, chunksize=batch_size or max(len(data), 1)
+    )
+
+
+def write_frame_with_config(data: DataFrame, path: Text, config):
+    """
+    Write DataFrame with compression and batch size from `base` section of config.
+
+    Args:
+        data {DataFrame}: Data to write.
+        path {Text}: Path to Feather file.
+        config {EnvYAML}: Yaml file with configurations.
+    """
+    write_frame(
+        data,
+        path,
+        compression=config["base"].get("io_compression", DEFAULT_COMPRESSION),
+        batch_size=config["base"].get("io_batch_size", DEFAULT_BATCH_SIZE),
+    )
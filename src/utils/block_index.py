@@ -0,0 +1,270 @@
+"""Provides sparse persistent index of dates over blocks of Feather files."""
+
+import json
+import os
+from typing import Optional, Sequence, Text
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from src.utils.arrow_io import column_to_numpy
+from src.utils.exceptions import UnsortedDates
+from src.utils.range_index import dates_to_int64
+
+INDEX_SUFFIX = ".index.feather"
+DEFAULT_BLOCK_SIZE = 65536
+INDEX_COLUMNS = ["batch", "offset", "row", "first", "last"]
+
+
+def index_path(path: Text) -> Text:
+    """
+    Path to index saved next to the file.
+
+    Args:
+        path {Text}: Path to Feather file.
+
+    Returns:
+        Text: `<file without extension>.index.feather`.
+    """
+    return f"{os.path.splitext(path)[0]}{INDEX_SUFFIX}"
+
+
+def file_version(path: Text) -> dict:
+    """
+    Size and modification time of file, index of another version is rebuilt.
+
+    Args:
+        path {Text}: Path to file.
+
+    Returns:
+        dict: `size` and `mtime_ns`.
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class BlockIndex:
+    """
+    First and last date of every block of rows of a Feather file sorted by date.
+
+    Blocks are slices of record batches of at most `block_size` rows, so a range of
+    dates is found with binary search over block bounds and one binary search inside
+    the first and the last block, only record batches with rows of the range are
+    read. Rows of uncompressed files are views on the mapped file.
+    """
+
+    def __init__(self, path: Text, blocks: dict[Text, np.ndarray], rows: int):
+        """
+        Open file with already built blocks.
+
+        Args:
+            path {Text}: Path to Feather file.
+            blocks {dict[Text, np.ndarray]}: Columns of `INDEX_COLUMNS`.
+            rows {int}: Number of rows of file.
+        """
+        self.path = path
+        self.blocks = blocks
+        self.rows = rows
+        self.reader = pa.ipc.open_file(pa.memory_map(path))
+        self.schema = self.reader.schema
+        starts = blocks["offset"] == 0
+        self._batches = blocks["batch"][starts]
+        self._batch_rows = np.r_[blocks["row"][starts], rows].astype(np.int64)
+
+    @classmethod
+    def build(cls, path: Text, block_size: int = DEFAULT_BLOCK_SIZE) -> "BlockIndex":
+        """
+        Build index by reading dates of file batch by batch.
+
+        Args:
+            path {Text}: Path to Feather file with `date` column.
+            block_size {int}: Maximum number of rows in block.
+
+        Returns:
+            BlockIndex: Index of file.
+        """
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        parts, row, previous = [], 0, None
+        for number in range(reader.num_record_batches):
+            dates = dates_to_int64(
+                column_to_numpy(reader.get_batch(number).column("date"))
+            )
+            if len(dates) == 0:
+                continue
+            if np.any(dates[1:] < dates[:-1]) or (
+                previous is not None and dates[0] < previous
+            ):
+                raise UnsortedDates
+            offsets = np.arange(0, len(dates), block_size)
+            ends = np.minimum(offsets + block_size, len(dates)) - 1
+            parts.append(
+                {
+                    "batch": np.full(len(offsets), number),
+                    "offset": offsets,
+                    "row": offsets + row,
+                    "first": dates[offsets],
+                    "last": dates[ends],
+                }
+            )
+            row, previous = row + len(dates), dates[-1]
+        blocks = {
+            column: np.concatenate(
+                [part[column] for part in parts] or [np.empty(0)]
+            ).astype(np.int64)
+            for column in INDEX_COLUMNS
+        }
+        return cls(path, blocks, row)
+
+    def save(self):
+        """Write index next to the file with version of file in metadata."""
+        from src.utils.arrow_io import write_batches
+
+        table = pa.table(self.blocks)
+        metadata = {"rows": self.rows, **file_version(self.path)}
+        table = table.replace_schema_metadata({"version": json.dumps(metadata)})
+        write_batches(table.to_batches(), index_path(self.path), table.schema)
+
+    @classmethod
+    def load(cls, path: Text) -> Optional["BlockIndex"]:
+        """
+        Read index saved next to the file.
+
+        Args:
+            path {Text}: Path to Feather file.
+
+        Returns:
+            Optional[BlockIndex]: Index or None if it is missing or was built for
+                another version of the file.
+        """
+        from src.utils.arrow_io import read_table
+
+        try:
+            table = read_table(index_path(path))
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        metadata = json.loads((table.schema.metadata or {}).get(b"version", b"{}"))
+        if {key: metadata.get(key) for key in ("size", "mtime_ns")} != file_version(
+            path
+        ):
+            return None
+        blocks = {column: table.column(column).to_numpy() for column in INDEX_COLUMNS}
+        return cls(path, blocks, metadata["rows"])
+
+    @classmethod
+    def open(cls, path: Text, block_size: int = DEFAULT_BLOCK_SIZE) -> "BlockIndex":
+        """
+        Read saved index, build and save it if it is missing or stale.
+
+        Args:
+            path {Text}: Path to Feather file.
+            block_size {int}: Maximum number of rows in block of a new index.
+
+        Returns:
+            BlockIndex: Index of file.
+        """
+        index = cls.load(path)
+        if index is None:
+            index = cls.build(path, block_size)
+            index.save()
+        return index
+
+    def _block_dates(self, block: int) -> np.ndarray:
+        """
+        Dates of block.
+
+        Args:
+            block {int}: Number of block.
+
+        Returns:
+            np.ndarray: Dates as int64.
+        """
+        offset = self.blocks["offset"][block]
+        end = (
+            self.blocks["offset"][block + 1]
+            if block + 1 < len(self.blocks["offset"])
+            and self.blocks["batch"][block + 1] == self.blocks["batch"][block]
+            else None
+        )
+        column = self.reader.get_batch(int(self.blocks["batch"][block])).column("date")
+        column = column.slice(offset, None if end is None else end - offset)
+        return dates_to_int64(column_to_numpy(column))
+
+    def find_rows(self, start=None, end=None) -> tuple[int, int]:
+        """
+        Rows with dates between `start` and `end`, both inclusive.
+
+        Args:
+            start: First date, from the first row if not set.
+            end: Last date, to the last row if not set.
+
+        Returns:
+            tuple[int, int]: First row and row after the last one.
+        """
+        first, last = self.blocks["first"], self.blocks["last"]
+        begin, stop = 0, self.rows
+        if start is not None:
+            start = dates_to_int64(pd.Timestamp(start))
+            block = int(np.searchsorted(last, start, side="left"))
+            begin = self.rows
+            if block < len(last):
+                dates = self._block_dates(block)
+                begin = int(self.blocks["row"][block]) + int(
+                    np.searchsorted(dates, start, side="left")
+                )
+        if end is not None:
+            end = dates_to_int64(pd.Timestamp(end))
+            block = int(np.searchsorted(first, end, side="right")) - 1
+            stop = 0
+            if block >= 0:
+                dates = self._block_dates(block)
+                stop = int(self.blocks["row"][block]) + int(
+                    np.searchsorted(dates, end, side="right")
+                )
+        return begin, max(begin, stop)
+
+    def read_rows(
+        self, begin: int, stop: int, columns: Optional[Sequence[Text]] = None
+    ) -> pa.Table:
+        """
+        Read rows of file, only record batches which contain them are read.
+
+        Args:
+            begin {int}: First row.
+            stop {int}: Row after the last one.
+            columns {Optional[Sequence[Text]]}: Columns to read, all if not set.
+
+        Returns:
+            pa.Table: Rows of file.
+        """
+        schema = self.schema
+        if columns:
+            schema = pa.schema([schema.field(column) for column in columns])
+        batches = []
+        first = int(np.searchsorted(self._batch_rows, begin, side="right")) - 1
+        for number in range(max(first, 0), len(self._batches)):
+            low, high = self._batch_rows[number], self._batch_rows[number + 1]
+            if low >= stop:
+                break
+            batch = self.reader.get_batch(int(self._batches[number]))
+            if columns:
+                batch = batch.select(list(columns))
+            offset = max(begin - low, 0)
+            batches.append(batch.slice(offset, min(stop, high) - low - offset))
+        return pa.Table.from_batches(batches, schema=schema)
+
+    def dates_at(self, rows: Sequence[int]) -> np.ndarray:
+        """
+        Dates of rows.
+
+        Args:
+            rows {Sequence[int]}: Numbers of rows.
+
+        Returns:
+            np.ndarray: Dates as datetime64[ns].
+        """
+        dates = np.empty(len(rows), dtype=np.int64)
+        for number, row in enumerate(rows):
+            block = int(np.searchsorted(self.blocks["row"], row, side="right")) - 1
+            dates[number] = self._block_dates(block)[row - self.blocks["row"][block]]
+        return dates.view("datetime64[ns]")
@@ -0,0 +1,264 @@
+"""Provides content-addressed on-disk cache of derived columns."""
+
+import hashlib
+import inspect
+import json
+import os
+from typing import Callable, Optional, Sequence, Text, Union
+
+import numpy as np
+import pyarrow as pa
+
+from src.utils.arrow_io import read_arrays, write_batches
+
+CACHE_SUFFIX = ".arrow"
+DEFAULT_CACHE_SIZE = 2**30
+
+
+def hash_array(values: np.ndarray) -> Text:
+    """
+    Hash of array content, dtype and shape.
+
+    Args:
+        values {np.ndarray}: Array to hash.
+
+    Returns:
+        Text: Hex digest.
+    """
+    values = np.ascontiguousarray(values)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{values.dtype.str}{values.shape}".encode())
+    digest.update(memoryview(values).cast("B"))
+    return digest.hexdigest()
+
+
+def code_version(function: Union[Callable, Text, Sequence]) -> Text:
+    """
+    Hash of source code of function or module which computes cached columns.
+
+    Args:
+        function {Union[Callable, Text, Sequence]}: Function, module, path to
+            another source file (like C source of an extension) or sequence of them.
+
+    Returns:
+        Text: Hex digest, changes with any edit of the function.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for code in function if isinstance(function, (list, tuple)) else [function]:
+        if isinstance(code, str):
+            with open(code, "rb") as file:
+                digest.update(file.read())
+        else:
+            digest.update(inspect.getsource(code).encode())
+    return digest.hexdigest()
+
+
+class ColumnCache:
+    """
+    Directory of derived columns, one Arrow file per column.
+
+    File name is a hash of the input data, the name and parameters of the column
+    and the code version, so changed input, parameters or code never hit a stale
+    entry. Files are used as LRU: reading a file updates its modification time and
+    the oldest files are removed when the total size exceeds the limit.
+    """
+
+    def __init__(self, directory: Text, max_size: int = DEFAULT_CACHE_SIZE):
+        """
+        Open cache, directory is created if needed.
+
+        Args:
+            directory {Text}: Directory with cached columns.
+            max_size {int}: Limit of total size of files in bytes.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, data_hash: Text, name: Text, params: dict, version: Text) -> Text:
+        """
+        Key of column.
+
+        Args:
+            data_hash {Text}: Hash of input data.
+            name {Text}: Name of column.
+            params {dict}: Parameters which define the column.
+            version {Text}: Version of code which computes the column.
+
+        Returns:
+            Text: Hex digest.
+        """
+        description = json.dumps([data_hash, name, params, version], sort_keys=True)
+        return hashlib.blake2b(description.encode(), digest_size=20).hexdigest()
+
+    def path(self, key: Text) -> Text:
+        """
+        Path to file of column.
+
+        Args:
+            key {Text}: Key of column.
+
+        Returns:
+            Text: Path in cache directory.
+        """
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(self, key: Text) -> Optional[np.ndarray]:
+        """
+        Read column and mark it as recently used.
+
+        Args:
+            key {Text}: Key of column.
+
+        Returns:
+            Optional[np.ndarray]: Values of column or None if it is not cached.
+        """
+        path = self.path(key)
+        try:
+            values = np.array(read_arrays(path, ["values"])["values"])
+            os.utime(path)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return values
+
+    def store(self, key: Text, values: np.ndarray):
+        """
+        Write column and evict least recently used columns over the size limit.
+
+        File is written under a temporary name and renamed, so concurrent runs never
+        read a partial file.
+
+        Args:
+            key {Text}: Key of column.
+            values {np.ndarray}: Values of column.
+        """
+        path = self.path(key)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        table = pa.table({"values": values})
+        write_batches(table.to_batches(), temporary, table.schema)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used columns until total size fits the limit."""
+        entries = []
+        with os.scandir(self.directory) as files:
+            for entry in files:
+                if entry.name.endswith(CACHE_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def open_cache(config) -> Optional[ColumnCache]:
+    """
+    Open cache from `base` section of config.
+
+    Args:
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        Optional[ColumnCache]: Cache or None if `cache_dir` is not set.
+    """
+    directory = config["base"].get("cache_dir")
+    if not directory:
+        return None
+    return ColumnCache(directory, config["base"].get("cache_size", DEFAULT_CACHE_SIZE))
+
+
+def load_columns(
+    cache: ColumnCache,
+    data_hash: Text,
+    function: Union[Callable, Text, Sequence],
+    params: dict,
+    names: Sequence[Text],
+) -> Optional[dict[Text, np.ndarray]]:
+    """
+    Read derived columns from cache.
+
+    Args:
+        cache {ColumnCache}: Cache.
+        data_hash {Text}: Hash of input data.
+        function {Union[Callable, Text, Sequence]}: Code whose source is the code
+            version, see `code_version`.
+        params {dict}: Parameters which define the columns.
+        names {Sequence[Text]}: Names of columns.
+
+    Returns:
+        Optional[dict[Text, np.ndarray]]: Columns by name or None if any of them is
+            not cached.
+    """
+    version = code_version(function)
+    columns = {}
+    for name in names:
+        columns[name] = cache.load(cache.key(data_hash, name, params, version))
+        if columns[name] is None:
+            return None
+    return columns
+
+
+def store_columns(
+    cache: ColumnCache,
+    data_hash: Text,
+    function: Union[Callable, Text, Sequence],
+    params: dict,
+    columns: dict[Text, np.ndarray],
+):
+    """
+    Write derived columns to cache.
+
+    Args:
+        cache {ColumnCache}: Cache.
+        data_hash {Text}: Hash of input data.
+        function {Union[Callable, Text, Sequence]}: Code whose source is the code
+            version, see `code_version`.
+        params {dict}: Parameters which define the columns.
+        columns {dict[Text, np.ndarray]}: Columns by name.
+    """
+    version = code_version(function)
+    for name, values in columns.items():
+        cache.store(cache.key(data_hash, name, params, version), np.asarray(values))
+
+
+def cached_columns(
+    cache: Optional[ColumnCache],
+    data_hash: Text,
+    function: Union[Callable, Text, Sequence],
+    params: dict,
+    names: Sequence[Text],
+    compute: Callable[[], dict[Text, np.ndarray]],
+) -> dict[Text, np.ndarray]:
+    """
+    Read derived columns from cache or compute and cache them.
+
+    Args:
+        cache {Optional[ColumnCache]}: Cache, columns are always computed if None.
+        data_hash {Text}: Hash of input data.
+        function {Union[Callable, Text, Sequence]}: Code whose source is the code
+            version, see `code_version`.
+        params {dict}: Parameters which define the columns.
+        names {Sequence[Text]}: Names of columns.
+        compute {Callable}: Computes all columns by name.
+
+    Returns:
+        dict[Text, np.ndarray]: Columns by name.
+    """
+    if cache is None:
+        return compute()
+
+    columns = load_columns(cache, data_hash, function, params, names)
+    if columns is None:
+        columns = compute()
+        store_columns(cache, data_hash, function, params, columns)
+    return columns
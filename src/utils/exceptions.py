@@ -4,3 +4,16 @@
 class NoAvailableData(Exception):
     def __str__(self):
         return "No mean values were passed for comparison"
+
+
+class UnsortedDates(Exception):
+    def __str__(self):
+        return "Dates must be sorted in increasing order"
+
+
+class UnknownSweepParameter(Exception):
+    def __init__(self, name: str):
+        self.name = name
+
+    def __str__(self):
+        return f"Parameter {self.name} can not be swept"
@@ -0,0 +1,96 @@
+"""Provides linear-time search of strict local extremes for several orders."""
+
+from typing import Sequence
+
+import numpy as np
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+
+
+def _trailing_filter(values: np.ndarray, size: int, function) -> np.ndarray:
+    """
+    Sliding extreme over `size` values ending at each position.
+
+    `maximum_filter1d` and `minimum_filter1d` keep a monotonic wedge of candidates,
+    so the cost does not depend on `size`.
+
+    Args:
+        values {np.ndarray}: Values without NaN.
+        size {int}: Window size.
+        function {Callable}: `maximum_filter1d` or `minimum_filter1d`.
+
+    Returns:
+        np.ndarray: Extreme of `values[i - size + 1 : i + 1]` at position i.
+    """
+    return function(values, size, mode="nearest", origin=(size - 1) // 2)
+
+
+def find_extremes(
+    values: np.ndarray, orders: Sequence[int]
+) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+    """
+    Find local extremes of several orders in O(N) per order.
+
+    Gives the same indices as `argrelextrema` with `np.less` and `np.greater`: a
+    point is an extremum when it is strictly smaller (larger) than every neighbour
+    within `order` points, neighbours beyond the edges are replaced by the edge
+    value, so the first and the last points and points on plateaus are never
+    extremes. A point with NaN among itself or its neighbours is not an extremum.
+    Padding and the count of NaN are shared by all orders.
+
+    Args:
+        values {np.ndarray}: Series.
+        orders {Sequence[int]}: Numbers of points for comparison.
+
+    Returns:
+        dict[int, tuple[np.ndarray, np.ndarray]]: Indices of local min and max
+            extremes by order.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    length = len(values)
+    if length == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return {order: (empty, empty) for order in orders}
+
+    pad = max(orders)
+    padded = np.pad(values, pad, mode="edge")
+    missing = np.isnan(padded)
+    missing_before = np.concatenate([[0], np.cumsum(missing)])
+    for_max = np.where(missing, -np.inf, padded)
+    for_min = np.where(missing, np.inf, padded)
+
+    centers = np.arange(pad, pad + length)
+    extremes = {}
+    for order in orders:
+        if order in extremes:
+            continue
+        complete = (
+            missing_before[centers + order + 1] - missing_before[centers - order] == 0
+        )
+        largest = _trailing_filter(for_max, order, maximum_filter1d)
+        smallest = _trailing_filter(for_min, order, minimum_filter1d)
+        is_max = (
+            complete
+            & (values > largest[centers - 1])
+            & (values > largest[centers + order])
+        )
+        is_min = (
+            complete
+            & (values < smallest[centers - 1])
+            & (values < smallest[centers + order])
+        )
+        extremes[order] = (np.flatnonzero(is_min), np.flatnonzero(is_max))
+    return extremes
+
+
+def relative_extremes(values: np.ndarray, order: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find local extremes of one order, see `find_extremes`.
+
+    Args:
+        values {np.ndarray}: Series.
+        order {int}: Number of points for comparison.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Indices of local min and max extremes.
+    """
+    return find_extremes(values, [order])[order]
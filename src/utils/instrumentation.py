@@ -0,0 +1,316 @@
+"""Provides timing spans with CPU time, peak memory and rows and their export."""
+
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import sys
+import time
+from typing import Callable, Optional, Text
+
+METRICS_JSONL_ENV = "MIDAS_METRICS_JSONL"
+METRICS_TEXTFILE_ENV = "MIDAS_METRICS_TEXTFILE"
+METRIC_PREFIX = "midas_span"
+METRICS = {
+    "wall_seconds": "Wall time spent in span during the last run.",
+    "cpu_seconds": "CPU time of process spent in span during the last run.",
+    "rows": "Rows processed in span during the last run.",
+    "calls": "Number of times span was entered during the last run.",
+    "peak_rss_delta_bytes": "Largest growth of peak resident memory in span.",
+}
+SAMPLE = re.compile(r"^(\w+)\{(.*)\} (\S+)$")
+
+_active_span = contextvars.ContextVar("active_span", default=None)
+_process_span = None
+_excepthook = None
+_totals = {}
+
+
+def peak_rss() -> int:
+    """
+    Peak resident memory of process.
+
+    Returns:
+        int: Bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Span:
+    """
+    Timed step of a run.
+
+    Records wall and CPU time, growth of peak resident memory and number of rows.
+    Spans opened inside another span are its children, their names are joined
+    with "/" and they log with the logger of the parent.
+    """
+
+    def __init__(
+        self,
+        name: Text,
+        rows: Optional[int] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        """
+        Create span, it starts when entered.
+
+        Args:
+            name {Text}: Name of step.
+            rows {Optional[int]}: Number of processed rows if known in advance.
+            logger {Optional[logging.Logger]}: Logger of span, the one of parent
+                span if not set.
+        """
+        self.name = name
+        self.rows = rows
+        self.logger = logger
+        self.path = name
+        self.parent = None
+        self._token = None
+
+    def add_rows(self, rows: int):
+        """
+        Count processed rows.
+
+        Args:
+            rows {int}: Number of rows.
+        """
+        self.rows = (self.rows or 0) + int(rows)
+
+    def start(self) -> "Span":
+        """
+        Start span and make it active.
+
+        Returns:
+            Span: Started span.
+        """
+        self.parent = _active_span.get()
+        if self.parent is not None:
+            self.path = f"{self.parent.path}/{self.name}"
+            self.logger = self.logger or self.parent.logger
+        self._token = _active_span.set(self)
+        self._peak = peak_rss()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def finish(self, status: Text = "ok") -> dict:
+        """
+        Stop span, log it and write it to configured sinks.
+
+        Args:
+            status {Text}: "ok" or "error".
+
+        Returns:
+            dict: Record of span.
+        """
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        peak = peak_rss()
+        if self._token is not None:
+            try:
+                _active_span.reset(self._token)
+            except ValueError:
+                _active_span.set(self.parent)
+            self._token = None
+        record = {
+            "timestamp": round(time.time(), 3),
+            "pid": os.getpid(),
+            "stage": self.path.split("/")[0],
+            "span": self.path,
+            "status": status,
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(cpu, 6),
+            "peak_rss_bytes": peak,
+            "peak_rss_delta_bytes": peak - self._peak,
+            "rows": self.rows,
+        }
+        if self.logger is not None:
+            rows = "" if self.rows is None else f", {self.rows} rows"
+            self.logger.info(
+                f"Span {self.path}: {wall:.3f} s wall, {cpu:.3f} s CPU, "
+                f"+{record['peak_rss_delta_bytes'] / 2**20:.1f} MB peak RSS{rows}"
+            )
+        export_span(record)
+        return record
+
+    def __enter__(self) -> "Span":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        self.finish("ok" if exc_type is None else "error")
+        return False
+
+
+def span(
+    name: Text, rows: Optional[int] = None, logger: Optional[logging.Logger] = None
+) -> Span:
+    """
+    Span to be used as context manager.
+
+    Args:
+        name {Text}: Name of step.
+        rows {Optional[int]}: Number of processed rows if known in advance.
+        logger {Optional[logging.Logger]}: Logger of span.
+
+    Returns:
+        Span: Not started span.
+    """
+    return Span(name, rows, logger)
+
+
+def instrumented(name: Optional[Text] = None) -> Callable:
+    """
+    Decorator which runs function inside a span.
+
+    Args:
+        name {Optional[Text]}: Name of span, name of function if not set.
+
+    Returns:
+        Callable: Decorator.
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(name or function.__name__):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def start_process_span(logger: logging.Logger):
+    """
+    Open a span over the whole run of process, it is closed at exit.
+
+    Called by `get_logger`, so every entry point has its total time and memory
+    recorded and spans of its steps become children of it. The exit handler and
+    the exception hook are installed once, forked processes inherit them.
+
+    Args:
+        logger {logging.Logger}: The first logger of process, its name is the name
+            of span.
+    """
+    global _process_span, _excepthook
+    if _process_span is not None and _process_span.pid == os.getpid():
+        return
+    _process_span = Span(logger.name, logger=logger).start()
+    _process_span.pid = os.getpid()
+    _process_span.status = "ok"
+    if _excepthook is None:
+        _excepthook = sys.excepthook
+        sys.excepthook = _mark_error
+        atexit.register(_finish_process_span)
+
+
+def _mark_error(*args):
+    """Mark the span of process as failed and call the previous exception hook."""
+    if _process_span is not None and _process_span.pid == os.getpid():
+        _process_span.status = "error"
+    _excepthook(*args)
+
+
+def _finish_process_span():
+    """Close the span of process if it was opened in this process."""
+    if _process_span is not None and _process_span.pid == os.getpid():
+        _process_span.finish(_process_span.status)
+
+
+def export_span(record: dict):
+    """
+    Write span to JSON lines file and Prometheus textfile from environment.
+
+    `MIDAS_METRICS_JSONL` is a file to which every span is appended as one line,
+    `MIDAS_METRICS_TEXTFILE` a file for the textfile collector of node exporter
+    with totals of spans of the last run of every stage. The textfile is read,
+    updated and replaced, so only the main process writes it: spans of worker
+    processes of pools are exported to JSON lines only.
+
+    Args:
+        record {dict}: Record of span.
+    """
+    path = os.environ.get(METRICS_JSONL_ENV)
+    if path:
+        with open(path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+    path = os.environ.get(METRICS_TEXTFILE_ENV)
+    if path and multiprocessing.parent_process() is None:
+        labels = (record["stage"], record["span"])
+        totals = _totals.setdefault(labels, dict.fromkeys(METRICS, 0))
+        totals["wall_seconds"] += record["wall_seconds"]
+        totals["cpu_seconds"] += record["cpu_seconds"]
+        totals["rows"] += record["rows"] or 0
+        totals["calls"] += 1
+        totals["peak_rss_delta_bytes"] = max(
+            totals["peak_rss_delta_bytes"], record["peak_rss_delta_bytes"]
+        )
+        write_textfile(path, _totals)
+
+
+def _format_labels(stage: Text, name: Text) -> Text:
+    """
+    Labels of sample in Prometheus text format.
+
+    Args:
+        stage {Text}: Name of stage.
+        name {Text}: Name of span.
+
+    Returns:
+        Text: Labels without braces.
+    """
+
+    def escape(value: Text) -> Text:
+        return value.replace("\\", "\\\\").replace('"', '\\"')
+
+    return f'stage="{escape(stage)}",span="{escape(name)}"'
+
+
+def write_textfile(path: Text, totals: dict[tuple[Text, Text], dict]):
+    """
+    Write totals of spans in Prometheus text format.
+
+    Samples of other stages already in the file are kept, samples of stages run by
+    this process are replaced. File is written under a temporary name and renamed,
+    so the collector never reads a partial file.
+
+    Args:
+        path {Text}: Path to textfile.
+        totals {dict}: Totals by (stage, span).
+    """
+    stages = {stage for stage, _ in totals}
+    samples = {metric: [] for metric in METRICS}
+    try:
+        with open(path) as file:
+            for line in file:
+                match = SAMPLE.match(line.strip())
+                if not match:
+                    continue
+                metric = match.group(1)[len(METRIC_PREFIX) + 1 :]
+                stage = re.search(r'stage="((?:[^"\\]|\\.)*)"', match.group(2))
+                if metric in samples and stage and stage.group(1) not in stages:
+                    samples[metric].append(line.strip())
+    except FileNotFoundError:
+        pass
+
+    for (stage, name), values in sorted(totals.items()):
+        for metric, value in values.items():
+            samples[metric].append(
+                f"{METRIC_PREFIX}_{metric}{{{_format_labels(stage, name)}}} {value}"
+            )
+
+    lines = []
+    for metric, description in METRICS.items():
+        lines.append(f"# HELP {METRIC_PREFIX}_{metric} {description}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{metric} gauge")
+        lines.extend(samples[metric])
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(temporary, path)
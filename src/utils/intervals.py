@@ -0,0 +1,96 @@
+"""Provides functions to label rows covered by intervals."""
+
+from typing import Any, Optional, Sequence
+
+import numpy as np
+
+
+def _clip_intervals(
+    length: int, starts: np.ndarray, ends: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Clip closed intervals to rows of column and drop empty ones.
+
+    Args:
+        length {int}: Number of rows.
+        starts {np.ndarray}: First rows of intervals.
+        ends {np.ndarray}: Last rows of intervals (inclusive).
+
+    Returns:
+        tuple[np.ndarray]: Clipped starts, ends and mask of kept intervals.
+    """
+    starts = np.clip(np.asarray(starts, dtype=np.int64), 0, None)
+    ends = np.clip(np.asarray(ends, dtype=np.int64), None, length - 1)
+    kept = starts <= ends
+    return starts[kept], ends[kept], kept
+
+
+def cover_intervals(length: int, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Find rows covered by at least one of closed intervals using difference array.
+
+    Args:
+        length {int}: Number of rows.
+        starts {np.ndarray}: First rows of intervals.
+        ends {np.ndarray}: Last rows of intervals (inclusive).
+
+    Returns:
+        np.ndarray: Boolean mask of covered rows.
+    """
+    starts, ends, _ = _clip_intervals(length, starts, ends)
+    difference = np.bincount(starts, minlength=length + 1) - np.bincount(
+        ends + 1, minlength=length + 1
+    )
+    return np.cumsum(difference[:length]) > 0
+
+
+def paint_intervals(
+    column: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    labels: Any,
+    precedence: Optional[Sequence[Any]] = None,
+) -> np.ndarray:
+    """
+    Write labels of closed intervals [start, end] into column in one vectorized pass.
+
+    Without precedence a later interval overrides an earlier one, like a sequence of
+    `data.loc[(data.index >= start) & (data.index <= end), column] = label`. With
+    precedence a label which comes later in it overrides an earlier label, whatever
+    the order of intervals is.
+
+    Args:
+        column {np.ndarray}: Column to write into, changed in place.
+        starts {np.ndarray}: First rows of intervals.
+        ends {np.ndarray}: Last rows of intervals (inclusive).
+        labels {Any}: Label for all intervals or array with label for each interval.
+        precedence {Optional[Sequence[Any]]}: Labels from lowest to highest priority.
+
+    Returns:
+        np.ndarray: Column with labels.
+    """
+    length = len(column)
+    if np.ndim(labels) == 0:
+        column[cover_intervals(length, starts, ends)] = labels
+        return column
+
+    starts, ends, kept = _clip_intervals(length, starts, ends)
+    labels = np.asarray(labels, dtype=column.dtype)[kept]
+
+    if precedence is not None:
+        for label in precedence:
+            same = labels == label
+            column[cover_intervals(length, starts[same], ends[same])] = label
+        return column
+
+    if np.any(np.diff(starts) < 0) or np.any(np.diff(ends) < 0):
+        for start, end, label in zip(starts, ends, labels):
+            column[start : end + 1] = label
+        return column
+
+    rows = np.arange(length)
+    last_started = np.cumsum(np.bincount(starts, minlength=length)[:length]) - 1
+    covered = last_started >= 0
+    covered[covered] = ends[last_started[covered]] >= rows[covered]
+    column[covered] = labels[last_started[covered]]
+    return column
@@ -0,0 +1,227 @@
+"""Provides hot loops of the models, compiled when the extension is built."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    if os.environ.get("MIDAS_KERNELS", "native") == "python":
+        raise ImportError("compiled kernels are disabled")
+    from src.utils import _kernels
+except ImportError:
+    _kernels = None
+
+BACKEND = "python" if _kernels is None else "native"
+SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_kernels.c")
+
+
+def python_first_detected_laps(
+    current_means: np.ndarray, means: np.ndarray, lap_thresholds: np.ndarray
+) -> np.ndarray:
+    """
+    NumPy version of `first_detected_laps`.
+
+    Args:
+        current_means {np.ndarray}: Means of current windows, shape (candidates, laps).
+        means {np.ndarray}: Means for comparing, shape (candidates, windows).
+        lap_thresholds {np.ndarray}: Threshold of each lap.
+
+    Returns:
+        np.ndarray: First lap of each candidate, -1 if anomaly is not detected.
+    """
+    from src.models.volume_anomaly import max_pct_change_mean
+
+    detected = max_pct_change_mean(current_means, means) >= lap_thresholds
+    return np.where(detected.any(axis=1), np.argmax(detected, axis=1), -1)
+
+
+def python_trend_bounds(
+    indices_min: np.ndarray, indices_max: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    NumPy version of `trend_bounds`.
+
+    Args:
+        indices_min {np.ndarray}: Sorted indices of local min extremes.
+        indices_max {np.ndarray}: Sorted indices of local max extremes.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Starts, ends and flags of rise.
+    """
+    indices = np.concatenate([indices_min, indices_max]).astype(np.int64)
+    rising = np.r_[np.zeros(len(indices_min), bool), np.ones(len(indices_max), bool)]
+    order = np.argsort(indices, kind="stable")
+    indices, rising = indices[order], rising[order]
+    last = np.r_[indices[1:] != indices[:-1], True][: len(indices)]
+    indices, rising = indices[last], rising[last]
+    return np.r_[0, indices][:-1].astype(np.int64), indices, rising
+
+
+def python_flat_bounds(
+    values: np.ndarray,
+    indices: np.ndarray,
+    window_size_for_rolling_mean: int,
+    left_border_for_flat_detection: float,
+    right_border_for_flat_detection: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    NumPy version of `flat_bounds`.
+
+    Args:
+        values {np.ndarray}: Signal line at extremes.
+        indices {np.ndarray}: Sorted indices of extremes.
+        window_size_for_rolling_mean {int}: Window size for rolling mean.
+        left_border_for_flat_detection {float}: Left border for flat detection.
+        right_border_for_flat_detection {float}: Right border for flat detection.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Starts and ends of flat segments.
+    """
+    means = (
+        pd.Series(values)
+        .pct_change()
+        .rolling(window_size_for_rolling_mean)
+        .mean()
+        .to_numpy()
+    )
+    flat = np.flatnonzero(
+        (left_border_for_flat_detection < means)
+        & (means < right_border_for_flat_detection)
+    )
+    indices = np.asarray(indices, dtype=np.int64)
+    return indices[flat - window_size_for_rolling_mean], indices[flat]
+
+
+def python_ewm_means(
+    values: np.ndarray, spans: np.ndarray, min_periods: np.ndarray
+) -> np.ndarray:
+    """
+    pandas version of `ewm_means`.
+
+    Args:
+        values {np.ndarray}: Series.
+        spans {np.ndarray}: Decay of every mean in terms of span.
+        min_periods {np.ndarray}: Minimum number of observations of every mean.
+
+    Returns:
+        np.ndarray: Means, shape (spans, values).
+    """
+    series = pd.Series(np.asarray(values, dtype=np.float64))
+    means = np.empty((len(spans), len(series)))
+    for number, (span, periods) in enumerate(zip(spans, min_periods)):
+        means[number] = (
+            series.ewm(span=span, min_periods=int(periods), adjust=False)
+            .mean()
+            .to_numpy()
+        )
+    return means
+
+
+def first_detected_laps(
+    current_means: np.ndarray, means: np.ndarray, lap_thresholds: np.ndarray
+) -> np.ndarray:
+    """
+    First lap at which change of window mean reaches its threshold.
+
+    Same as the first lap with `max_pct_change_mean(...) >= lap_thresholds`, the
+    compiled version stops at the first detected lap of each candidate and does not
+    build arrays of changes.
+
+    Args:
+        current_means {np.ndarray}: Means of current windows, shape (candidates, laps).
+        means {np.ndarray}: Means for comparing, shape (candidates, windows).
+        lap_thresholds {np.ndarray}: Threshold of each lap.
+
+    Returns:
+        np.ndarray: First lap of each candidate, -1 if anomaly is not detected.
+    """
+    if _kernels is None:
+        return python_first_detected_laps(current_means, means, lap_thresholds)
+    return _kernels.first_detected_laps(current_means, means, lap_thresholds)
+
+
+def trend_bounds(
+    indices_min: np.ndarray, indices_max: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Rise and fall segments between local extremes.
+
+    Segment ends at an extremum and starts at the previous one (the first one at 0),
+    it rises to a max and falls to a min. An index which is both min and max is a max.
+
+    Args:
+        indices_min {np.ndarray}: Sorted indices of local min extremes.
+        indices_max {np.ndarray}: Sorted indices of local max extremes.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Starts, ends and flags of rise.
+    """
+    if _kernels is None:
+        return python_trend_bounds(indices_min, indices_max)
+    return _kernels.trend_bounds(indices_min, indices_max)
+
+
+def flat_bounds(
+    values: np.ndarray,
+    indices: np.ndarray,
+    window_size_for_rolling_mean: int,
+    left_border_for_flat_detection: float,
+    right_border_for_flat_detection: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Flat segments where rolling mean of change of signal line at extremes is small.
+
+    Segment ends at an extremum whose mean of `pct_change` over the last
+    `window_size_for_rolling_mean` extremes is between borders and starts at the
+    extremum before the window. Means are computed like pandas `rolling().mean()`.
+
+    Args:
+        values {np.ndarray}: Signal line at extremes.
+        indices {np.ndarray}: Sorted indices of extremes.
+        window_size_for_rolling_mean {int}: Window size for rolling mean.
+        left_border_for_flat_detection {float}: Left border for flat detection.
+        right_border_for_flat_detection {float}: Right border for flat detection.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Starts and ends of flat segments.
+    """
+    if _kernels is None:
+        return python_flat_bounds(
+            values,
+            indices,
+            window_size_for_rolling_mean,
+            left_border_for_flat_detection,
+            right_border_for_flat_detection,
+        )
+    return _kernels.flat_bounds(
+        values,
+        indices,
+        window_size_for_rolling_mean,
+        left_border_for_flat_detection,
+        right_border_for_flat_detection,
+    )
+
+
+def ewm_means(
+    values: np.ndarray, spans: np.ndarray, min_periods: np.ndarray
+) -> np.ndarray:
+    """
+    `Series.ewm(span=span, min_periods=periods, adjust=False).mean()` of several
+    spans.
+
+    The compiled version updates means of all spans in one pass over values with
+    the operations of pandas in the same order, so results are the same to the
+    last bit.
+
+    Args:
+        values {np.ndarray}: Series.
+        spans {np.ndarray}: Decay of every mean in terms of span.
+        min_periods {np.ndarray}: Minimum number of observations of every mean.
+
+    Returns:
+        np.ndarray: Means, shape (spans, values).
+    """
+    if _kernels is None:
+        return python_ewm_means(values, spans, min_periods)
+    return _kernels.ewm_means(values, spans, min_periods)
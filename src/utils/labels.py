@@ -0,0 +1,376 @@
+"""Provides compact trend and anomaly columns and their sparse intervals."""
+
+import json
+import os
+from typing import Iterable, Iterator, Optional, Sequence, Text
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas import DataFrame
+
+TREND_LABELS = ["null", "rise", "fall", "flat"]
+TREND_TYPE = pa.dictionary(pa.int8(), pa.string())
+INTERVALS_SUFFIX = ".intervals.feather"
+INTERVAL_COLUMNS = ["start", "end", "start_row", "end_row", "label"]
+
+
+def trend_codes(labels: Sequence) -> np.ndarray:
+    """
+    Codes of trend labels, positions in `TREND_LABELS`.
+
+    Args:
+        labels {Sequence}: Trend labels as strings or categorical.
+
+    Returns:
+        np.ndarray: Codes, int8.
+    """
+    return np.asarray(pd.Categorical(labels, categories=TREND_LABELS).codes, np.int8)
+
+
+def trend_categorical(codes: np.ndarray) -> pd.Categorical:
+    """
+    Trend column from codes.
+
+    Categories are always `TREND_LABELS`, so the column is written to Feather as
+    dictionary with int8 indices and files of all stages share the dictionary.
+
+    Args:
+        codes {np.ndarray}: Codes of trend.
+
+    Returns:
+        pd.Categorical: Trend column.
+    """
+    return pd.Categorical.from_codes(np.asarray(codes, np.int8), TREND_LABELS)
+
+
+def trend_array(codes: np.ndarray) -> pa.DictionaryArray:
+    """
+    Arrow trend column from codes.
+
+    Args:
+        codes {np.ndarray}: Codes of trend.
+
+    Returns:
+        pa.DictionaryArray: Column of `TREND_TYPE`.
+    """
+    return pa.DictionaryArray.from_arrays(
+        pa.array(np.asarray(codes, np.int8)), pa.array(TREND_LABELS)
+    )
+
+
+def column_codes(values: Sequence) -> tuple[np.ndarray, Optional[list[Text]]]:
+    """
+    Codes of trend or anomaly column.
+
+    Args:
+        values {Sequence}: Trend labels or anomaly flags.
+
+    Returns:
+        tuple[np.ndarray, Optional[list[Text]]]: Codes and trend labels, labels are
+            None for anomaly flags.
+    """
+    if pd.api.types.is_bool_dtype(values):
+        return np.asarray(values, dtype=np.int8), None
+    return trend_codes(values), TREND_LABELS
+
+
+class IntervalCollector:
+    """
+    Sparse representation of a labelled column built batch by batch.
+
+    Runs of the same code are found in every batch and runs which continue over
+    the border of batches are merged, runs of code 0 (`null` trend, no anomaly)
+    are dropped.
+    """
+
+    def __init__(self, labels: Optional[list[Text]] = None):
+        """
+        Start empty collection.
+
+        Args:
+            labels {Optional[list[Text]]}: Trend labels, None for anomaly flags.
+        """
+        self.labels = labels
+        self.rows = 0
+        self.parts = []
+
+    def add(self, dates: np.ndarray, codes: np.ndarray):
+        """
+        Add next rows.
+
+        Args:
+            dates {np.ndarray}: Dates of rows.
+            codes {np.ndarray}: Codes of rows, see `column_codes`.
+        """
+        if len(codes) == 0:
+            return
+        change = np.flatnonzero(codes[1:] != codes[:-1])
+        starts = np.r_[0, change + 1]
+        ends = np.r_[change, len(codes) - 1]
+        self.parts.append(
+            (
+                starts + self.rows,
+                ends + self.rows,
+                dates[starts],
+                dates[ends],
+                codes[starts],
+            )
+        )
+        self.rows += len(codes)
+
+    def frame(self) -> DataFrame:
+        """
+        Intervals of all added rows.
+
+        Returns:
+            DataFrame: `start` and `end` dates, `start_row` and `end_row` (both
+                inclusive) and `label` of each interval.
+        """
+        if not self.parts:
+            starts = ends = np.empty(0, dtype=np.int64)
+            first = last = np.empty(0, dtype="datetime64[ns]")
+            codes = np.empty(0, dtype=np.int8)
+        else:
+            starts, ends, first, last, codes = map(np.concatenate, zip(*self.parts))
+        merged = np.r_[True, codes[1:] != codes[:-1]][: len(codes)]
+        heads = np.flatnonzero(merged)
+        ends_of_merged = np.r_[heads[1:] - 1, len(codes) - 1][: len(heads)]
+        kept = codes[merged] != 0
+        return DataFrame(
+            {
+                "start": first[merged][kept],
+                "end": last[ends_of_merged][kept],
+                "start_row": starts[merged][kept],
+                "end_row": ends[ends_of_merged][kept],
+                "label": self._labels(codes[merged][kept]),
+            },
+            columns=INTERVAL_COLUMNS,
+        )
+
+    def _labels(self, codes: np.ndarray):
+        """
+        Labels of intervals.
+
+        Args:
+            codes {np.ndarray}: Codes of intervals.
+
+        Returns:
+            Trend categorical or anomaly flags.
+        """
+        if self.labels is None:
+            return codes.astype(bool)
+        return trend_categorical(codes)
+
+
+def intervals_path(path: Text, column: Text) -> Text:
+    """
+    Path to intervals of column saved next to the dense file.
+
+    Args:
+        path {Text}: Path to dense Feather file.
+        column {Text}: Name of column.
+
+    Returns:
+        Text: `<file without extension>.<column>.intervals.feather`.
+    """
+    return f"{os.path.splitext(path)[0]}.{column}{INTERVALS_SUFFIX}"
+
+
+def write_intervals(intervals: DataFrame, path: Text, column: Text, rows: int):
+    """
+    Write intervals of column next to the dense file.
+
+    Number of rows, size and modification time of the dense file are kept in
+    metadata, so intervals of another version of the file are not used. Dense file
+    has to be written first.
+
+    Args:
+        intervals {DataFrame}: Intervals from `IntervalCollector`.
+        path {Text}: Path to dense Feather file.
+        column {Text}: Name of column.
+        rows {int}: Number of rows of dense file.
+    """
+    from src.utils.arrow_io import write_batches
+    from src.utils.block_index import file_version
+
+    table = pa.Table.from_pandas(intervals, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {"rows": json.dumps(rows), "version": json.dumps(file_version(path))}
+    )
+    write_batches(table.to_batches(), intervals_path(path, column), table.schema)
+
+
+def read_intervals(
+    path: Text, column: Text, rows: Optional[int] = None
+) -> Optional[DataFrame]:
+    """
+    Read intervals of column saved next to the dense file.
+
+    Args:
+        path {Text}: Path to dense Feather file.
+        column {Text}: Name of column.
+        rows {Optional[int]}: Expected number of rows of dense file.
+
+    Returns:
+        Optional[DataFrame]: Intervals or None if they are missing or were written
+            for another version of the file or a file with another number of rows.
+    """
+    from src.utils.arrow_io import read_table
+    from src.utils.block_index import file_version
+
+    try:
+        table = read_table(intervals_path(path, column))
+        version = file_version(path)
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    metadata = table.schema.metadata or {}
+    if json.loads(metadata.get(b"version", b"{}")) != version:
+        return None
+    if rows is not None and json.loads(metadata.get(b"rows", b"-1")) != rows:
+        return None
+    return table.to_pandas()
+
+
+def intervals_to_column(intervals: DataFrame, rows: int):
+    """
+    Dense column from intervals.
+
+    Args:
+        intervals {DataFrame}: Intervals from `read_intervals`.
+        rows {int}: Number of rows.
+
+    Returns:
+        Trend categorical or anomaly flags.
+    """
+    from src.utils.intervals import cover_intervals, paint_intervals
+
+    starts = intervals["start_row"].to_numpy()
+    ends = intervals["end_row"].to_numpy()
+    if pd.api.types.is_bool_dtype(intervals["label"]):
+        flagged = intervals["label"].to_numpy()
+        return cover_intervals(rows, starts[flagged], ends[flagged])
+    codes = paint_intervals(
+        np.zeros(rows, dtype=np.int8), starts, ends, trend_codes(intervals["label"])
+    )
+    return trend_categorical(codes)
+
+
+def read_labels(path: Text, column: Text, rows: int):
+    """
+    Read trend or anomaly column from its intervals, from the dense file if there
+    are no intervals.
+
+    Args:
+        path {Text}: Path to dense Feather file.
+        column {Text}: Name of column.
+        rows {int}: Number of rows of dense file.
+
+    Returns:
+        Trend categorical or anomaly flags.
+    """
+    from src.utils.arrow_io import read_frame
+
+    intervals = read_intervals(path, column, rows)
+    if intervals is None:
+        return read_frame(path, columns=[column])[column].values
+    return intervals_to_column(intervals, rows)
+
+
+def label_columns(config) -> list[Text]:
+    """
+    Names of trend and anomaly columns.
+
+    Args:
+        config {EnvYAML}: Yaml file with configurations.
+
+    Returns:
+        list[Text]: Columns whose intervals are saved next to results.
+    """
+    return [
+        config["featurize"]["trend_detection"]["column_with_trend"],
+        config["featurize"]["volume_anomaly"]["column_with_anomaly"],
+    ]
+
+
+def write_result(data: DataFrame, path: Text, config):
+    """
+    Write result with compression and batch size from config and save intervals of
+    its trend and anomaly columns next to it.
+
+    Args:
+        data {DataFrame}: Result with `date` and trend and/or anomaly columns.
+        path {Text}: Path to Feather file.
+        config {EnvYAML}: Yaml file with configurations.
+    """
+    from src.utils.arrow_io import write_frame_with_config
+
+    write_frame_with_config(data, path, config)
+    dates = data["date"].to_numpy()
+    for column in label_columns(config):
+        if column not in data:
+            continue
+        codes, labels = column_codes(data[column])
+        collector = IntervalCollector(labels)
+        collector.add(dates, codes)
+        write_intervals(collector.frame(), path, column, len(data))
+
+
+def _array_codes(values: pa.Array) -> np.ndarray:
+    """
+    Codes of trend or anomaly column of record batch, missing anomaly is normal.
+
+    Args:
+        values {pa.Array}: Dictionary trend or boolean anomaly column.
+
+    Returns:
+        np.ndarray: Codes, see `column_codes`.
+    """
+    if pa.types.is_boolean(values.type):
+        return values.fill_null(False).to_numpy(zero_copy_only=False).view(np.int8)
+    return trend_codes(values.to_pandas())
+
+
+def write_result_batches(
+    batches: Iterable[pa.RecordBatch], path: Text, schema: pa.Schema, config
+):
+    """
+    Write result by record batches and save intervals of its trend and anomaly
+    columns next to it, intervals are collected on the way.
+
+    File is written under a temporary name and renamed, so an interrupted run
+    leaves the previous result in place and batches may be read from it.
+
+    Args:
+        batches {Iterable[pa.RecordBatch]}: Batches with `date` column.
+        path {Text}: Path to Feather file.
+        schema {pa.Schema}: Schema of batches.
+        config {EnvYAML}: Yaml file with configurations.
+    """
+    from src.utils.arrow_io import DEFAULT_COMPRESSION, column_to_numpy, write_batches
+
+    collectors = {
+        column: IntervalCollector(
+            None if pa.types.is_boolean(schema.field(column).type) else TREND_LABELS
+        )
+        for column in label_columns(config)
+        if column in schema.names
+    }
+
+    def collected() -> Iterator[pa.RecordBatch]:
+        for batch in batches:
+            dates = column_to_numpy(batch.column("date"))
+            for column, collector in collectors.items():
+                collector.add(dates, _array_codes(batch.column(column)))
+            yield batch
+
+    temporary = f"{path}.tmp"
+    write_batches(
+        collected(),
+        temporary,
+        schema,
+        compression=config["base"].get("io_compression", DEFAULT_COMPRESSION),
+    )
+    os.replace(temporary, path)
+    for column, collector in collectors.items():
+        write_intervals(collector.frame(), path, column, collector.rows)
@@ -24,6 +24,8 @@ def get_logger(
     name: Text = __name__, log_level: Union[Text, int] = logging.DEBUG
 ) -> logging.Logger:
     """Get logger.
+    The first logger of process also opens the span over the whole run, see
+    `src.utils.instrumentation`.
     Args:
         name {Text}: logger name
         log_level {Text or int}: logging level; can be string name or integer value
@@ -40,4 +42,7 @@ def get_logger(
     logger.addHandler(get_console_handler())
     logger.propagate = False
 
+    from src.utils.instrumentation import start_process_span
+
+    start_process_span(logger)
     return logger
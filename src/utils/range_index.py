@@ -0,0 +1,246 @@
+"""Provides prefix-sum index for range queries over volume."""
+
+from typing import Text, Union
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from src.utils.arrow_io import read_arrays
+from src.utils.exceptions import UnsortedDates
+
+NANOSECONDS_IN_MINUTE = 60 * 10**9
+
+
+def dates_to_int64(dates) -> np.ndarray:
+    """
+    Convert dates to nanoseconds since epoch.
+
+    Args:
+        dates {array-like}: Dates, DatetimeIndex or int64 timestamps.
+
+    Returns:
+        np.ndarray: Int64 timestamps in nanoseconds.
+    """
+    if isinstance(dates, pd.Timestamp):
+        return np.int64(dates.value)
+    values = np.asarray(dates)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ns]").view(np.int64)
+    if values.dtype.kind in "iu":
+        return values.astype(np.int64)
+    flat = pd.DatetimeIndex(values.ravel()).values.astype("datetime64[ns]")
+    return flat.view(np.int64).reshape(values.shape)
+
+
+class VolumeRangeIndex:
+    """
+    Cumulative sums and counts of volume over sorted timestamps.
+
+    Answers sum, count and mean of volume between two dates (both inclusive) in
+    O(log N). Queries accept scalars or arrays, arrays are broadcast against each
+    other. NaN volume is skipped like in `Series.mean`.
+    """
+
+    def __init__(self, dates, volume: np.ndarray):
+        """
+        Build index.
+
+        Args:
+            dates {array-like}: Sorted dates of rows.
+            volume {np.ndarray}: Volume of rows.
+        """
+        self.dates = dates_to_int64(dates)
+        if np.any(self.dates[1:] < self.dates[:-1]):
+            raise UnsortedDates
+        volume = np.asarray(volume, dtype=np.float64)
+        observed = ~np.isnan(volume)
+        self.cumulative_volume = np.concatenate(
+            [[0.0], np.cumsum(np.where(observed, volume, 0.0))]
+        )
+        self.cumulative_count = np.concatenate(
+            [[0], np.cumsum(observed, dtype=np.int64)]
+        )
+
+    @classmethod
+    def from_frame(
+        cls, data: DataFrame, date_column: Text = "date", column: Text = "volume"
+    ) -> "VolumeRangeIndex":
+        """
+        Build index from DataFrame, rows are sorted by date if needed.
+
+        Args:
+            data {DataFrame}: DataFrame with dates and volume.
+            date_column {Text}: Name of column with dates.
+            column {Text}: Name of column with volume.
+
+        Returns:
+            VolumeRangeIndex: Index over the DataFrame.
+        """
+        if not data[date_column].is_monotonic_increasing:
+            data = data.sort_values(date_column, kind="stable")
+        return cls(data[date_column].values, data[column].values)
+
+    @classmethod
+    def from_feather(
+        cls, path: Text, date_column: Text = "date", column: Text = "volume"
+    ) -> "VolumeRangeIndex":
+        """
+        Build index from feather file, only dates and volume are read.
+
+        Args:
+            path {Text}: Path to feather file.
+            date_column {Text}: Name of column with dates.
+            column {Text}: Name of column with volume.
+
+        Returns:
+            VolumeRangeIndex: Index over the file.
+        """
+        arrays = read_arrays(path, [date_column, column])
+        dates, volume = arrays[date_column], arrays[column]
+        if len(dates) > 1 and np.any(dates[1:] < dates[:-1]):
+            order = np.argsort(dates, kind="stable")
+            dates, volume = dates[order], volume[order]
+        return cls(dates, volume)
+
+    @classmethod
+    def from_cumulative(
+        cls,
+        dates: np.ndarray,
+        cumulative_volume: np.ndarray,
+        cumulative_count: np.ndarray,
+    ) -> "VolumeRangeIndex":
+        """
+        Wrap already built arrays of index without copying them.
+
+        Args:
+            dates {np.ndarray}: Sorted int64 timestamps of rows.
+            cumulative_volume {np.ndarray}: Volume before each row and in total.
+            cumulative_count {np.ndarray}: Number of rows with volume before each row
+                and in total.
+
+        Returns:
+            VolumeRangeIndex: Index over the arrays.
+        """
+        index = cls.__new__(cls)
+        index.dates = dates
+        index.cumulative_volume = cumulative_volume
+        index.cumulative_count = cumulative_count
+        return index
+
+    def slice(self, lo: int, hi: int) -> "VolumeRangeIndex":
+        """
+        Index over rows [lo, hi) sharing memory with this one.
+
+        Sums are taken from the same cumulative values, so they are equal to sums of
+        the whole index, positions are relative to `lo`.
+
+        Args:
+            lo {int}: Position of first row.
+            hi {int}: Position after last row.
+
+        Returns:
+            VolumeRangeIndex: Index over the rows.
+        """
+        return self.from_cumulative(
+            self.dates[lo:hi],
+            self.cumulative_volume[lo : hi + 1],
+            self.cumulative_count[lo : hi + 1],
+        )
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def bounds(self, start, end) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Positions of rows between two dates.
+
+        Args:
+            start {array-like}: First date of range.
+            end {array-like}: Last date of range (inclusive).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Positions of first row and after last row.
+        """
+        lo = np.searchsorted(self.dates, dates_to_int64(start), side="left")
+        hi = np.searchsorted(self.dates, dates_to_int64(end), side="right")
+        return lo, np.maximum(hi, lo)
+
+    def sum_between(self, lo: np.ndarray, hi: np.ndarray) -> Union[float, np.ndarray]:
+        """
+        Sum of volume in rows [lo, hi).
+
+        Args:
+            lo {np.ndarray}: Position of first row.
+            hi {np.ndarray}: Position after last row.
+
+        Returns:
+            Union[float, np.ndarray]: Sum of volume.
+        """
+        return self.cumulative_volume[hi] - self.cumulative_volume[lo]
+
+    def count_between(self, lo: np.ndarray, hi: np.ndarray) -> Union[int, np.ndarray]:
+        """
+        Number of rows with volume in rows [lo, hi).
+
+        Args:
+            lo {np.ndarray}: Position of first row.
+            hi {np.ndarray}: Position after last row.
+
+        Returns:
+            Union[int, np.ndarray]: Number of rows.
+        """
+        return self.cumulative_count[hi] - self.cumulative_count[lo]
+
+    def mean_between(self, lo: np.ndarray, hi: np.ndarray) -> Union[float, np.ndarray]:
+        """
+        Mean of volume in rows [lo, hi), NaN for empty range.
+
+        Args:
+            lo {np.ndarray}: Position of first row.
+            hi {np.ndarray}: Position after last row.
+
+        Returns:
+            Union[float, np.ndarray]: Mean of volume.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sum_between(lo, hi) / self.count_between(lo, hi)
+
+    def sum(self, start, end) -> Union[float, np.ndarray]:
+        """
+        Sum of volume between two dates.
+
+        Args:
+            start {array-like}: First date of range.
+            end {array-like}: Last date of range (inclusive).
+
+        Returns:
+            Union[float, np.ndarray]: Sum of volume.
+        """
+        return self.sum_between(*self.bounds(start, end))
+
+    def count(self, start, end) -> Union[int, np.ndarray]:
+        """
+        Number of rows with volume between two dates.
+
+        Args:
+            start {array-like}: First date of range.
+            end {array-like}: Last date of range (inclusive).
+
+        Returns:
+            Union[int, np.ndarray]: Number of rows.
+        """
+        return self.count_between(*self.bounds(start, end))
+
+    def mean(self, start, end) -> Union[float, np.ndarray]:
+        """
+        Mean of volume between two dates, NaN for empty range.
+
+        Args:
+            start {array-like}: First date of range.
+            end {array-like}: Last date of range (inclusive).
+
+        Returns:
+            Union[float, np.ndarray]: Mean of volume.
+        """
+        return self.mean_between(*self.bounds(start, end))
@@ -0,0 +1,71 @@
+"""Provides NumPy arrays in shared memory for worker processes."""
+
+from multiprocessing import shared_memory
+from typing import Text
+
+import numpy as np
+
+ArraySpec = tuple[Text, tuple[int, ...], Text]
+
+
+class SharedArrays:
+    """
+    Copies of NumPy arrays placed in shared memory blocks.
+
+    Workers get only `specs` (names, shapes and dtypes of blocks) and attach to the
+    same memory with `attach_arrays` instead of receiving pickled arrays. Blocks are
+    released when the owner leaves the context.
+    """
+
+    def __init__(self, arrays: dict[Text, np.ndarray]):
+        """
+        Copy arrays to shared memory.
+
+        Args:
+            arrays {dict[Text, np.ndarray]}: Arrays by name.
+        """
+        self.blocks: list[shared_memory.SharedMemory] = []
+        self.specs: dict[Text, ArraySpec] = {}
+        self.arrays: dict[Text, np.ndarray] = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            self.blocks.append(block)
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[...] = array
+            self.arrays[name] = shared
+            self.specs[name] = (block.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """Release shared memory blocks."""
+        self.arrays.clear()
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks.clear()
+
+    def __enter__(self) -> "SharedArrays":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def attach_arrays(
+    specs: dict[Text, ArraySpec],
+) -> tuple[dict[Text, np.ndarray], list[shared_memory.SharedMemory]]:
+    """
+    Attach to arrays created by `SharedArrays` in another process.
+
+    Args:
+        specs {dict[Text, ArraySpec]}: Names, shapes and dtypes of blocks.
+
+    Returns:
+        tuple: Arrays by name and blocks, which must be closed after use.
+    """
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return arrays, blocks
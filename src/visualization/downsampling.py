@@ -0,0 +1,225 @@
+"""Provides downsampling of long series for figures a few thousand pixels wide."""
+
+from typing import Optional, Sequence
+
+import numpy as np
+from matplotlib import rcParams
+
+METHODS = ["lttb", "minmax", "none"]
+
+
+def pixel_width(plot_size: Sequence[float], dpi: Optional[float] = None) -> int:
+    """
+    Width of figure in pixels.
+
+    Args:
+        plot_size {Sequence[float]}: Width and height of figure in inches.
+        dpi {Optional[float]}: Dots per inch, `figure.dpi` of matplotlib if not set.
+
+    Returns:
+        int: Number of pixels.
+    """
+    return int(plot_size[0] * (dpi or rcParams["figure.dpi"]))
+
+
+def find_breaks(values: np.ndarray, labels: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Find rows where label changes or value becomes missing or present.
+
+    Args:
+        values {np.ndarray}: Values of series.
+        labels {Optional[np.ndarray]}: Label of each row, e.g. trend.
+
+    Returns:
+        np.ndarray: Mask of length `len(values) - 1`, True between rows i and i + 1
+            which belong to different runs.
+    """
+    missing = np.isnan(values)
+    breaks = missing[1:] != missing[:-1]
+    if labels is not None:
+        breaks |= labels[1:] != labels[:-1]
+    return breaks
+
+
+def minmax_indices(
+    values: np.ndarray, buckets: int, breaks: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Rows to draw with per-pixel min/max decimation.
+
+    Rows are split into `buckets` groups of neighbouring rows, a group is also split
+    at every break. First, last, smallest and largest values of each group are
+    kept, so the drawn line covers the same pixels and both sides of every break
+    are kept exactly.
+
+    Args:
+        values {np.ndarray}: Values of series.
+        buckets {int}: Number of groups, usually width of axes in pixels.
+        breaks {Optional[np.ndarray]}: Breaks between rows from `find_breaks`.
+
+    Returns:
+        np.ndarray: Sorted positions of kept rows.
+    """
+    length = len(values)
+    if length <= 4 * buckets:
+        return np.arange(length)
+
+    bucket = np.arange(length) * buckets // length
+    change = np.empty(length, dtype=bool)
+    change[0] = True
+    change[1:] = bucket[1:] != bucket[:-1]
+    if breaks is not None:
+        change[1:] |= breaks
+    starts = np.flatnonzero(change)
+    group = np.cumsum(change) - 1
+
+    keep = change.copy()
+    keep[np.r_[starts[1:], length] - 1] = True
+    with np.errstate(invalid="ignore"):
+        for reduce in (np.fmin, np.fmax):
+            extreme = np.flatnonzero(values == reduce.reduceat(values, starts)[group])
+            first = np.ones(len(extreme), dtype=bool)
+            first[1:] = group[extreme[1:]] != group[extreme[:-1]]
+            keep[extreme[first]] = True
+    return np.flatnonzero(keep)
+
+
+def lttb_indices(values: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Rows to draw with largest-triangle-three-buckets.
+
+    The first and the last rows are kept, from each of `threshold - 2` buckets
+    between them the row which makes the largest triangle with the previous kept
+    row and the mean of the next bucket is kept.
+
+    Args:
+        values {np.ndarray}: Values of series without missing values.
+        threshold {int}: Number of rows to keep.
+
+    Returns:
+        np.ndarray: Sorted positions of kept rows.
+    """
+    length = len(values)
+    if threshold >= length:
+        return np.arange(length)
+    if threshold < 3:
+        return np.array([0, length - 1])
+
+    every = (length - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = length - 1
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = length - 1
+    previous = 0
+    for number in range(threshold - 2):
+        start, stop = edges[number], edges[number + 1]
+        if number + 2 < len(edges):
+            next_start, next_stop = stop, edges[number + 2]
+        else:
+            next_start, next_stop = length - 1, length
+        next_x = (next_start + next_stop - 1) / 2
+        next_y = values[next_start:next_stop].mean()
+        x = np.arange(start, stop)
+        area = np.abs(
+            (previous - next_x) * (values[start:stop] - values[previous])
+            - (previous - x) * (next_y - values[previous])
+        )
+        previous = start + int(np.argmax(area))
+        indices[number + 1] = previous
+    return indices
+
+
+def lttb_run_indices(
+    values: np.ndarray, threshold: int, breaks: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Rows to draw with largest-triangle-three-buckets applied to each run.
+
+    Series is split at breaks, every run gets a share of `threshold` proportional
+    to its length and keeps its first and last rows. Runs of missing values keep
+    only their ends.
+
+    Args:
+        values {np.ndarray}: Values of series.
+        threshold {int}: Number of rows to keep.
+        breaks {Optional[np.ndarray]}: Breaks between rows from `find_breaks`.
+
+    Returns:
+        np.ndarray: Sorted positions of kept rows.
+    """
+    length = len(values)
+    if length <= threshold:
+        return np.arange(length)
+    if breaks is None:
+        breaks = find_breaks(values)
+    starts = np.r_[0, np.flatnonzero(breaks) + 1]
+    stops = np.r_[starts[1:], length]
+
+    indices = []
+    for start, stop in zip(starts, stops):
+        if np.isnan(values[start]):
+            indices.append(np.unique([start, stop - 1]))
+            continue
+        share = max(2, int(round(threshold * (stop - start) / length)))
+        indices.append(start + lttb_indices(values[start:stop], share))
+    return np.concatenate(indices)
+
+
+def downsample_line(
+    values: np.ndarray,
+    width: int,
+    labels: Optional[np.ndarray] = None,
+    method: str = "minmax",
+) -> np.ndarray:
+    """
+    Rows to draw for line which is `width` pixels wide.
+
+    Args:
+        values {np.ndarray}: Values of series.
+        width {int}: Width of figure in pixels.
+        labels {Optional[np.ndarray]}: Label of each row, both sides of every label
+            change are kept.
+        method {str}: "lttb", "minmax" or "none".
+
+    Returns:
+        np.ndarray: Sorted positions of kept rows.
+    """
+    if method == "none":
+        return np.arange(len(values))
+    breaks = find_breaks(values, labels)
+    if method == "lttb":
+        return lttb_run_indices(values, 2 * width, breaks)
+    return minmax_indices(values, width, breaks)
+
+
+def downsample_bars(
+    heights: np.ndarray, flags: np.ndarray, width: int, method: str = "minmax"
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merge neighbouring bars which fall into the same pixel.
+
+    Bars are merged only inside runs of the same flag, so spans of flagged bars are
+    kept exactly. A merged bar is as high as the highest of its bars.
+
+    Args:
+        heights {np.ndarray}: Heights of bars.
+        flags {np.ndarray}: Flag of each bar, e.g. anomaly.
+        width {int}: Width of figure in pixels.
+        method {str}: "none" to keep all bars, bars are merged otherwise.
+
+    Returns:
+        tuple[np.ndarray]: First and last positions, heights and flags of bars.
+    """
+    length = len(heights)
+    positions = np.arange(length)
+    if method == "none" or length <= width:
+        return positions, positions, heights, flags
+
+    bucket = positions * width // length
+    change = np.empty(length, dtype=bool)
+    change[0] = True
+    change[1:] = (bucket[1:] != bucket[:-1]) | (flags[1:] != flags[:-1])
+    starts = np.flatnonzero(change)
+    stops = np.r_[starts[1:], length] - 1
+    return starts, stops, np.fmax.reduceat(heights, starts), flags[starts]
@@ -3,97 +3,141 @@ import sys
 import warnings
 from typing import Text
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 from envyaml import EnvYAML
+from pandas import DataFrame
 
 warnings.filterwarnings("ignore")
 
+TRENDS = ["fall", "rise", "flat"]
 
-def plot_stock_with_trends(config_path: Text):
+
+def render_trend_figure(
+    path: Text,
+    x: np.ndarray,
+    lines: list[tuple[np.ndarray, Text, Text]],
+    ticks: np.ndarray,
+    tick_labels: list[Text],
+    plot_size: list[float],
+) -> Text:
     """
-    Detection of trend of stock market price.
+    Draw price of one interval with trends and save png file.
 
     Args:
-        config_path {Text}: path to config
+        path {Text}: Path to png file.
+        x {np.ndarray}: Positions of rows.
+        lines {list[tuple[np.ndarray, Text, Text]]}: Price masked by trend, its color
+            and label.
+        ticks {np.ndarray}: Positions of x ticks.
+        tick_labels {list[Text]}: Dates of x ticks.
+        plot_size {list[float]}: Width and height of figure in inches.
+
+    Returns:
+        Text: Path to png file.
     """
-    config = EnvYAML(config_path)
-    sys.path.append(config["base"]["project_path"])
+    from src.visualization.rendering import new_figure, save_figure
+
+    figure = new_figure(plot_size)
+    axes = figure.axes[0]
+    for values, color, label in lines:
+        axes.plot(x, values, color=color, label=label)
+    axes.set_xticks(ticks)
+    axes.set_xticklabels(tick_labels, rotation=45)
+    axes.set_xlabel("Dates")
+    axes.set_ylabel("Price")
+    axes.set_title("BTC price with trend definition")
+    axes.legend()
+    return save_figure(figure, path)
+
+
+def render_trend_plots(data: DataFrame, config: EnvYAML):
+    """
+    Plot price with trends by intervals and save png files.
+
+    Price is masked by each trend once for all intervals. Intervals longer than
+    figure width in pixels are downsampled with `downsampling` method keeping the
+    borders of trends exact. Figures are drawn in `base.workers` processes.
+
+    Args:
+        data {DataFrame}: Data with trend and anomaly.
+        config {EnvYAML}: Yaml file with configurations.
+    """
+    from src.utils.labels import TREND_LABELS, trend_codes
     from src.utils.logger import get_logger
+    from src.visualization.downsampling import downsample_line, pixel_width
+    from src.visualization.rendering import make_intervals, make_ticks, render_all
 
     logger = get_logger("PLOT_TREND", log_level=config["base"]["log_level"])
-    logger.info("Read data")
-    data = pd.read_feather(config["data"]["result_with_trend_and_anomaly"])
-    data.reset_index(inplace=True)
     column_with_value = config["featurize"]["trend_detection"]["column_for_macd"]
     column_with_trend = config["featurize"]["trend_detection"]["column_with_trend"]
     logger.info(f"Column with trend {column_with_trend}")
     logger.info(f"Column with values {column_with_value}")
 
-    logger.info("Making copy for each trend")
-    data_fall = data.copy()
-    data_rise = data.copy()
-    data_flat = data.copy()
-    data_fall.loc[data_fall[column_with_trend] != "fall", column_with_value] = np.nan
-    data_rise.loc[data_rise[column_with_trend] != "rise", column_with_value] = np.nan
-    data_flat.loc[data_flat[column_with_trend] != "flat", column_with_value] = np.nan
-    len_of_indices = len(data.index)
-    divider = config["reports"]["trend_detection"]["step"]
-    step = len_of_indices // divider
-    logger.info(f"Step of intervals: {step}")
-
-    intervals = [(i, i + step) for i in range(0, len_of_indices - step, step)]
+    logger.info("Masking price by trends")
+    values = data[column_with_value].to_numpy(dtype=np.float64)
+    trend = trend_codes(data[column_with_trend])
+    masked = [
+        np.where(trend == TREND_LABELS.index(label), values, np.nan) for label in TRENDS
+    ]
+
+    params = config["reports"]["trend_detection"]
+    intervals = make_intervals(len(data), params["step"])
     logger.info(f"Number of intervals {len(intervals)}")
-    main_path = config["reports"]["trend_detection"]["path_to_trend_png"]
-    colors = config["reports"]["trend_detection"]["colors"]
+    colors = params["colors"]
     logger.info(f"Will use next colors: {colors}")
-    labels = config["reports"]["trend_detection"]["labels"]
+    labels = params["labels"]
     logger.info(f"Will use next labels: {labels}")
-    number_of_xticks = config["reports"]["trend_detection"]["number_of_xticks"] 
+    number_of_xticks = params["number_of_xticks"]
     logger.info(f"Number of xticks: {number_of_xticks}")
-    all_dates = data["date"]
-    step_for_dates = step // number_of_xticks
-    logger.info(f"Step for dates: {step_for_dates}")
-    plot_size = config["reports"]["trend_detection"]["plot_size"]  
-    for number, period in enumerate(intervals):
-        plt.figure(figsize=(plot_size[0], plot_size[1]))
-        plt.plot(
-            data_fall.loc[
-                (data_fall.index >= period[0]) & (data_fall.index <= period[1]),
-                column_with_value,
-            ],
-            color=colors[0],
-            label=labels[0],
-        )
-        plt.plot(
-            data_rise.loc[
-                (data_rise.index >= period[0]) & (data_rise.index <= period[1]),
-                column_with_value,
-            ],
-            color=colors[1],
-            label=labels[1],
+    method = params.get("downsampling", "minmax")
+    width = pixel_width(params["plot_size"])
+    logger.info(f"Downsampling: {method} to {width} pixels")
+    dates = data["date"].to_numpy()
+
+    jobs = []
+    for number, (start, stop) in enumerate(intervals):
+        ticks, tick_labels = make_ticks(dates, start, stop - start, number_of_xticks)
+        rows = start + downsample_line(
+            values[start : stop + 1], width, trend[start : stop + 1], method
         )
-        plt.plot(
-            data_flat.loc[
-                (data_flat.index >= period[0]) & (data_flat.index <= period[1]),
-                column_with_value,
-            ],
-            color=colors[2],
-            label=labels[2],
+        jobs.append(
+            dict(
+                path=params["path_to_trend_png"] + f"trend_{number}.png",
+                x=rows,
+                lines=[
+                    (line[rows], color, label)
+                    for line, color, label in zip(masked, colors, labels)
+                ],
+                ticks=ticks,
+                tick_labels=tick_labels,
+                plot_size=params["plot_size"],
+            )
         )
-        dates = [all_dates[i+period[0]] for i in range(0, step, step_for_dates)]
-        indeces = [i+period[0] for i in range(0, step, step_for_dates)]
-        plt.xticks(indeces, dates, rotation = 45)
-        plt.xlabel("Dates")
-        plt.ylabel("Price")
-        plt.title("BTC price with trend definition")
-        plt.legend()
-        path = main_path + f"trend_{number}.png"
-        logger.info(f"Path for {number} photo")
-        plt.savefig(path)
-        plt.close()
-        logger.info(f"Photo {number} saved")
+    render_all(render_trend_figure, jobs, config["base"].get("workers", 1), logger)
+
+
+def plot_stock_with_trends(config_path: Text):
+    """
+    Detection of trend of stock market price.
+
+    Args:
+        config_path {Text}: path to config
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import read_frame
+    from src.utils.labels import read_labels
+    from src.utils.logger import get_logger
+
+    logger = get_logger("PLOT_TREND", log_level=config["base"]["log_level"])
+    logger.info("Read data")
+    params = config["featurize"]["trend_detection"]
+    path = config["data"]["result_with_trend_and_anomaly"]
+    data = read_frame(path, columns=["date", params["column_for_macd"]])
+    data[params["column_with_trend"]] = read_labels(
+        path, params["column_with_trend"], len(data)
+    )
+    render_trend_plots(data, config)
 
 
 if __name__ == "__main__":
@@ -3,73 +3,164 @@ import sys
 import warnings
 from typing import Text
 
-import matplotlib.pyplot as plt
-import pandas as pd
+import numpy as np
 from envyaml import EnvYAML
+from pandas import DataFrame
 
 warnings.filterwarnings("ignore")
 
+DEFAULT_PLOT_SIZE = [6.4, 4.8]
 
-def plot_volume_with_anomaly(config_path: Text):
+
+def render_volume_figure(
+    path: Text,
+    first: np.ndarray,
+    last: np.ndarray,
+    volume: np.ndarray,
+    anomaly: np.ndarray,
+    colors: list[Text],
+    width_of_bar: float,
+    ticks: np.ndarray,
+    tick_labels: list[Text],
+    plot_size: list[float],
+) -> Text:
     """
-    Plot volume with anomaly.
+    Draw volume bars of one interval and save png file.
+
+    Bars are drawn as one collection of rectangles instead of a patch per bar, thin
+    edges keep bars narrower than a pixel visible.
 
     Args:
-        config_path {Text}: path to config
+        path {Text}: Path to png file.
+        first {np.ndarray}: Positions of first rows of bars.
+        last {np.ndarray}: Positions of last rows of bars.
+        volume {np.ndarray}: Volume of bars.
+        anomaly {np.ndarray}: Anomaly flags of bars.
+        colors {list[Text]}: Colors of anomaly and normal bars.
+        width_of_bar {float}: Width of bar.
+        ticks {np.ndarray}: Positions of x ticks.
+        tick_labels {list[Text]}: Dates of x ticks.
+        plot_size {list[float]}: Width and height of figure in inches.
+
+    Returns:
+        Text: Path to png file.
+    """
+    from matplotlib.collections import PolyCollection
+    from matplotlib.colors import to_rgba
+
+    from src.visualization.rendering import new_figure, save_figure
+
+    figure = new_figure(plot_size)
+    axes = figure.axes[0]
+    left = first - width_of_bar / 2
+    right = last + width_of_bar / 2
+    height = np.nan_to_num(volume)
+    bottom = np.zeros_like(height)
+    bars = np.stack(
+        [
+            np.column_stack([left, bottom]),
+            np.column_stack([left, height]),
+            np.column_stack([right, height]),
+            np.column_stack([right, bottom]),
+        ],
+        axis=1,
+    )
+    face_colors = np.where(anomaly[:, None], to_rgba(colors[0]), to_rgba(colors[1]))
+    axes.add_collection(
+        PolyCollection(
+            bars, facecolors=face_colors, edgecolors=face_colors, linewidths=0.5
+        )
+    )
+    axes.autoscale_view()
+    axes.set_ylim(bottom=min(0, height.min(initial=0)))
+    axes.set_xticks(ticks)
+    axes.set_xticklabels(tick_labels, rotation=45)
+    axes.set_xlabel("Dates")
+    axes.set_ylabel("Volume")
+    axes.set_title("BTC volume with anomaly")
+    return save_figure(figure, path)
+
+
+def render_volume_plots(data: DataFrame, config: EnvYAML):
+    """
+    Plot volume with anomaly by intervals and save png files.
+
+    Bars of anomaly rows get the first color, other bars the second one. Bars of
+    intervals longer than figure width in pixels are merged by pixels with the
+    highest volume kept, spans of anomalies stay exact. Figures are drawn in
+    `base.workers` processes.
+
+    Args:
+        data {DataFrame}: Data with trend and anomaly.
+        config {EnvYAML}: Yaml file with configurations.
     """
-    config = EnvYAML(config_path)
-    sys.path.append(config["base"]["project_path"])
     from src.utils.logger import get_logger
+    from src.visualization.downsampling import downsample_bars, pixel_width
+    from src.visualization.rendering import make_intervals, make_ticks, render_all
 
     logger = get_logger("PLOT_VOLUME_ANOMALY", log_level=config["base"]["log_level"])
-    logger.info("Read data")
-    data = pd.read_feather(config["data"]["result_with_trend_and_anomaly"])
-    data.reset_index(inplace=True)
     column_with_anomaly = config["featurize"]["volume_anomaly"]["column_with_anomaly"]
 
-    width_of_bar = config["reports"]["volume_anomaly"]["width_of_bar"]
+    params = config["reports"]["volume_anomaly"]
+    width_of_bar = params["width_of_bar"]
     logger.info(f"Width of bar: {width_of_bar}")
-    len_of_indices = len(data.index)
-    divider = config["reports"]["volume_anomaly"]["step"]
-    step = len_of_indices // divider
-
-    logger.info(f"Step of intervals: {step}")
-    intervals = [(i, i + step) for i in range(0, len_of_indices - step, step)]
+    intervals = make_intervals(len(data), params["step"])
     logger.info(f"Number of intervals {len(intervals)}")
-
-    main_path = config["reports"]["volume_anomaly"]["path_to_volume_png"]
-    colors = config["reports"]["volume_anomaly"]["colors"]
+    colors = list(params["colors"])
     logger.info(f"Will use next colors: {colors}")
-    number_of_xticks = config["reports"]["volume_anomaly"]["number_of_xticks"] 
+    number_of_xticks = params["number_of_xticks"]
     logger.info(f"Number of xticks: {number_of_xticks}")
-    all_dates = data["date"]
-    step_for_dates = step // number_of_xticks
-    logger.info("Creating list with colors")
-    for _, row in data.iterrows():
-        if row[column_with_anomaly]:
-            colors.append(colors[0])
-        else:
-            colors.append(colors[1])
-    for number, period in enumerate(intervals[1:2]):
-        plt.bar(
-            data.index[period[0] : period[1]],
-            data[column_with_anomaly][period[0] : period[1]],
-            width=width_of_bar,
-            color=colors,
+
+    plot_size = params.get("plot_size", DEFAULT_PLOT_SIZE)
+    method = params.get("downsampling", "minmax")
+    width = pixel_width(plot_size)
+    logger.info(f"Downsampling: {method} to {width} pixels")
+    volume = data["volume"].to_numpy(dtype=np.float64)
+    anomaly = data[column_with_anomaly].to_numpy(dtype=bool)
+    dates = data["date"].to_numpy()
+    jobs = []
+    for number, (start, stop) in enumerate(intervals):
+        ticks, tick_labels = make_ticks(dates, start, stop - start, number_of_xticks)
+        first, last, heights, flags = downsample_bars(
+            volume[start:stop], anomaly[start:stop], width, method
+        )
+        jobs.append(
+            dict(
+                path=params["path_to_volume_png"] + f"volume_{number}.png",
+                first=start + first,
+                last=start + last,
+                volume=heights,
+                anomaly=flags,
+                colors=colors,
+                width_of_bar=width_of_bar,
+                ticks=ticks,
+                tick_labels=tick_labels,
+                plot_size=plot_size,
+            )
         )
-        dates = [data.loc[data.index == i, "date"].values[0] for i in range(period[0], period[1], step_for_dates)]
-        indeces = [i for i in range(period[0], period[1], step_for_dates)]
-        dates = [all_dates[i+period[0]] for i in range(0, step, step_for_dates)]
-        indeces = [i+period[0] for i in range(0, step, step_for_dates)]
-        plt.xticks(indeces, dates, rotation = 45)
-        plt.xlabel("Dates")
-        plt.ylabel("Volume")
-        plt.title("BTC volume with anomaly")
-        path = main_path + f"volume_{number}.png"
-        logger.info(f"Path for {number} photo")
-        plt.savefig(path)
-        plt.close()
-        logger.info(f"Photo {number} saved")
+    render_all(render_volume_figure, jobs, config["base"].get("workers", 1), logger)
+
+
+def plot_volume_with_anomaly(config_path: Text):
+    """
+    Plot volume with anomaly.
+
+    Args:
+        config_path {Text}: path to config
+    """
+    config = EnvYAML(config_path)
+    sys.path.append(config["base"]["project_path"])
+    from src.utils.arrow_io import read_frame
+    from src.utils.labels import read_labels
+    from src.utils.logger import get_logger
+
+    logger = get_logger("PLOT_VOLUME_ANOMALY", log_level=config["base"]["log_level"])
+    logger.info("Read data")
+    column_with_anomaly = config["featurize"]["volume_anomaly"]["column_with_anomaly"]
+    path = config["data"]["result_with_trend_and_anomaly"]
+    data = read_frame(path, columns=["date", "volume"])
+    data[column_with_anomaly] = read_labels(path, column_with_anomaly, len(data))
+    render_volume_plots(data, config)
 
 
 if __name__ == "__main__":
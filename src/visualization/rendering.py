@@ -0,0 +1,100 @@
+"""Provides helpers to render report figures with Agg in parallel processes."""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Sequence, Text
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+PNG_COMPRESS_LEVEL = 1
+
+
+def make_intervals(length: int, divider: int) -> list[tuple[int, int]]:
+    """
+    Split rows into intervals of `length // divider` rows, one interval per figure.
+
+    Args:
+        length {int}: Number of rows.
+        divider {int}: Number of parts.
+
+    Returns:
+        list[tuple[int, int]]: First row and row after the last one of intervals.
+    """
+    step = length // divider
+    if step == 0:
+        return []
+    return [(start, start + step) for start in range(0, length - step, step)]
+
+
+def make_ticks(
+    dates: np.ndarray, start: int, step: int, number_of_xticks: int
+) -> tuple[np.ndarray, list[Text]]:
+    """
+    Positions and date labels of x ticks of interval.
+
+    Args:
+        dates {np.ndarray}: Dates of all rows.
+        start {int}: First row of interval.
+        step {int}: Number of rows in interval.
+        number_of_xticks {int}: Number of ticks.
+
+    Returns:
+        tuple[np.ndarray, list[Text]]: Positions of ticks and dates for them.
+    """
+    positions = start + np.arange(0, step, max(step // number_of_xticks, 1))
+    return positions, list(pd.DatetimeIndex(dates[positions]).astype(str))
+
+
+def new_figure(plot_size: Sequence[float]) -> Figure:
+    """
+    Create figure drawn by Agg without pyplot global state.
+
+    Args:
+        plot_size {Sequence[float]}: Width and height in inches.
+
+    Returns:
+        Figure: Empty figure with one axes.
+    """
+    figure = Figure(figsize=(plot_size[0], plot_size[1]))
+    FigureCanvasAgg(figure)
+    figure.add_subplot()
+    return figure
+
+
+def save_figure(figure: Figure, path: Text) -> Text:
+    """
+    Save figure to png file with fast compression.
+
+    Args:
+        figure {Figure}: Figure to save.
+        path {Text}: Path to png file.
+
+    Returns:
+        Text: Path to png file.
+    """
+    figure.savefig(path, pil_kwargs={"compress_level": PNG_COMPRESS_LEVEL})
+    return path
+
+
+def render_all(render: Callable, jobs: list[dict], workers: int, logger):
+    """
+    Render figures one by one or in worker processes.
+
+    Args:
+        render {Callable}: Module level function which saves one figure and returns
+            its path.
+        jobs {list[dict]}: Keyword arguments of each call.
+        workers {int}: Number of worker processes.
+        logger {logging.Logger}: Logger for saved paths.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            logger.info(f"Photo {render(**job)} saved")
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        futures = [executor.submit(render, **job) for job in jobs]
+        for future in futures:
+            logger.info(f"Photo {future.result()} saved")
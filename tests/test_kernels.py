@@ -0,0 +1,76 @@
+"""Tests that compiled kernels give the same output as NumPy ones."""
+
+import importlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_PATH)
+sys.path.append(os.path.join(PROJECT_PATH, "benchmarks"))
+
+from check_kernels import random_cases, realistic_cases, same  # noqa: E402
+
+from src.utils import kernels  # noqa: E402
+
+_kernels = pytest.importorskip(
+    "src.utils._kernels", reason="compiled kernels are not built, run `python build.py`"
+)
+
+KERNELS = ["first_detected_laps", "trend_bounds", "flat_bounds", "ewm_means"]
+ROWS = 100000
+CASES = 200
+
+
+@pytest.fixture(scope="module")
+def random():
+    return random_cases(0, CASES)
+
+
+@pytest.fixture(scope="module")
+def realistic():
+    return realistic_cases(ROWS, 0)
+
+
+@pytest.mark.parametrize("name", KERNELS)
+def test_random_cases(name, random):
+    python = getattr(kernels, f"python_{name}")
+    native = getattr(_kernels, name)
+    for number, arguments in enumerate(random[name]):
+        assert same(python(*arguments), native(*arguments)), f"case {number}"
+
+
+@pytest.mark.parametrize("name", KERNELS)
+def test_realistic_case(name, realistic):
+    python = getattr(kernels, f"python_{name}")
+    native = getattr(_kernels, name)
+    assert same(python(*realistic[name]), native(*realistic[name]))
+
+
+@pytest.mark.parametrize("name", KERNELS)
+def test_forced_python_backend(name, realistic, monkeypatch):
+    native = getattr(kernels, name)(*realistic[name])
+    monkeypatch.setenv("MIDAS_KERNELS", "python")
+    try:
+        forced = importlib.reload(kernels)
+        assert forced.BACKEND == "python"
+        assert same(getattr(forced, name)(*realistic[name]), native)
+    finally:
+        monkeypatch.delenv("MIDAS_KERNELS")
+        importlib.reload(kernels)
+
+
+def test_empty_inputs():
+    empty = np.empty(0, dtype=np.int64)
+    assert same(
+        kernels.python_trend_bounds(empty, empty), _kernels.trend_bounds(empty, empty)
+    )
+    values = np.empty(0, dtype=np.float64)
+    arguments = (values, np.array([12.0, 26.0]), np.array([12, 26]))
+    assert same(kernels.python_ewm_means(*arguments), _kernels.ewm_means(*arguments))
+    arguments = (values, empty, 150, -0.0007, 0.0007)
+    assert same(
+        kernels.python_flat_bounds(*arguments), _kernels.flat_bounds(*arguments)
+    )